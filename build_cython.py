@@ -0,0 +1,28 @@
+'''
+Description: build script for the nbody_cython extension module
+Usage: python build_cython.py build_ext --inplace
+
+The extension is compiled with OpenMP so the prange loops of nbody_cython.pyx
+run on all cores. Set NBODY_NO_OPENMP=1 to build it single-threaded, e.g.
+with compilers that lack OpenMP support.
+'''
+
+import os
+import sys
+
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+if os.environ.get('NBODY_NO_OPENMP') == '1':
+    compile_args = link_args = []
+elif sys.platform == 'win32':
+    compile_args, link_args = ['/openmp', '/O2'], []
+else:
+    compile_args, link_args = ['-fopenmp', '-O3'], ['-fopenmp']
+
+extension = Extension('nbody_cython', ['nbody_cython.pyx'],
+                      extra_compile_args=compile_args,
+                      extra_link_args=link_args)
+
+setup(name='nbody_cython',
+      ext_modules=cythonize([extension], language_level=3))
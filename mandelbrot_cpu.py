@@ -0,0 +1,105 @@
+'''
+Description: A CPU version to calculate the Mandelbrot set
+Usage: python mandelbrot_cpu.py
+
+compute_mandel has the signature of the CUDA kernels in mandelbrot_gpu.py
+and mandelbrot_shared.py, but is called directly instead of with a launch
+configuration:
+
+    compute_mandel(-2.0, 1.0, -1.0, 1.0, image, 20)
+
+With numba installed it runs an escape-time kernel compiled with
+parallel=True, the rows of the image spread over all cores. Without numba
+a vectorized NumPy version is used: every iteration advances only the
+points that have not escaped yet, the escaped ones are dropped from the
+working arrays.
+
+Both evaluate z*z + c exactly like the complex product of the mandel
+device function, (zr*zr - zi*zi, zr*zi + zi*zr), in IEEE double without
+fused multiply-adds, so the image is pixel-identical to mandel() for every
+pixel.
+'''
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+
+def compute_mandel_numpy(min_x, max_x, min_y, max_y, image, iters):
+    '''
+    NumPy version, compacts the still active points every iteration
+    '''
+    height, width = image.shape
+    pixel_size_x = (max_x - min_x) / width
+    pixel_size_y = (max_y - min_y) / height
+
+    # pixel coordinates computed as min + index * size, like the kernels
+    real = min_x + np.arange(width) * pixel_size_x
+    imag = min_y + np.arange(height) * pixel_size_y
+    cr = np.broadcast_to(real[None, :], (height, width)).ravel()
+    ci = np.broadcast_to(imag[:, None], (height, width)).ravel()
+
+    result = np.full(height * width, iters, dtype=np.int64)
+    active = np.arange(height * width)
+    zr = np.zeros(height * width)
+    zi = np.zeros(height * width)
+    for i in range(iters):
+        zr, zi = zr * zr - zi * zi + cr, zr * zi + zi * zr + ci
+        escaped = zr * zr + zi * zi >= 4
+        if escaped.any():
+            result[active[escaped]] = i
+            keep = ~escaped
+            active, zr, zi, cr, ci = active[keep], zr[keep], zi[keep], cr[keep], ci[keep]
+            if not active.size:
+                break
+    image[...] = result.reshape(height, width).astype(image.dtype, copy=False)
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def mandel(x, y, max_iters):
+        '''
+        Given the real and imaginary parts of a complex number,
+        determine if it is a candidate for membership in the
+        Mandelbrot set given a fixed number of iterations.
+        '''
+        c = complex(x, y)
+        z = 0.0j
+        for i in range(max_iters):
+            z = z*z + c
+            if (z.real*z.real + z.imag*z.imag) >= 4:
+                return i
+
+        return max_iters
+
+    @njit(parallel=True, cache=True)
+    def compute_mandel_numba(min_x, max_x, min_y, max_y, image, iters):
+        '''
+        Numba version, one row of the image per parallel iteration
+        '''
+        height, width = image.shape
+        pixel_size_x = (max_x - min_x) / width
+        pixel_size_y = (max_y - min_y) / height
+
+        for y in prange(height):
+            imag = min_y + y * pixel_size_y
+            for x in range(width):
+                real = min_x + x * pixel_size_x
+                image[y, x] = mandel(real, imag, iters)
+
+    compute_mandel = compute_mandel_numba
+else:
+    compute_mandel = compute_mandel_numpy
+
+
+if __name__ == '__main__':
+    from pylab import imshow, show
+
+    image = np.zeros((1024, 1536), dtype = np.uint8)
+    compute_mandel(-2.0, 1.0, -1.0, 1.0, image, 20)
+    imshow(image)
+    show()
@@ -0,0 +1,267 @@
+"""
+    N-body simulation.
+
+    Version: Pluggable backend registry with a single nbody entry point
+
+    The pure Python (nbody_opt), numpy (nbody_numpy), Numba (nbody_numba)
+    and Cython (nbody_cython) engines are registered here under one state
+    format, the (r, v, m) arrays of nbody_numpy. Every backend provides
+
+        advance(iterations, r, v, m, dt)   - kick then drift, in place
+        report_energy(r, v, m)             - total energy
+
+    and nbody(..., backend=name) dispatches to it:
+
+        'python' - nbody_opt, the state is converted to a BODIES dict for
+                   every call
+        'numpy'  - nbody_numpy
+        'numba'  - nbody_numba, needs numba
+        'cython' - the compiled nbody_cython extension
+        'auto'   - the fastest available backend for this host and body
+                   count
+
+    'auto' times a short calibration run of every available backend on the
+    actual body count (see calibrate) and caches the winner on disk (CACHE_FILE, keyed by
+    host, Python version, body count rounded up to a power of two and the
+    set of available backends), so later runs start without calibrating.
+"""
+import json
+import os
+import platform
+import sys
+import time
+from collections import namedtuple
+from itertools import combinations
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, arrays_to_bodies, offset_momentum
+
+Backend = namedtuple('Backend', ['name', 'advance', 'report_energy'])
+
+BACKENDS = {}
+
+CACHE_FILE = os.path.join(
+    os.environ.get('NBODY_CACHE_DIR',
+                   os.path.join(os.path.expanduser('~'), '.cache', 'nbody')),
+    'backends.json')
+CALIBRATION_STEPS = 20
+CALIBRATION_REPEATS = 3
+CALIBRATION_BUDGET = 0.25
+SAMPLE_BODIES = 256
+SLOWER = 4.0
+
+
+def register(name):
+    '''
+        register a loader function returning a Backend under name
+    '''
+    def decorator(loader):
+        BACKENDS[name] = loader
+        return loader
+    return decorator
+
+
+@register('python')
+def _python():
+    import nbody_opt
+
+    def to_bodies(r, v, m):
+        names = [str(i) for i in range(len(m))]
+        return names, arrays_to_bodies(names, r, v, m)
+
+    def advance(iterations, r, v, m, dt):
+        names, bodies = to_bodies(r, v, m)
+        nbody_opt.advance(iterations, set(combinations(names, 2)), bodies, dt)
+        for i, name in enumerate(names):
+            r[i] = bodies[name][0]
+            v[i] = bodies[name][1]
+
+    def report_energy(r, v, m):
+        names, bodies = to_bodies(r, v, m)
+        return nbody_opt.report_energy(bodies, set(combinations(names, 2)))
+
+    return Backend('python', advance, report_energy)
+
+
+@register('numpy')
+def _numpy():
+    import nbody_numpy
+    return Backend('numpy', nbody_numpy.advance, nbody_numpy.report_energy)
+
+
+@register('numba')
+def _numba():
+    import nbody_numba
+    return Backend('numba', nbody_numba.advance, nbody_numba.report_energy)
+
+
+@register('cython')
+def _cython():
+    import nbody_cython
+    return Backend('cython', nbody_cython.advance, nbody_cython.report_energy)
+
+
+_loaded = {}
+_failed = {}
+
+
+def load(name):
+    '''
+        load a registered backend, raises if it is not available here
+    '''
+    if name not in BACKENDS:
+        raise ValueError('unknown backend %r, choose from %s'
+                         % (name, ', '.join(sorted(BACKENDS) + ['auto'])))
+    if name in _failed:
+        raise _failed[name]
+    if name not in _loaded:
+        try:
+            _loaded[name] = BACKENDS[name]()
+        except Exception as e:
+            _failed[name] = e
+            raise
+    return _loaded[name]
+
+
+def available():
+    '''
+        names of the backends that load on this host
+    '''
+    names = []
+    for name in sorted(BACKENDS):
+        try:
+            load(name)
+        except Exception:
+            continue
+        names.append(name)
+    return names
+
+
+def _cache_key(n, names):
+    bucket = 1
+    while bucket < n:
+        bucket *= 2
+    return '%s|%s|%s|n<=%d|%s' % (platform.node(), platform.machine(),
+                                  '.'.join(map(str, sys.version_info[:2])),
+                                  bucket, ','.join(names))
+
+
+def _read_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache):
+    folder = os.path.dirname(CACHE_FILE)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmp = CACHE_FILE + '.%d' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, CACHE_FILE)
+
+
+def _time(backend, r, v, m, dt, steps):
+    '''
+        seconds per step of backend on a copy of the state
+    '''
+    rc, vc = r.copy(), v.copy()
+    start = time.perf_counter()
+    backend.advance(steps, rc, vc, m, dt)
+    return (time.perf_counter() - start) / steps
+
+
+def calibrate(r, v, m, dt=0.01, steps=CALIBRATION_STEPS, repeats=CALIBRATION_REPEATS,
+              budget=CALIBRATION_BUDGET):
+    '''
+        time every available backend on a copy of the state
+        returns {name: best seconds per step}
+
+        - every backend is first warmed up and timed for one step on at
+          most SAMPLE_BODIES bodies, which absorbs JIT compilation and
+          gives an estimate for the full count (scaled by N**2)
+        - the backends are then timed on the full state from the most
+          promising one on, with steps and repeats cut down to about
+          budget seconds per backend
+        - a backend whose estimate or first full step is more than SLOWER
+          times the best time so far is not timed any further, its
+          estimate is reported instead
+    '''
+    n = len(m)
+    k = min(n, SAMPLE_BODIES)
+    sample = (r[:k], v[:k], np.ascontiguousarray(m[:k]))
+    estimates = {}
+    for name in available():
+        backend = load(name)
+        backend.advance(1, sample[0].copy(), sample[1].copy(), sample[2], dt)
+        estimates[name] = _time(backend, sample[0], sample[1], sample[2], dt, 1) * (n / k) ** 2
+
+    timings = {}
+    best = None
+    for name in sorted(estimates, key=estimates.get):
+        if best is not None and estimates[name] > SLOWER * best:
+            timings[name] = estimates[name]
+            continue
+        backend = load(name)
+        first = _time(backend, r, v, m, dt, 1)
+        if best is not None and first > SLOWER * best:
+            timings[name] = first
+            continue
+        count = max(1, min(steps, int(budget / first)))
+        runs = max(1, min(repeats, int(budget / (count * first))))
+        elapsed = min([first] + [_time(backend, r, v, m, dt, count) for _ in range(runs)])
+        timings[name] = elapsed
+        best = elapsed if best is None else min(best, elapsed)
+    return timings
+
+
+def choose(r, v, m, dt=0.01, refresh=False):
+    '''
+        fastest available backend for this state, cached on disk
+    '''
+    names = available()
+    key = _cache_key(len(m), names)
+    cache = _read_cache()
+    if not refresh and cache.get(key) in names:
+        return load(cache[key])
+
+    timings = calibrate(r, v, m, dt)
+    best = min(timings, key=timings.get)
+    cache[key] = best
+    try:
+        _write_cache(cache)
+    except (IOError, OSError):
+        pass
+    return load(best)
+
+
+def get_backend(name, r, v, m, dt=0.01):
+    if name == 'auto':
+        return choose(r, v, m, dt)
+    return load(name)
+
+
+def nbody(loops, reference, iterations, backend='auto', bodies=BODIES, dt=0.01):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        backend - 'python', 'numpy', 'numba', 'cython' or 'auto'
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    engine = get_backend(backend, r, v, m, dt)
+
+    for _ in range(loops):
+        engine.advance(iterations, r, v, m, dt)
+        print(engine.report_energy(r, v, m))
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
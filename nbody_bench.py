@@ -0,0 +1,281 @@
+"""
+    N-body benchmark suite with regression tracking.
+
+    The timings in the module docstrings (95.9s for nbody.py, 29.6s for
+    nbody_opt.py, 6.98s for the Cython build) were measured by hand. This
+    harness runs every N-body variant and backend with warm-up and repeated
+    trials over several body counts and step counts, and records the median
+    and the dispersion of the trials together with the machine metadata
+    as JSON.
+
+    Cases:
+
+        nbody, nbody_1 .. nbody_4, nbody_iter, nbody_opt
+                         - the original scripts through their own nbody(),
+                           loaded fresh for every trial since they keep the
+                           state in module globals; 5 bodies only
+        backend:<name>   - every available backend of nbody_backends
+        bh, pm           - the Barnes-Hut and particle-mesh force backends
+        mixed, mixed:float64, mixed:numba, mixed:numba-float64
+                         - nbody_mixed in float32 and its float64 build of
+                           the same (3, N) layout, with the NumPy and the
+                           Numba force kernels
+
+    With --baseline the results are compared against a stored run: a case
+    is flagged as a regression when its median is slower than the baseline
+    median by more than the threshold (or the measured noise, whichever is
+    larger), and the command exits with status 1.
+
+    Usage:
+
+        python nbody_bench.py --bodies 5,64,256 --steps 100 --output bench.json
+        python nbody_bench.py --baseline bench.json --output new.json
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import nbody_backends
+from nbody_numpy import offset_momentum
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ['nbody', 'nbody_1', 'nbody_2', 'nbody_3', 'nbody_4', 'nbody_iter', 'nbody_opt']
+THRESHOLD = 0.10
+CASES = {}
+
+
+def register(name):
+    '''
+        register factory(n, dt) returning run(steps), or None when the case
+        does not support n bodies
+    '''
+    def decorator(factory):
+        CASES[name] = factory
+        return factory
+    return decorator
+
+
+def random_state(n, seed=0):
+    '''
+        n bodies in a unit cube with small random velocities, zero momentum
+    '''
+    rng = np.random.default_rng(seed)
+    r = rng.random((n, 3))
+    v = 0.01 * rng.standard_normal((n, 3))
+    m = rng.random(n) / n
+    offset_momentum(v, m, 0)
+    return r, v, m
+
+
+def _fresh_module(name):
+    spec = importlib.util.spec_from_file_location('_bench_' + name,
+                                                  os.path.join(HERE, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _script_case(name):
+    def factory(n, dt):
+        if n != 5:
+            return None
+
+        modules = []
+
+        def prepare():
+            modules[:] = [_fresh_module(name)]
+
+        def run(steps):
+            with contextlib.redirect_stdout(io.StringIO()):
+                modules[0].nbody(1, 'sun', steps)
+        run.prepare = prepare
+        return run
+    return factory
+
+for _name in SCRIPTS:
+    register(_name)(_script_case(_name))
+
+
+def _backend_case(name):
+    def factory(n, dt):
+        backend = nbody_backends.load(name)
+        r, v, m = random_state(n)
+
+        def run(steps):
+            backend.advance(steps, r, v, m, dt)
+        return run
+    return factory
+
+for _name in nbody_backends.BACKENDS:
+    register('backend:' + _name)(_backend_case(_name))
+
+
+@register('bh')
+def _bh(n, dt):
+    import nbody_bh
+    r, v, m = random_state(n)
+    return lambda steps: nbody_bh.advance(steps, r, v, m, dt)
+
+
+@register('pm')
+def _pm(n, dt):
+    import nbody_pm
+    r, v, m = random_state(n)
+    mesh = nbody_pm.ParticleMesh(32)
+    return lambda steps: nbody_pm.advance(steps, r, v, m, dt, mesh)
+
+
+def _mixed_case(dtype, engine):
+    def factory(n, dt):
+        import nbody_mixed
+        r, v, m = random_state(n)
+        try:
+            state = nbody_mixed.MixedState(r, v, m, dtype, engine)
+        except ImportError:
+            return None
+        return lambda steps: state.advance(steps, dt)
+    return factory
+
+register('mixed')(_mixed_case(np.float32, 'numpy'))
+register('mixed:float64')(_mixed_case(np.float64, 'numpy'))
+register('mixed:numba')(_mixed_case(np.float32, 'numba'))
+register('mixed:numba-float64')(_mixed_case(np.float64, 'numba'))
+
+
+def machine():
+    '''
+        metadata of the host the benchmark ran on
+    '''
+    return {'node': platform.node(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def measure(run, steps, repeat=5, warmup=1):
+    '''
+        wall clock seconds of repeat trials after warmup untimed runs
+        run.prepare(), if present, is called untimed before every run
+    '''
+    prepare = getattr(run, 'prepare', lambda: None)
+    for _ in range(warmup):
+        prepare()
+        run(steps)
+    times = []
+    for _ in range(repeat):
+        prepare()
+        start = time.perf_counter()
+        run(steps)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times):
+    median = statistics.median(times)
+    q = np.percentile(times, [25, 75])
+    return {'median': median,
+            'iqr': float(q[1] - q[0]),
+            'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+            'min': min(times),
+            'max': max(times),
+            'times': times}
+
+
+def run_suite(cases=None, bodies=(5,), steps=(100,), repeat=5, warmup=1, dt=0.01,
+              log=sys.stderr):
+    '''
+        run every case for every body count and step count
+        returns the JSON-ready report
+    '''
+    results = []
+    for name in cases or sorted(CASES):
+        for n in bodies:
+            try:
+                run = CASES[name](n, dt)
+            except Exception as e:
+                if log:
+                    print('skip %s n=%d: %s' % (name, n, str(e).splitlines()[0]), file=log)
+                continue
+            if run is None:
+                continue
+            for s in steps:
+                record = {'case': name, 'bodies': n, 'steps': s,
+                          'repeat': repeat, 'warmup': warmup}
+                record.update(summarize(measure(run, s, repeat, warmup)))
+                if log:
+                    print('%-16s n=%-6d steps=%-6d median %.4fs' % (name, n, s, record['median']),
+                          file=log)
+                results.append(record)
+    return {'machine': machine(), 'results': results}
+
+
+def compare(report, baseline, threshold=THRESHOLD):
+    '''
+        regressions of report against baseline
+        returns a list of (case, bodies, steps, baseline median, median)
+    '''
+    old = {(r['case'], r['bodies'], r['steps']): r for r in baseline['results']}
+    regressions = []
+    for r in report['results']:
+        base = old.get((r['case'], r['bodies'], r['steps']))
+        if base is None:
+            continue
+        noise = max(r['iqr'] / r['median'] if r['median'] else 0.0,
+                    base['iqr'] / base['median'] if base['median'] else 0.0)
+        if r['median'] > base['median'] * (1.0 + max(threshold, 2 * noise)):
+            regressions.append((r['case'], r['bodies'], r['steps'],
+                                base['median'], r['median']))
+    return regressions
+
+
+def _ints(text):
+    return [int(x) for x in text.split(',') if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='N-body benchmark suite')
+    parser.add_argument('--cases', default='', help='comma separated, default all')
+    parser.add_argument('--bodies', type=_ints, default=[5])
+    parser.add_argument('--steps', type=_ints, default=[100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    # read the baseline first, --output may point at the same file
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    cases = [c for c in args.cases.split(',') if c] or None
+    report = run_suite(cases, args.bodies, args.steps, args.repeat, args.warmup)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold)
+        for case, n, steps, old, new in regressions:
+            print('REGRESSION %s n=%d steps=%d: %.4fs -> %.4fs (x%.2f)'
+                  % (case, n, steps, old, new, new / old))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+    N-body simulation.
+
+    Version: Barnes-Hut octree force backend for large N
+
+    Every timestep an octree is rebuilt over the bodies and each cell stores
+    its mass moment (total mass and center of mass). The force on a body
+    walks the tree and replaces a whole cell by its center of mass when the
+    cell is seen under an angle smaller than THETA:
+
+        cell size / distance < theta
+
+    theta = 0 reproduces the exact pair sum, larger theta trades accuracy
+    for speed. A step costs O(N log N) instead of the O(N^2) pair sum of
+    nbody_opt.advance.
+
+    The walk is done for a whole chunk of bodies at once: the frontier of
+    (body, cell) pairs is kept in index arrays and opened one tree level at
+    a time, so the Python loop runs over tree depth rather than bodies.
+
+    compare_drift() runs the exact numpy engine and this backend side by
+    side from the same initial state and reports the relative energy drift
+    of both, which is what theta should be picked from.
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import (bodies_to_arrays, accelerations, report_energy,
+                         offset_momentum)
+
+THETA = 0.5
+LEAF_SIZE = 8
+MAX_DEPTH = 32
+CHUNK = 4096
+
+
+class Octree(object):
+    '''
+        flat array octree over a set of bodies
+
+        center, half - geometric center and half width of every cell
+        mass, com    - mass moment (total mass, center of mass) of every cell
+        children     - (cells, 8) child cell ids, -1 where empty
+        start, count - slice of perm holding the bodies of a leaf cell
+    '''
+
+    def __init__(self, r, m, leaf_size=LEAF_SIZE):
+        self.r = r
+        self.m = m
+        self.leaf_size = leaf_size
+        self._center = []
+        self._half = []
+        self._mass = []
+        self._com = []
+        self._children = []
+        self._start = []
+        self._count = []
+        self._perm = []
+
+        lo = r.min(axis=0)
+        hi = r.max(axis=0)
+        half = max(0.5 * (hi - lo).max(), 1e-12) * (1.0 + 1e-9)
+        self._build(np.arange(len(m)), 0.5 * (lo + hi), half, 0)
+
+        self.center = np.array(self._center)
+        self.half = np.array(self._half)
+        self.mass = np.array(self._mass)
+        self.com = np.array(self._com)
+        self.children = np.array(self._children, dtype=np.intp)
+        self.start = np.array(self._start, dtype=np.intp)
+        self.count = np.array(self._count, dtype=np.intp)
+        self.perm = np.array(self._perm, dtype=np.intp)
+        self.is_leaf = self.children.max(axis=1) < 0
+
+    def _build(self, idx, center, half, depth):
+        node = len(self._center)
+        mass = self.m[idx].sum()
+        if mass > 0:
+            com = np.dot(self.m[idx], self.r[idx]) / mass
+        else:
+            com = center
+        self._center.append(center)
+        self._half.append(half)
+        self._mass.append(mass)
+        self._com.append(com)
+        self._children.append([-1] * 8)
+        self._start.append(len(self._perm))
+        self._count.append(0)
+
+        if len(idx) <= self.leaf_size or depth >= MAX_DEPTH:
+            self._perm.extend(idx)
+            self._count[node] = len(idx)
+            return node
+
+        octant = np.dot(self.r[idx] > center, [1, 2, 4])
+        for o in range(8):
+            sub = idx[octant == o]
+            if sub.size:
+                sign = np.array([o & 1, (o >> 1) & 1, (o >> 2) & 1]) * 2 - 1
+                child = self._build(sub, center + sign * 0.5 * half,
+                                    0.5 * half, depth + 1)
+                self._children[node][o] = child
+        return node
+
+    def accelerations(self, theta=THETA, chunk=CHUNK):
+        '''
+            approximate acceleration on every body, shape (N, 3)
+        '''
+        n = len(self.m)
+        acc = np.zeros((n, 3))
+        for first in range(0, n, chunk):
+            self._walk(np.arange(first, min(first + chunk, n)), theta, acc)
+        return acc
+
+    def _walk(self, bodies, theta, acc):
+        r = self.r
+        cells = np.zeros(len(bodies), dtype=np.intp)
+
+        while bodies.size:
+            pos = r[bodies]
+            d = self.com[cells] - pos
+            dist2 = np.einsum('ij,ij->i', d, d)
+
+            # a cell may only be used as a whole if the body lies outside it
+            half = self.half[cells]
+            outside = (np.abs(pos - self.center[cells]) > half[:, None]).any(axis=1)
+            far = outside & (4.0 * half * half < theta * theta * dist2)
+            self._accumulate(acc, bodies[far], d[far], dist2[far],
+                             self.mass[cells[far]])
+
+            near = ~far
+            leaf = near & self.is_leaf[cells]
+            self._direct(acc, bodies[leaf], cells[leaf])
+
+            # open the remaining cells into their non-empty children
+            inner = near & ~self.is_leaf[cells]
+            children = self.children[cells[inner]]
+            keep = children >= 0
+            bodies = np.repeat(bodies[inner], 8)[keep.ravel()]
+            cells = children[keep]
+
+    def _direct(self, acc, bodies, cells):
+        '''
+            exact sum over the bodies held by leaf cells, skipping self
+        '''
+        counts = self.count[cells]
+        total = counts.sum()
+        if not total:
+            return
+        offsets = np.repeat(self.start[cells] - (np.cumsum(counts) - counts), counts)
+        others = self.perm[offsets + np.arange(total)]
+        bodies = np.repeat(bodies, counts)
+        keep = others != bodies
+        bodies = bodies[keep]
+        others = others[keep]
+        d = self.r[others] - self.r[bodies]
+        dist2 = np.einsum('ij,ij->i', d, d)
+        self._accumulate(acc, bodies, d, dist2, self.m[others])
+
+    def _accumulate(self, acc, bodies, d, dist2, mass):
+        if not bodies.size:
+            return
+        w = mass * dist2 ** (-1.5)
+        n = len(acc)
+        for k in range(3):
+            acc[:, k] += np.bincount(bodies, d[:, k] * w, minlength=n)
+
+
+def advance(iterations, r, v, m, dt, theta=THETA):
+    '''
+        advance the system iterations timesteps with tree forces
+        same kick then drift scheme as nbody_numpy.advance
+    '''
+    for _ in range(iterations):
+        v += dt * Octree(r, m).accelerations(theta)
+        r += dt * v
+
+
+def nbody(loops, reference, iterations, theta=THETA, bodies=BODIES, dt=0.01):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        theta - opening angle, 0 is exact
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+
+    for _ in range(loops):
+        advance(iterations, r, v, m, dt, theta)
+        print(report_energy(r, v, m))
+
+
+def compare_drift(loops, reference, iterations, theta=THETA, bodies=BODIES, dt=0.01):
+    '''
+        run the exact and the tree backend from the same initial state
+        returns a list of (loop, exact drift, tree drift) where drift is
+        the relative energy error |E - E0| / |E0|
+    '''
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    r_bh, v_bh = r.copy(), v.copy()
+
+    e0 = report_energy(r, v, m)
+    result = []
+    for loop in range(loops):
+        for _ in range(iterations):
+            v += dt * accelerations(r, m)
+            r += dt * v
+        advance(iterations, r_bh, v_bh, m, dt, theta)
+        result.append((loop,
+                       abs((report_energy(r, v, m) - e0) / e0),
+                       abs((report_energy(r_bh, v_bh, m) - e0) / e0)))
+    return result
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
@@ -0,0 +1,178 @@
+"""
+    N-body simulation.
+
+    Version: Hierarchical block (individual) timesteps
+
+    With one global dt every body is stepped at the rate the fastest orbit
+    needs. Here every body i gets its own step
+
+        dt_i = dt / 2**k_i,   0 <= k_i <= levels
+
+    chosen from the shortest two-body free-fall time to any other body,
+
+        dt_i ~ eta * min_j sqrt(|r_ij|**3 / (m_i + m_j))
+
+    Time is counted in integer ticks of dt / 2**levels, so all steps of a
+    level line up. At every tick only the bodies that are due ("active")
+    get a new force; the positions of all other bodies are predicted to the
+    current time with
+
+        r + v * tau + a * tau**2 / 2
+
+    The active bodies are then corrected with a velocity Verlet update.
+    A body may move to a smaller step at any of its own steps and to a
+    larger one only where the larger step is aligned. At the end of every
+    dt all bodies are synchronised.
+
+    stats counts the force evaluations per body and compares them with a
+    global-step advance at the smallest step that was used.
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import (BLOCK, bodies_to_arrays, accelerations, report_energy,
+                         offset_momentum)
+
+LEVELS = 8
+ETA = 0.02
+
+
+def accelerations_on(active, r, m, block=BLOCK):
+    '''
+        acceleration on the bodies in active from all bodies, shape (A, 3)
+        active bodies are processed in blocks of block rows, like
+        nbody_numpy.accelerations
+    '''
+    acc = np.empty((len(active), 3))
+    for start in range(0, len(active), block):
+        stop = min(start + block, len(active))
+        rows = active[start:stop]
+        d = r[rows, None, :] - r[None, :, :]
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        dist2[np.arange(stop - start), rows] = np.inf
+        acc[start:stop] = -np.einsum('ijk,ij->ik', d, m * dist2 ** (-1.5))
+    return acc
+
+
+def timestep_criterion(active, r, m, eta=ETA, block=BLOCK):
+    '''
+        eta times the shortest two-body free-fall time of every active body
+    '''
+    t = np.empty(len(active))
+    for start in range(0, len(active), block):
+        stop = min(start + block, len(active))
+        rows = active[start:stop]
+        d = r[rows, None, :] - r[None, :, :]
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        dist2[np.arange(stop - start), rows] = np.inf
+        t2 = dist2 ** 1.5 / (m[rows, None] + m[None, :])
+        t[start:stop] = eta * np.sqrt(t2.min(axis=1))
+    return t
+
+
+class BlockScheduler(object):
+    '''
+        individual block timesteps on the array state of nbody_numpy
+        dt - base (largest) step
+        levels - number of halvings below dt
+        eta - accuracy parameter of the timestep criterion
+    '''
+
+    def __init__(self, r, v, m, dt=0.01, levels=LEVELS, eta=ETA):
+        self.r = r
+        self.v = v
+        self.m = m
+        self.dt = dt
+        self.levels = levels
+        self.eta = eta
+        self.tick = dt / 2 ** levels
+        self.now = 0
+        n = len(m)
+        self.time = np.zeros(n, dtype=np.int64)
+        self.a = accelerations(r, m)
+        self.step = self._steps(np.arange(n), r, np.full(n, 2 ** levels))
+        self.stats = {'force_evaluations': 0, 'global_evaluations': 0,
+                      'substeps': 0, 'smallest_step': int(self.step.min())}
+
+    def _steps(self, active, r, current):
+        '''
+            new step in ticks for the active bodies, a power of two
+        '''
+        wanted = timestep_criterion(active, r, self.m, self.eta) / self.tick
+        k = np.floor(np.log2(np.maximum(wanted, 1.0))).astype(np.int64)
+        step = 2 ** np.clip(k, 0, self.levels)
+        # grow by at most a factor of two, and only where it stays aligned
+        grown = np.minimum(step, 2 * current)
+        aligned = (self.now % grown) == 0
+        return np.where(grown > current, np.where(aligned, grown, current), step)
+
+    def substep(self):
+        '''
+            advance to the next time at which any body is due
+        '''
+        due = self.time + self.step
+        now = int(due.min())
+        active = np.flatnonzero(due == now)
+
+        # predict every body to now
+        tau = ((now - self.time) * self.tick)[:, None]
+        predicted = self.r + self.v * tau + 0.5 * self.a * tau * tau
+
+        a_new = accelerations_on(active, predicted, self.m)
+        dt = (self.step[active] * self.tick)[:, None]
+        self.r[active] = predicted[active]
+        self.v[active] += 0.5 * (self.a[active] + a_new) * dt
+        self.a[active] = a_new
+        self.time[active] = now
+        self.now = now
+        self.step[active] = self._steps(active, predicted, self.step[active])
+
+        self.stats['force_evaluations'] += len(active)
+        self.stats['substeps'] += 1
+        self.stats['smallest_step'] = min(self.stats['smallest_step'],
+                                          int(self.step.min()))
+
+    def advance(self, iterations):
+        '''
+            advance all bodies iterations base steps and synchronise them
+        '''
+        end = self.now + iterations * 2 ** self.levels
+        while self.now < end:
+            self.substep()
+        # a global step scheme would need every body at the smallest step
+        self.stats['global_evaluations'] = (len(self.m) * self.now //
+                                            self.stats['smallest_step'])
+
+    def saved(self):
+        '''
+            fraction of force evaluations saved against global steps
+        '''
+        if not self.stats['global_evaluations']:
+            return 0.0
+        return 1.0 - float(self.stats['force_evaluations']) / self.stats['global_evaluations']
+
+
+def nbody(loops, reference, iterations, dt=0.01, levels=LEVELS, eta=ETA,
+          bodies=BODIES):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of base timesteps to advance
+        returns the run statistics
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    scheduler = BlockScheduler(r, v, m, dt, levels, eta)
+
+    for _ in range(loops):
+        scheduler.advance(iterations)
+        print(report_energy(r, v, m))
+
+    stats = dict(scheduler.stats, saved=scheduler.saved())
+    print(stats)
+    return stats
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
@@ -0,0 +1,253 @@
+"""
+    N-body simulation.
+
+    Version: Content-addressed result cache with checkpoint resume
+
+    Rerunning nbody(100, 'sun', 20000), or extending a finished run by a
+    few thousand steps, used to start again from BODIES at t = 0. Runs are
+    now cached on disk:
+
+        key        sha256 of the initial r, v, m bytes, the integrator,
+                   dt, the backend and the cache and checkpoint format
+                   versions (run_key); bump CACHE_VERSION when a change
+                   alters the trajectories, so old entries are not hit
+        snapshots  checkpoints of nbody_checkpoint, one file per cached
+                   step count: <directory>/<key>/<step>.ckpt, including the
+                   integrator state so a resumed run is bit-identical to an
+                   uninterrupted one
+
+    run() asks for the state after a number of steps: an exact snapshot is
+    returned without stepping, otherwise the run resumes from the nearest
+    earlier snapshot (or the initial state) and stores new snapshots on the
+    way. The cache is bounded by max_bytes; after every store the least
+    recently used snapshots (file mtime, refreshed on every hit) are
+    evicted until it fits.
+
+    The directory is $NBODY_CACHE_DIR/runs, default ~/.cache/nbody/runs,
+    the size bound $NBODY_RUN_CACHE_BYTES, default MAX_BYTES.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, report_energy, offset_momentum
+from nbody_integrators import INTEGRATORS
+from nbody_checkpoint import VERSION, write_checkpoint, read_checkpoint
+
+CACHE_VERSION = 1
+MAX_BYTES = 1 << 30
+SUFFIX = '.ckpt'
+
+CACHE_DIR = os.path.join(
+    os.environ.get('NBODY_CACHE_DIR',
+                   os.path.join(os.path.expanduser('~'), '.cache', 'nbody')),
+    'runs')
+
+
+def run_key(r, v, m, method='kick-drift', dt=0.01, backend=None):
+    '''
+        hex digest identifying a run by its initial state and parameters
+    '''
+    h = hashlib.sha256()
+    h.update(('nbody-cache %d checkpoint %d|' % (CACHE_VERSION, VERSION)).encode())
+    for a in (r, v, m):
+        a = np.ascontiguousarray(a, dtype='<f8')
+        h.update(repr(a.shape).encode())
+        h.update(memoryview(a).cast('B'))
+    h.update(('%s|%r|%s' % (method, float(dt), backend)).encode())
+    return h.hexdigest()
+
+
+class RunCache(object):
+    '''
+        size-bounded LRU store of run snapshots
+        directory - cache root, one sub-directory per run key
+        max_bytes - total size bound of the snapshot files
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('NBODY_RUN_CACHE_BYTES', MAX_BYTES))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, step):
+        return os.path.join(self.directory, key, '%012d%s' % (step, SUFFIX))
+
+    def steps(self, key):
+        '''
+            sorted step counts cached for key
+        '''
+        try:
+            names = os.listdir(os.path.join(self.directory, key))
+        except OSError:
+            return []
+        return sorted(int(name[:-len(SUFFIX)]) for name in names
+                      if name.endswith(SUFFIX) and name[:-len(SUFFIX)].isdigit())
+
+    def nearest(self, key, step):
+        '''
+            largest cached step count <= step, None if there is none
+        '''
+        earlier = [s for s in self.steps(key) if s <= step]
+        return earlier[-1] if earlier else None
+
+    def load(self, key, step):
+        '''
+            read a cached snapshot and mark it as recently used,
+            None if it was evicted in the meantime
+        '''
+        path = self._path(key, step)
+        try:
+            state = read_checkpoint(path, mmap=False)
+            os.utime(path)
+        except (IOError, OSError):
+            return None
+        return state
+
+    def store(self, key, r, v, m, step, time, dt, method, extra=None):
+        folder = os.path.join(self.directory, key)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        path = self._path(key, step)
+        write_checkpoint(path, r, v, m, step, time, dt, method, extra)
+        self.evict(keep=path)
+
+    def _files(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def evict(self, keep=None):
+        '''
+            remove least recently used snapshots until the cache fits
+            into max_bytes; keep is never removed
+        '''
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def clear(self):
+        '''
+            remove every snapshot and the run directories
+        '''
+        for _, _, path in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        try:
+            keys = os.listdir(self.directory)
+        except OSError:
+            return
+        for key in keys:
+            try:
+                os.rmdir(os.path.join(self.directory, key))
+            except OSError:
+                pass
+
+
+def run(steps, r, v, m, dt=0.01, method='kick-drift', backend=None,
+        every=None, cache=None):
+    '''
+        state after steps timesteps from the initial state (r, v, m)
+        method - integrator of nbody_integrators
+        backend - name of a nbody_backends backend to step with instead,
+                  kick-drift only
+        every - also store snapshots every `every` steps on the way
+        returns (r, v, m, info); info has the key, the step resumed from
+        and whether the result was cached
+    '''
+    cache = cache or RunCache()
+    if backend is not None and method != 'kick-drift':
+        raise ValueError('backends only step with the kick-drift integrator')
+    key = run_key(r, v, m, method, dt, backend)
+
+    start = cache.nearest(key, steps)
+    state = cache.load(key, start) if start is not None else None
+    integrator = INTEGRATORS[method]()
+    if state is None:
+        start = 0
+        time = 0.0
+        r, v, m = (np.array(a, dtype=np.float64) for a in (r, v, m))
+    else:
+        time = state['time']
+        r, v, m = (np.array(state[a]) for a in ('r', 'v', 'm'))
+        integrator.set_state(state['extra'])
+
+    info = {'key': key, 'resumed_from': start, 'cached': start == steps}
+    if start == steps:
+        cache.hits += 1
+        return r, v, m, info
+    cache.misses += 1
+
+    if backend is not None:
+        import nbody_backends
+        engine = nbody_backends.load(backend)
+
+    step = start
+    while step < steps:
+        chunk = steps - step
+        if every:
+            chunk = min(chunk, every - step % every)
+        if backend is not None:
+            engine.advance(chunk, r, v, m, dt)
+            time += chunk * dt
+        else:
+            for _ in range(chunk):
+                time += integrator.step(r, v, m, dt)
+        step += chunk
+        if step == steps or (every and step % every == 0):
+            cache.store(key, r, v, m, step, time, dt, method,
+                        integrator.get_state())
+    return r, v, m, info
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01,
+          method='kick-drift', backend=None, cache=None):
+    '''
+        nbody simulation through the run cache
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+    '''
+    cache = cache or RunCache()
+    names, r0, v0, m0 = bodies_to_arrays(bodies)
+    offset_momentum(v0, m0, names.index(reference))
+
+    for loop in range(loops):
+        r, v, m, _ = run((loop + 1) * iterations, r0, v0, m0, dt, method,
+                         backend, iterations, cache)
+        print(report_energy(r, v, m))
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
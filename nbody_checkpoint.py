@@ -0,0 +1,185 @@
+"""
+    N-body simulation.
+
+    Version: Memory-mapped binary checkpoint/restart
+
+    A checkpoint holds the array state (positions, velocities, masses), the
+    step count, the simulated time, the timestep, the integrator name and
+    the integrator's internal arrays (see Integrator.get_state) in one
+    binary file:
+
+        header     struct HEADER: magic, version, body count, step count,
+                   array count, time, dt, integrator name
+        table      one struct ENTRY per array: name, offset, ndim, shape
+        data       raw little-endian float64 arrays, each aligned to
+                   ALIGN bytes
+
+    Arrays are written straight from their buffers and read back with
+    np.memmap, so neither side converts or parses anything; restoring
+    10**6 bodies only maps the file. Files are written to a temporary name
+    in the same directory, fsync'ed and renamed over the old checkpoint, so
+    a job killed during a write leaves the previous checkpoint intact; the
+    file gets the usual 0666 & ~umask mode, not the 0600 of the temporary.
+    Array names longer than 16 bytes and integrator names longer than 32
+    bytes do not fit the table and header and raise ValueError.
+
+    nbody() writes a checkpoint every `every` loops and, if the checkpoint
+    file exists, resumes from it. The restart continues bit-identically.
+"""
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, report_energy, offset_momentum
+from nbody_integrators import INTEGRATORS
+from nbody_metrics import METRICS
+
+MAGIC = b'NBODYCK1'
+VERSION = 1
+HEADER = struct.Struct('<8sIIqIdd32s')
+ENTRY = struct.Struct('<16sQI3Q')
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_checkpoint(path, r, v, m, step, time=0.0, dt=0.0,
+                     integrator='kick-drift', extra=None):
+    '''
+        atomically write the state to path
+        extra - dict of additional float64 arrays (integrator state)
+    '''
+    arrays = [('r', r), ('v', v), ('m', m)]
+    arrays += sorted((extra or {}).items())
+    arrays = [(name, np.ascontiguousarray(a, dtype='<f8')) for name, a in arrays]
+    for name, _ in arrays:
+        _check_name('array', name, 16)
+    _check_name('integrator', integrator, 32)
+
+    offset = _align(HEADER.size + ENTRY.size * len(arrays))
+    table = []
+    for name, a in arrays:
+        shape = tuple(a.shape) + (0,) * (3 - a.ndim)
+        table.append(ENTRY.pack(name.encode(), offset, a.ndim, *shape))
+        offset = _align(offset + a.nbytes)
+
+    with METRICS.phase('io'):
+        _write_file(path, arrays, table, offset, m, step, time, dt, integrator)
+    METRICS.count('bytes_written', offset)
+
+
+def _check_name(kind, name, size):
+    if len(name.encode()) > size:
+        raise ValueError('%s name %r is longer than %d bytes' % (kind, name, size))
+
+
+def _file_mode():
+    '''
+        mode of a newly created file under the current umask
+    '''
+    mask = os.umask(0)
+    os.umask(mask)
+    return 0o666 & ~mask
+
+
+def _write_file(path, arrays, table, size, m, step, time, dt, integrator):
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.ckpt-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(m), step, len(arrays),
+                                time, dt, integrator.encode()))
+            f.write(b''.join(table))
+            for (name, a), entry in zip(arrays, table):
+                f.seek(ENTRY.unpack(entry)[1])
+                f.write(memoryview(a).cast('B'))
+            f.truncate(size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, _file_mode())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_checkpoint(path, mmap=True):
+    '''
+        read a checkpoint written by write_checkpoint
+        returns a dict with step, time, dt, integrator, r, v, m and extra;
+        with mmap the arrays are read-only memory maps of the file
+    '''
+    with open(path, 'rb') as f:
+        magic, version, n, step, count, time, dt, integrator = HEADER.unpack(
+            f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d checkpoint' % (path, VERSION))
+        entries = [ENTRY.unpack(f.read(ENTRY.size)) for _ in range(count)]
+
+    arrays = {}
+    for name, offset, ndim, s0, s1, s2 in entries:
+        shape = (s0, s1, s2)[:ndim]
+        if mmap and int(np.prod(shape)):
+            a = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=shape)
+        else:
+            a = np.fromfile(path, dtype='<f8', count=int(np.prod(shape)),
+                            offset=offset).reshape(shape)
+        arrays[name.rstrip(b'\0').decode()] = a
+
+    return {'step': step,
+            'time': time,
+            'dt': dt,
+            'integrator': integrator.rstrip(b'\0').decode(),
+            'r': arrays.pop('r'),
+            'v': arrays.pop('v'),
+            'm': arrays.pop('m'),
+            'extra': arrays}
+
+
+def nbody(loops, reference, iterations, path='nbody.ckpt', every=1,
+          method='kick-drift', dt=0.01, bodies=BODIES):
+    '''
+        nbody simulation with checkpoint/restart
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        path - checkpoint file, resumed from if it exists
+        every - write a checkpoint every `every` loops
+    '''
+    integrator = INTEGRATORS[method]()
+
+    if os.path.exists(path):
+        state = read_checkpoint(path)
+        if state['integrator'] != method:
+            raise ValueError('checkpoint was written by the %s integrator'
+                             % state['integrator'])
+        r = np.array(state['r'])
+        v = np.array(state['v'])
+        m = np.array(state['m'])
+        step = state['step']
+        time = state['time']
+        dt = state['dt']
+        integrator.set_state(state['extra'])
+    else:
+        names, r, v, m = bodies_to_arrays(bodies)
+        offset_momentum(v, m, names.index(reference))
+        step = 0
+        time = 0.0
+
+    for loop in range(step // iterations, loops):
+        for _ in range(iterations):
+            # adaptive integrators take steps other than dt
+            time += integrator.step(r, v, m, dt)
+        step += iterations
+        print(report_energy(r, v, m))
+        if (loop + 1) % every == 0 or loop + 1 == loops:
+            write_checkpoint(path, r, v, m, step, time, dt, method,
+                             integrator.get_state())
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
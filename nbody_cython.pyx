@@ -1,11 +1,12 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, language_level=3
 """
 Author: Qiming Chen qc449@nyu.edu
-Comment: 
+Comment:
 
 N-body simulation.
 
     Version: Optimized by Cython, derived from nbody_opt.py
-    
+
     Speed up: R = 95.9 / 29.6 = 3.24
 
     1. initial: 33.6s
@@ -14,7 +15,7 @@ N-body simulation.
     4. claiming C type variable for function parameters 13s -> 13.4s
     5. adding cdef for local variables 13.4s -> 7.23s
 
-    tested in jupyter notebook by 
+    tested in jupyter notebook by
 
         import pyximport
         pyximport.install()
@@ -25,136 +26,185 @@ N-body simulation.
 
     Speed up: R = 33.6 / 6.98 = 4.81
 
+    Version: typed memoryviews, nogil, OpenMP
+
+    Most of the remaining 6.98s was Python object traffic: iterating a set
+    of string key pairs and unpacking dict/list entries in advance. The
+    engine now works on the array state of nbody_numpy,
+
+        r, v - double[:, ::1], shape (N, 3)
+        m    - double[::1],    shape (N,)
+
+    with a precomputed (P, 2) integer array of the unique pairs. The whole
+    step loop runs with the GIL released:
+
+        - below PARALLEL_MIN_BODIES bodies the serial pair loop applies
+          both sides of every pair, like nbody_opt.advance
+        - from PARALLEL_MIN_BODIES bodies on every body sums its own row of
+          forces in an OpenMP prange, so threads never write the same
+          velocity
+
+    Build with the build script instead of pyximport:
+
+        python build_cython.py build_ext --inplace
 """
 
-import cython
-from itertools import combinations
 import numpy as np
+from itertools import combinations
+
+from cython.parallel cimport prange
+from libc.math cimport sqrt
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays
+
+PARALLEL_MIN_BODIES = 64
 
-cdef double PI = 3.14159265358979323
-cdef double SOLAR_MASS = 4 * PI * PI
-cdef double DAYS_PER_YEAR = 365.24
-
-cdef dict BODIES = {
-    'sun': ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], SOLAR_MASS), # SOLAR_MASS = 39.4784176044
-
-    'jupiter': ([4.84143144246472090e+00,
-                 -1.16032004402742839e+00,
-                 -1.03622044471123109e-01],
-                [1.66007664274403694e-03 * DAYS_PER_YEAR,
-                 7.69901118419740425e-03 * DAYS_PER_YEAR,
-                 -6.90460016972063023e-05 * DAYS_PER_YEAR],
-                9.54791938424326609e-04 * SOLAR_MASS),
-
-    'saturn': ([8.34336671824457987e+00,
-                4.12479856412430479e+00,
-                -4.03523417114321381e-01],
-               [-2.76742510726862411e-03 * DAYS_PER_YEAR,
-                4.99852801234917238e-03 * DAYS_PER_YEAR,
-                2.30417297573763929e-05 * DAYS_PER_YEAR],
-               2.85885980666130812e-04 * SOLAR_MASS),
-
-    'uranus': ([1.28943695621391310e+01,
-                -1.51111514016986312e+01,
-                -2.23307578892655734e-01],
-               [2.96460137564761618e-03 * DAYS_PER_YEAR,
-                2.37847173959480950e-03 * DAYS_PER_YEAR,
-                -2.96589568540237556e-05 * DAYS_PER_YEAR],
-               4.36624404335156298e-05 * SOLAR_MASS),
-
-    'neptune': ([1.53796971148509165e+01,
-                 -2.59193146099879641e+01,
-                 1.79258772950371181e-01],
-                [2.68067772490389322e-03 * DAYS_PER_YEAR,
-                 1.62824170038242295e-03 * DAYS_PER_YEAR,
-                 -9.51592254519715870e-05 * DAYS_PER_YEAR],
-                5.15138902046611451e-05 * SOLAR_MASS)}
-
-cdef advance(int iterations, set body_keypairs, dict bodies, double dt = 0.01):
+cdef dict _pairs = {}
+
+
+def pair_array(Py_ssize_t n):
+    '''
+        (P, 2) array of the unique pairs (i, j), i < j, cached per n
     '''
-        advance the system one timestep
+    if n not in _pairs:
+        pairs = np.array(list(combinations(range(n), 2)), dtype=np.intp)
+        _pairs[n] = pairs.reshape(-1, 2)
+    return _pairs[n]
+
+
+cdef void _advance_pairs(int iterations, double[:, ::1] r, double[:, ::1] v,
+                         double[::1] m, Py_ssize_t[:, ::1] pairs, double dt) noexcept nogil:
+    cdef Py_ssize_t n = m.shape[0], p, i, j, k
+    cdef int step
+    cdef double dx, dy, dz, d2, mag, mi_mag, mj_mag
+
+    for step in range(iterations):
+        for p in range(pairs.shape[0]):
+            i = pairs[p, 0]
+            j = pairs[p, 1]
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            # update v's, dt * d2 ** (-1.5) without calling pow
+            d2 = dx * dx + dy * dy + dz * dz
+            mag = dt / (d2 * sqrt(d2))
+            mi_mag = m[i] * mag
+            mj_mag = m[j] * mag
+            v[i, 0] -= dx * mj_mag
+            v[i, 1] -= dy * mj_mag
+            v[i, 2] -= dz * mj_mag
+            v[j, 0] += dx * mi_mag
+            v[j, 1] += dy * mi_mag
+            v[j, 2] += dz * mi_mag
+
+        for i in range(n):
+            for k in range(3):
+                r[i, k] += dt * v[i, k]
+
+
+cdef inline void _kick_row(Py_ssize_t i, double[:, ::1] r, double[:, ::1] v,
+                           double[::1] m, double dt) noexcept nogil:
+    cdef Py_ssize_t n = m.shape[0], j
+    cdef double dx, dy, dz, d2, mag
+    cdef double ax = 0.0, ay = 0.0, az = 0.0
+
+    for j in range(n):
+        if j != i:
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            d2 = dx * dx + dy * dy + dz * dz
+            mag = m[j] / (d2 * sqrt(d2))
+            ax -= dx * mag
+            ay -= dy * mag
+            az -= dz * mag
+    v[i, 0] += dt * ax
+    v[i, 1] += dt * ay
+    v[i, 2] += dt * az
+
+
+cdef inline void _drift_row(Py_ssize_t i, double[:, ::1] r, double[:, ::1] v,
+                            double dt) noexcept nogil:
+    r[i, 0] += dt * v[i, 0]
+    r[i, 1] += dt * v[i, 1]
+    r[i, 2] += dt * v[i, 2]
+
+
+cdef void _advance_rows(int iterations, double[:, ::1] r, double[:, ::1] v,
+                        double[::1] m, double dt, int threads) noexcept nogil:
+    cdef Py_ssize_t n = m.shape[0], i
+    cdef int step
+
+    # num_threads is only passed when given, so the module needs no OpenMP
+    # runtime calls and also builds and imports without OpenMP
+    for step in range(iterations):
+        if threads > 0:
+            for i in prange(n, schedule='static', num_threads=threads):
+                _kick_row(i, r, v, m, dt)
+            for i in prange(n, schedule='static', num_threads=threads):
+                _drift_row(i, r, v, dt)
+        else:
+            for i in prange(n, schedule='static'):
+                _kick_row(i, r, v, m, dt)
+            for i in prange(n, schedule='static'):
+                _drift_row(i, r, v, dt)
+
+
+def advance(int iterations, double[:, ::1] r, double[:, ::1] v, double[::1] m,
+            double dt=0.01, int threads=0):
     '''
-    
-#     cdef np.ndarray[np.double_t,ndim=1] l1, l2
-    
-    cdef list v1, v2, r
-    cdef double x1, x2, y1, y2, z1, z2, m1, m2, mag, m1_mag, m2_mag, dx, dy, dz, m, vx, vy, vz
-    bodies_keys = bodies.keys()
-
-#     bodies_keys = bodies.keys()
-    
-    for _ in range(iterations):
-        for (body1, body2) in iter(body_keypairs):         
-            ([x1, y1, z1], v1, m1) = bodies[body1]
-            ([x2, y2, z2], v2, m2) = bodies[body2]
-            (dx, dy, dz) = (x1-x2, y1-y2, z1-z2)
-            # update v's
-            mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
-            m1_mag = m1 * mag
-            m2_mag = m2 * mag
-            v1[0] -= dx * m2_mag
-            v1[1] -= dy * m2_mag
-            v1[2] -= dz * m2_mag
-            v2[0] += dx * m1_mag
-            v2[1] += dy * m1_mag
-            v2[2] += dz * m1_mag
-            
-        # for body in BODIES_KEYS:
-        for i, body in enumerate(iter(bodies_keys)):
-            (r, [vx, vy, vz], m) = bodies[body]
-            r[0] += dt * vx
-            r[1] += dt * vy
-            r[2] += dt * vz
-            
-cdef report_energy(dict bodies, set body_keypairs, double e=0.0):
+        advance the system iterations timesteps without holding the GIL
+        threads - OpenMP threads for large N, 0 uses the OpenMP default
+    '''
+    cdef Py_ssize_t[:, ::1] pairs
+    if m.shape[0] >= PARALLEL_MIN_BODIES:
+        with nogil:
+            _advance_rows(iterations, r, v, m, dt, threads)
+    else:
+        pairs = pair_array(m.shape[0])
+        with nogil:
+            _advance_pairs(iterations, r, v, m, pairs, dt)
+
+
+def report_energy(double[:, ::1] r, double[:, ::1] v, double[::1] m):
     '''
         compute the energy and return it so that it can be printed
     '''
-    
-    cdef list v1, v2, r
-    cdef double x1, x2, y1, y2, z1, z2, m1, m2, dx, dy, dz, vx, vy, vz, m
-    bodies_keys = bodies.keys()
-    
-    for (body1, body2) in body_keypairs:
-        ((x1, y1, z1), v1, m1) = bodies[body1]
-        ((x2, y2, z2), v2, m2) = bodies[body2]
-
-        (dx, dy, dz) = (x1-x2, y1-y2, z1-z2)
-        # comput energy
-        e -= (m1 * m2) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
-
-    # for body in BODIES_KEYS:
-    for i, body in enumerate(iter(bodies_keys)):
-        (r, [vx, vy, vz], m) = bodies[body]
-        e += m * (vx * vx + vy * vy + vz * vz) / 2.
-        
+    cdef Py_ssize_t n = m.shape[0], i, j
+    cdef double dx, dy, dz, ei, e = 0.0
+
+    for i in prange(n, nogil=True, schedule='dynamic'):
+        ei = 0.5 * m[i] * (v[i, 0] * v[i, 0] + v[i, 1] * v[i, 1] + v[i, 2] * v[i, 2])
+        for j in range(i + 1, n):
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            ei = ei - (m[i] * m[j]) / sqrt(dx * dx + dy * dy + dz * dz)
+        e += ei
     return e
 
-cdef offset_momentum(dict bodies, str reference, double px=0.0, double py=0.0, double pz=0.0):
+
+def offset_momentum(double[:, ::1] v, double[::1] m, Py_ssize_t reference):
     '''
-        ref is the body in the center of the system
-        offset values from this reference
+        reference is the index of the body in the center of the system
+        change its velocity so that the total momentum is zero, like
+        nbody_numpy.offset_momentum
     '''
-    
-    cdef list r, v
-    cdef double vx, vy, vz, m
-    bodies_keys = bodies.keys()
-    ref = bodies[reference]
-
-    # for body in BODIES_KEYS:
-    for i, body in enumerate(iter(bodies_keys)):
-        (r, [vx, vy, vz], m) = bodies[body]
-        px -= vx * m
-        py -= vy * m
-        pz -= vz * m
-        
-    (r, v, m) = ref
-    v[0] = px / m
-    v[1] = py / m
-    v[2] = pz / m
-
-
-def nbody(int loops, str reference, int iterations):
+    cdef Py_ssize_t i
+    cdef double px = 0.0, py = 0.0, pz = 0.0
+
+    for i in range(m.shape[0]):
+        px -= v[i, 0] * m[i]
+        py -= v[i, 1] * m[i]
+        pz -= v[i, 2] * m[i]
+
+    v[reference, 0] += px / m[reference]
+    v[reference, 1] += py / m[reference]
+    v[reference, 2] += pz / m[reference]
+
+
+def nbody(int loops, str reference, int iterations, bodies=BODIES, double dt=0.01):
     '''
         nbody simulation
         loops - number of loops to run
@@ -162,12 +212,9 @@ def nbody(int loops, str reference, int iterations):
         iterations - number of timesteps to advance
     '''
 
-    # Set up global state
-    offset_momentum(BODIES, reference)
-
-    cdef set body_pairs = set(combinations(BODIES,2)) # create unique pairs
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
 
     for _ in range(loops):
-        advance(iterations, body_pairs, BODIES)
-#         print(report_energy(BODIES, BODIES_KEYS, body_pairs))
-        report_energy(BODIES, body_pairs)
\ No newline at end of file
+        advance(iterations, r, v, m, dt)
+        print(report_energy(r, v, m))
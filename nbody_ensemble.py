@@ -0,0 +1,138 @@
+"""
+    N-body simulation.
+
+    Version: Batched ensemble, vectorized over a batch axis
+
+    For Monte Carlo stability studies many slightly perturbed copies of the
+    same system are integrated. Instead of one nbody() call (or process) per
+    member, the whole ensemble is held as
+
+        r - positions,  shape (B, N, 3)
+        v - velocities, shape (B, N, 3)
+        m - masses,     shape (B, N) or (N,) when shared by all members
+
+    and every member is advanced in the same array operations, so the Python
+    overhead of a timestep is paid once for all B members. The pair arrays
+    are built for chunks of members and rows of at most PAIRS pairs, so
+    memory stays bounded for large ensembles and large N alike.
+
+    Usage:
+
+        r, v, m = perturb(BODIES, 1000, scale=1e-6, seed=0)
+        energies = nbody(100, 'sun', 20000, r, v, m)   # shape (100, B)
+"""
+import numbers
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import BLOCK, bodies_to_arrays
+
+PAIRS = BLOCK * 1024
+
+
+def perturb(bodies, members, scale=1e-6, seed=None):
+    '''
+        ensemble of members copies of the bodies with positions and
+        velocities multiplied by (1 + scale * normal noise)
+        returns (r, v, m) with shapes (B, N, 3), (B, N, 3), (N,)
+    '''
+    _, r, v, m = bodies_to_arrays(bodies)
+    rng = np.random.default_rng(seed)
+    shape = (members,) + r.shape
+    r = r * (1.0 + scale * rng.standard_normal(shape))
+    v = v * (1.0 + scale * rng.standard_normal(shape))
+    return r, v, m
+
+
+def _masses(m, r):
+    '''
+        masses broadcast to shape (B, N)
+    '''
+    return np.broadcast_to(m, r.shape[:2])
+
+
+def accelerations(r, m, pairs=PAIRS):
+    '''
+        gravitational acceleration on every body of every member,
+        shape (B, N, 3)
+        pairs - pairs per chunk of members and rows
+    '''
+    m = _masses(m, r)
+    members, n = r.shape[:2]
+    rows = max(1, min(n, pairs // max(n, 1)))
+    chunk = max(1, pairs // (rows * max(n, 1)))
+    acc = np.empty_like(r)
+    for first in range(0, members, chunk):
+        last = min(first + chunk, members)
+        for start in range(0, n, rows):
+            stop = min(start + rows, n)
+            d = r[first:last, start:stop, None, :] - r[first:last, None, :, :]
+            dist2 = np.einsum('bijk,bijk->bij', d, d)
+            k = np.arange(stop - start)
+            dist2[:, k, k + start] = np.inf
+            mag = m[first:last, None, :] * dist2 ** (-1.5)
+            acc[first:last, start:stop] = -np.einsum('bijk,bij->bik', d, mag)
+    return acc
+
+
+def advance(iterations, r, v, m, dt):
+    '''
+        advance every member iterations timesteps (kick then drift)
+    '''
+    for _ in range(iterations):
+        v += dt * accelerations(r, m)
+        r += dt * v
+
+
+def report_energy(r, v, m, pairs=PAIRS):
+    '''
+        energy of every member, shape (B,)
+        pairs - pairs per chunk of members
+    '''
+    m = _masses(m, r)
+    members, n = r.shape[:2]
+    i, j = np.triu_indices(n, 1)
+    chunk = max(1, pairs // max(len(i), 1))
+    e = 0.5 * (m * np.einsum('bik,bik->bi', v, v)).sum(axis=1)
+    for first in range(0, members, chunk):
+        last = min(first + chunk, members)
+        d = r[first:last, i, :] - r[first:last, j, :]
+        dist = np.sqrt(np.einsum('bpk,bpk->bp', d, d))
+        e[first:last] -= (m[first:last, i] * m[first:last, j] / dist).sum(axis=1)
+    return e
+
+
+def offset_momentum(v, m, reference):
+    '''
+        reference is the index of the body in the center of the system
+        zero the total momentum of every member separately
+    '''
+    m = _masses(m, v)
+    p = -np.einsum('bi,bik->bk', m, v)
+    v[:, reference] += p / m[:, reference, None]
+
+
+def nbody(loops, reference, iterations, r, v, m, dt=0.01, names=None):
+    '''
+        ensemble nbody simulation
+        loops - number of loops to run
+        reference - index or name of the body at center of system
+        iterations - number of timesteps to advance
+        r, v, m - ensemble state, updated in place
+        names - body names, used when reference is a name
+        returns the energies of every member after every loop, (loops, B)
+    '''
+    if not isinstance(reference, numbers.Integral):
+        reference = (names or list(BODIES.keys())).index(reference)
+    offset_momentum(v, m, reference)
+
+    energies = np.empty((loops, r.shape[0]))
+    for loop in range(loops):
+        advance(iterations, r, v, m, dt)
+        energies[loop] = report_energy(r, v, m)
+    return energies
+
+if __name__ == '__main__':
+    r, v, m = perturb(BODIES, 1000, seed=0)
+    print(nbody(100, 'sun', 20000, r, v, m)[-1])
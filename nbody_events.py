@@ -0,0 +1,294 @@
+"""
+    N-body simulation.
+
+    Version: On-the-fly event detection and dense output
+
+    Close approaches, conjunctions or radius crossings used to be found by
+    storing every step and post-processing the trajectory. Here event
+    functions g(t, r, v, m) are registered with an EventDetector that runs
+    inside the step loop:
+
+        - g is evaluated once per step; a sign change between the start
+          and the end of a step brackets an event
+        - the bracket is refined on the dense output of the step, a cubic
+          Hermite interpolant of the positions through the (r, v) states at
+          both ends, by Illinois false position
+        - each event adds one row to a compact table (EVENT_DTYPE): event
+          index, time, step, direction and an optional recorded value, e.g.
+          the distance at closest approach
+
+    Dense output at arbitrary times is requested up front with sample
+    times; the positions and velocities are interpolated when the run
+    passes those times, so only the requested samples are ever kept.
+
+    Only the previous (r, v) state is held besides the live one, memory is
+    independent of the run length.
+
+    Event factories:
+
+        close_approach(i, j)          - minimum of the distance |ri - rj|,
+                                        records the distance
+        radius_crossing(i, radius, c) - |ri - rc| crosses radius
+        conjunction(i, j, c)          - i and j aligned as seen from c
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, report_energy, offset_momentum
+from nbody_integrators import INTEGRATORS
+
+EVENT_DTYPE = np.dtype([('event', '<i4'), ('time', '<f8'), ('step', '<i8'),
+                        ('direction', 'i1'), ('value', '<f8')])
+REFINE_ITERATIONS = 60
+
+
+class Event(object):
+    '''
+        event function g(t, r, v, m) with
+        direction - +1 only rising (g from - to +), -1 only falling, 0 both
+        terminal - stop the run at the end of the step holding the event
+        record - optional f(t, r, v, m) stored in the value column
+        accept - optional predicate f(t, r, v, m), events where it is false
+                 are dropped (e.g. oppositions of a conjunction function)
+    '''
+
+    def __init__(self, name, function, direction=0, terminal=False,
+                 record=None, accept=None):
+        self.name = name
+        self.function = function
+        self.direction = direction
+        self.terminal = terminal
+        self.record = record
+        self.accept = accept
+
+
+def close_approach(i, j):
+    '''
+        minimum of the distance between bodies i and j
+    '''
+    def g(t, r, v, m):
+        return np.dot(r[i] - r[j], v[i] - v[j])
+
+    def distance(t, r, v, m):
+        return np.sqrt(np.dot(r[i] - r[j], r[i] - r[j]))
+
+    return Event('approach %d-%d' % (i, j), g, direction=1, record=distance)
+
+
+def radius_crossing(i, radius, center=0, direction=0):
+    '''
+        distance of body i from body center crossing radius
+    '''
+    def g(t, r, v, m):
+        d = r[i] - r[center]
+        return np.sqrt(np.dot(d, d)) - radius
+
+    return Event('radius %d %g' % (i, radius), g, direction=direction)
+
+
+def conjunction(i, j, center=0):
+    '''
+        bodies i and j on the same line of sight from body center
+    '''
+    def g(t, r, v, m):
+        a = r[i] - r[center]
+        b = r[j] - r[center]
+        normal = np.cross(a, v[i] - v[center])
+        return np.dot(np.cross(a, b), normal)
+
+    def same_side(t, r, v, m):
+        return np.dot(r[i] - r[center], r[j] - r[center]) > 0
+
+    return Event('conjunction %d-%d' % (i, j), g, accept=same_side)
+
+
+def hermite(t, t0, r0, v0, t1, r1, v1):
+    '''
+        dense output of one step at time t, cubic Hermite interpolation
+        returns (r, v)
+    '''
+    h = t1 - t0
+    s = (t - t0) / h
+    s2 = s * s
+    s3 = s2 * s
+    r = ((2 * s3 - 3 * s2 + 1) * r0 + (s3 - 2 * s2 + s) * h * v0
+         + (3 * s2 - 2 * s3) * r1 + (s3 - s2) * h * v1)
+    v = ((6 * s2 - 6 * s) * (r0 - r1) / h + (3 * s2 - 4 * s + 1) * v0
+         + (3 * s2 - 2 * s) * v1)
+    return r, v
+
+
+class EventDetector(object):
+    '''
+        evaluates the events on every step and collects the event table
+        and the dense output samples
+        times - sorted times to sample the dense output at
+    '''
+
+    def __init__(self, events=(), times=()):
+        self.events = list(events)
+        self.times = np.sort(np.asarray(times, dtype=np.float64))
+        self.samples_r = None
+        self.samples_v = None
+        self._next = 0
+        self._rows = []
+        self._values = None
+
+    def add(self, event):
+        self.events.append(event)
+        self._values = None
+
+    @property
+    def started(self):
+        '''
+            True once the events were evaluated at an initial state; adding
+            an event resets it
+        '''
+        return self._values is not None
+
+    def start(self, t, r, v, m):
+        '''
+            evaluate the events at the initial state
+        '''
+        self._values = [e.function(t, r, v, m) for e in self.events]
+        if self.samples_r is None:
+            self.samples_r = np.empty((len(self.times),) + r.shape)
+            self.samples_v = np.empty((len(self.times),) + v.shape)
+        while self._next < len(self.times) and self.times[self._next] <= t:
+            self.samples_r[self._next] = r
+            self.samples_v[self._next] = v
+            self._next += 1
+
+    def _refine(self, event, g0, g1, m, step):
+        '''
+            time of the zero of the event function inside the step
+        '''
+        t0, t1 = step[0], step[3]
+        a, b = t0, t1
+        ga, gb = g0, g1
+        side = 0
+        tol = 4 * np.finfo(float).eps * max(abs(t0), abs(t1), 1.0)
+        t = b
+        for _ in range(REFINE_ITERATIONS):
+            t = (a * gb - b * ga) / (gb - ga)
+            if not a < t < b:
+                t = 0.5 * (a + b)
+            g = event.function(t, *(hermite(t, *step) + (m,)))
+            if g == 0 or b - a < tol:
+                break
+            if (g > 0) == (gb > 0):
+                b, gb = t, g
+                if side == -1:
+                    ga *= 0.5
+                side = -1
+            else:
+                a, ga = t, g
+                if side == 1:
+                    gb *= 0.5
+                side = 1
+        return t
+
+    def check(self, count, t0, r0, v0, t1, r1, v1, m):
+        '''
+            look for events and samples in the step from (t0, r0, v0) to
+            (t1, r1, v1); count is the step number of the end state
+            returns True if a terminal event occurred
+        '''
+        if not self.started:
+            self.start(t0, r0, v0, m)
+        step = (t0, r0, v0, t1, r1, v1)
+        terminal = False
+        found = []
+        for k, event in enumerate(self.events):
+            g0 = self._values[k]
+            g1 = event.function(t1, r1, v1, m)
+            self._values[k] = g1
+            if (g0 < 0) == (g1 < 0) or g0 == 0:
+                continue
+            direction = 1 if g1 > g0 else -1
+            if event.direction and direction != event.direction:
+                continue
+            t = self._refine(event, g0, g1, m, step)
+            r, v = hermite(t, *step)
+            if event.accept is not None and not event.accept(t, r, v, m):
+                continue
+            value = event.record(t, r, v, m) if event.record else np.nan
+            found.append((k, t, count, direction, value))
+            terminal = terminal or event.terminal
+        found.sort(key=lambda row: row[1])
+        self._rows.extend(found)
+
+        while self._next < len(self.times) and self.times[self._next] <= t1:
+            self.samples_r[self._next], self.samples_v[self._next] = hermite(
+                self.times[self._next], *step)
+            self._next += 1
+        return terminal
+
+    def table(self):
+        '''
+            the events found so far as an EVENT_DTYPE array
+        '''
+        return np.array(self._rows, dtype=EVENT_DTYPE)
+
+    def names(self):
+        return [e.name for e in self.events]
+
+    def samples(self):
+        '''
+            (times, r, v) of the dense output samples passed so far
+        '''
+        k = self._next
+        if self.samples_r is None:
+            return self.times[:0], None, None
+        return self.times[:k], self.samples_r[:k], self.samples_v[:k]
+
+
+def run(steps, r, v, m, detector, dt=0.01, integrator=None, start=0, time=0.0):
+    '''
+        advance the state in place steps timesteps, checking the events of
+        detector after every step
+        start, time - step count and time of the initial state
+        returns (steps done, time), fewer steps on a terminal event
+    '''
+    integrator = integrator or INTEGRATORS['kick-drift']()
+    if not detector.started:
+        detector.start(time, r, v, m)
+    count = start
+    for count in range(start + 1, start + steps + 1):
+        r0, v0, t0 = r.copy(), v.copy(), time
+        time += integrator.step(r, v, m, dt)
+        if detector.check(count, t0, r0, v0, time, r, v, m):
+            break
+    return count - start, time
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01, method='kick-drift'):
+    '''
+        nbody simulation reporting the closest approaches of neighbouring
+        bodies and their conjunctions as seen from the reference body
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        returns the event names and the event table
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    center = names.index(reference)
+    offset_momentum(v, m, center)
+
+    others = [i for i in range(len(names)) if i != center]
+    detector = EventDetector()
+    for i, j in zip(others, others[1:]):
+        detector.add(close_approach(i, j))
+        detector.add(conjunction(i, j, center))
+
+    integrator = INTEGRATORS[method]()
+    step, time = 0, 0.0
+    for _ in range(loops):
+        done, time = run(iterations, r, v, m, detector, dt, integrator, step, time)
+        step += done
+        print(report_energy(r, v, m))
+    return detector.names(), detector.table()
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
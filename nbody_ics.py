@@ -0,0 +1,234 @@
+"""
+    N-body initial conditions.
+
+    Loaders and generators returning the array state of nbody_numpy in the
+    shape of bodies_to_arrays, (names, r (N, 3), v (N, 3), m (N,)), with
+    offset_momentum applied, so any body count can be fed to the engines
+    instead of the 5 hard-coded BODIES. names is None when the bodies have
+    none (generated bodies, .npy files).
+
+    Loaders, by file extension:
+
+        .csv   one body per row: [name,] x, y, z, vx, vy, vz, m
+               an optional header row and name column are detected
+        .json  a BODIES style object {name: [[x, y, z], [vx, vy, vz], m]}
+               or a list of such [[x, y, z], [vx, vy, vz], m] entries
+        .npy   a float array of shape (N, 7): x, y, z, vx, vy, vz, m
+
+    Generators (units with G = 1, seeded with numpy's default_rng):
+
+        plummer(n)       - Plummer sphere, velocities from the distribution
+                           function by rejection sampling
+        uniform_cube(n)  - uniform random positions in a cube
+        disk(n)          - central mass plus a thin disk on circular orbits
+
+    All sampling is vectorized, a million bodies take a fraction of a
+    second.
+"""
+import csv
+import json
+import os
+
+import numpy as np
+
+from nbody_numpy import offset_momentum
+
+
+def _finish(r, v, m, reference=0):
+    r = np.ascontiguousarray(r, dtype=np.float64)
+    v = np.ascontiguousarray(v, dtype=np.float64)
+    m = np.ascontiguousarray(m, dtype=np.float64)
+    offset_momentum(v, m, reference)
+    return r, v, m
+
+
+def _to_center_of_mass(r, v, m):
+    '''
+        shift positions and velocities into the center of mass frame
+    '''
+    total = m.sum()
+    r -= np.dot(m, r) / total
+    v -= np.dot(m, v) / total
+
+
+def _reference_index(names, reference):
+    if reference is None:
+        return 0
+    if isinstance(reference, str):
+        if names is None:
+            raise ValueError('bodies have no names, give reference as an index')
+        return names.index(reference)
+    return int(reference)
+
+
+def load(path, reference=None):
+    '''
+        load a body set from a .csv, .json or .npy file
+        reference - name or index of the body at the center of the system,
+                    defaults to the first body
+        returns (names, r, v, m), names is None for .npy files
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        names, table = _read_csv(path)
+    elif ext == '.json':
+        names, table = _read_json(path)
+    elif ext == '.npy':
+        names, table = None, np.load(path)
+    else:
+        raise ValueError('unknown body file type %r' % ext)
+
+    table = np.asarray(table, dtype=np.float64)
+    if table.ndim != 2 or table.shape[1] != 7:
+        raise ValueError('%s: expected 7 values per body, got shape %s'
+                         % (path, table.shape))
+    r, v, m = _finish(table[:, 0:3], table[:, 3:6], table[:, 6],
+                      _reference_index(names, reference))
+    return names, r, v, m
+
+
+def _read_csv(path):
+    names = []
+    rows = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            row = [cell.strip() for cell in row]
+            if not row or row[0].startswith('#'):
+                continue
+            if len(row) == 8:
+                name, values = row[0], row[1:]
+            else:
+                name, values = None, row
+            try:
+                values = [float(x) for x in values]
+            except ValueError:
+                if not rows:
+                    # header row
+                    continue
+                raise
+            names.append(name)
+            rows.append(values)
+    if any(name is None for name in names):
+        names = None
+    return names, rows
+
+
+def _read_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        names = list(data.keys())
+        entries = [data[name] for name in names]
+    else:
+        names = None
+        entries = data
+    rows = [list(r) + list(v) + [m] for r, v, m in entries]
+    return names, rows
+
+
+def save(path, r, v, m, names=None):
+    '''
+        write a body set in the format given by the file extension
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    table = np.column_stack([r, v, m])
+    if ext == '.npy':
+        np.save(path, table)
+    elif ext == '.csv':
+        with open(path, 'w') as f:
+            writer = csv.writer(f)
+            header = ['x', 'y', 'z', 'vx', 'vy', 'vz', 'm']
+            writer.writerow((['name'] + header) if names else header)
+            for i, row in enumerate(table.tolist()):
+                writer.writerow(([names[i]] + row) if names else row)
+    elif ext == '.json':
+        names = names or [str(i) for i in range(len(m))]
+        with open(path, 'w') as f:
+            json.dump({name: [r[i].tolist(), v[i].tolist(), float(m[i])]
+                       for i, name in enumerate(names)}, f, indent=1)
+    else:
+        raise ValueError('unknown body file type %r' % ext)
+
+
+def plummer(n, seed=None, mass=1.0, a=1.0):
+    '''
+        Plummer sphere of n equal masses, total mass mass, scale radius a
+        returns (None, r, v, m)
+    '''
+    rng = np.random.default_rng(seed)
+    m = np.full(n, mass / n)
+
+    # radius from the inverted cumulative mass profile
+    x = rng.uniform(1e-10, 1.0, n)
+    radius = a / np.sqrt(x ** (-2.0 / 3.0) - 1.0)
+    r = radius[:, None] * _directions(rng, n)
+
+    # speed as a fraction q of the escape speed, g(q) = q^2 (1 - q^2)^3.5
+    q = np.empty(n)
+    todo = np.arange(n)
+    while todo.size:
+        trial = rng.random(todo.size)
+        accept = rng.random(todo.size) * 0.1 < trial ** 2 * (1.0 - trial ** 2) ** 3.5
+        q[todo[accept]] = trial[accept]
+        todo = todo[~accept]
+    escape = np.sqrt(2.0 * mass / a) * (1.0 + (radius / a) ** 2) ** -0.25
+    v = (q * escape)[:, None] * _directions(rng, n)
+
+    _to_center_of_mass(r, v, m)
+    return (None,) + _finish(r, v, m)
+
+
+def uniform_cube(n, seed=None, mass=1.0, side=1.0, sigma=0.0):
+    '''
+        n equal masses uniformly distributed in a cube of the given side,
+        with Gaussian velocities of dispersion sigma
+        returns (None, r, v, m)
+    '''
+    rng = np.random.default_rng(seed)
+    m = np.full(n, mass / n)
+    r = (rng.random((n, 3)) - 0.5) * side
+    v = sigma * rng.standard_normal((n, 3)) if sigma else np.zeros((n, 3))
+    _to_center_of_mass(r, v, m)
+    return (None,) + _finish(r, v, m)
+
+
+def disk(n, seed=None, central_mass=1.0, disk_mass=1e-3, inner=0.5, outer=5.0,
+         thickness=0.01):
+    '''
+        central mass (body 0) plus n - 1 bodies in a thin disk with surface
+        density ~ 1/R between radius inner and outer, on circular orbits
+        around the mass enclosed by their radius
+        returns (None, r, v, m)
+    '''
+    rng = np.random.default_rng(seed)
+    k = n - 1
+    m = np.empty(n)
+    m[0] = central_mass
+    m[1:] = disk_mass / k if k else 0.0
+
+    # surface density ~ 1/R makes the enclosed mass linear in R
+    radius = inner + (outer - inner) * rng.random(k)
+    phi = 2 * np.pi * rng.random(k)
+    r = np.zeros((n, 3))
+    r[1:, 0] = radius * np.cos(phi)
+    r[1:, 1] = radius * np.sin(phi)
+    r[1:, 2] = thickness * rng.standard_normal(k)
+
+    enclosed = central_mass + disk_mass * (radius - inner) / (outer - inner)
+    speed = np.sqrt(enclosed / radius)
+    v = np.zeros((n, 3))
+    v[1:, 0] = -speed * np.sin(phi)
+    v[1:, 1] = speed * np.cos(phi)
+
+    _to_center_of_mass(r, v, m)
+    return (None,) + _finish(r, v, m)
+
+
+def _directions(rng, n):
+    '''
+        n isotropic unit vectors
+    '''
+    z = rng.uniform(-1.0, 1.0, n)
+    phi = rng.uniform(0.0, 2 * np.pi, n)
+    s = np.sqrt(1.0 - z * z)
+    return np.column_stack([s * np.cos(phi), s * np.sin(phi), z])
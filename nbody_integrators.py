@@ -0,0 +1,312 @@
+"""
+    N-body simulation.
+
+    Version: Selectable integrators
+
+    The only scheme in nbody*.py is the first order kick then drift step
+    hard-coded in advance(dt). This module makes the integrator a choice:
+
+        'kick-drift' - the existing first order scheme, 1 force evaluation
+        'leapfrog'   - velocity Verlet (kick-drift-kick), second order and
+                       symplectic, 1 force evaluation per step since the
+                       closing kick is reused by the next step
+        'yoshida4'   - Yoshida's fourth order composition of leapfrog,
+                       3 force evaluations per step
+        'adaptive'   - Dormand-Prince 5(4) with an embedded error estimate
+                       and step size control to a tolerance tol
+
+    Every integrator works on the array state of nbody_numpy and counts its
+    force evaluations, so methods can be compared at equal accuracy with
+    time_to_solution().
+"""
+import time
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import (bodies_to_arrays, accelerations, report_energy,
+                         offset_momentum)
+from nbody_metrics import METRICS
+
+INTEGRATORS = {}
+
+
+def register(cls):
+    INTEGRATORS[cls.name] = cls
+    return cls
+
+
+class Integrator(object):
+    '''
+        base class, step() advances the state in place and returns the
+        timestep actually taken
+    '''
+    name = None
+    adaptive = False
+
+    def __init__(self, force=accelerations):
+        self.force = force
+        self.evaluations = 0
+
+    def acc(self, r, m):
+        self.evaluations += 1
+        if not METRICS.enabled:
+            return self.force(r, m)
+        n = len(m)
+        METRICS.count('force_evaluations')
+        METRICS.count('pair_interactions', n * (n - 1) // 2)
+        with METRICS.phase('force'):
+            return self.force(r, m)
+
+    def reset(self):
+        '''
+            drop cached forces after the state was changed from outside
+        '''
+
+    def get_state(self):
+        '''
+            internal state as a dict of arrays, for checkpoints
+        '''
+        return {}
+
+    def set_state(self, state):
+        '''
+            restore the internal state saved by get_state()
+        '''
+
+    def step(self, r, v, m, dt):
+        raise NotImplementedError
+
+
+@register
+class KickDrift(Integrator):
+    name = 'kick-drift'
+
+    def step(self, r, v, m, dt):
+        v += dt * self.acc(r, m)
+        r += dt * v
+        return dt
+
+
+@register
+class Leapfrog(Integrator):
+    name = 'leapfrog'
+
+    def __init__(self, force=accelerations):
+        Integrator.__init__(self, force)
+        self._a = None
+
+    def reset(self):
+        self._a = None
+
+    def get_state(self):
+        if self._a is None:
+            return {}
+        return {'a': self._a}
+
+    def set_state(self, state):
+        self._a = np.array(state['a']) if 'a' in state else None
+
+    def step(self, r, v, m, dt):
+        if self._a is None:
+            self._a = self.acc(r, m)
+        v += 0.5 * dt * self._a
+        r += dt * v
+        self._a = self.acc(r, m)
+        v += 0.5 * dt * self._a
+        return dt
+
+
+@register
+class Yoshida4(Integrator):
+    name = 'yoshida4'
+
+    W1 = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+    W0 = -2.0 ** (1.0 / 3.0) / (2.0 - 2.0 ** (1.0 / 3.0))
+    C = (W1 / 2, (W0 + W1) / 2, (W0 + W1) / 2, W1 / 2)
+    D = (W1, W0, W1)
+
+    def step(self, r, v, m, dt):
+        for c, d in zip(self.C, self.D):
+            r += c * dt * v
+            v += d * dt * self.acc(r, m)
+        r += self.C[3] * dt * v
+        return dt
+
+
+@register
+class Adaptive(Integrator):
+    '''
+        Dormand-Prince 5(4), the timestep follows the local error estimate
+        tol - relative/absolute error tolerance per step
+        max_dt - largest step the controller may take
+    '''
+    name = 'adaptive'
+    adaptive = True
+
+    A = ([],
+         [1 / 5],
+         [3 / 40, 9 / 40],
+         [44 / 45, -56 / 15, 32 / 9],
+         [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+         [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+         [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84])
+    # difference between the 5th and the embedded 4th order weights
+    E = (71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+
+    def __init__(self, force=accelerations, tol=1e-9, max_dt=np.inf):
+        Integrator.__init__(self, force)
+        self.tol = tol
+        self.max_dt = max_dt
+        self.dt = None
+        self.rejected = 0
+        self._k = None
+
+    def reset(self):
+        self._k = None
+
+    def get_state(self):
+        state = {}
+        if self.dt is not None:
+            state['dt'] = np.array([self.dt])
+        if self._k is not None:
+            state['kr'], state['kv'] = self._k
+        return state
+
+    def set_state(self, state):
+        self.dt = float(state['dt'][0]) if 'dt' in state else None
+        if 'kr' in state:
+            self._k = (np.array(state['kr']), np.array(state['kv']))
+        else:
+            self._k = None
+
+    def step(self, r, v, m, dt):
+        '''
+            dt is an upper bound, e.g. the time left, and the initial step
+            guess of the first call; the step taken may be smaller
+        '''
+        if self.dt is None:
+            self.dt = min(dt, self.max_dt)
+        while True:
+            h = min(self.dt, self.max_dt, dt)
+            kr, kv = [], []
+            if self._k is None:
+                self._k = (v.copy(), self.acc(r, m))
+            kr.append(self._k[0])
+            kv.append(self._k[1])
+            for a in self.A[1:]:
+                rs = r + h * sum(c * k for c, k in zip(a, kr))
+                vs = v + h * sum(c * k for c, k in zip(a, kv))
+                kr.append(vs)
+                kv.append(self.acc(rs, m))
+
+            err_r = h * sum(e * k for e, k in zip(self.E, kr))
+            err_v = h * sum(e * k for e, k in zip(self.E, kv))
+            err = max(np.sqrt(np.mean((err_r / (self.tol * (1.0 + np.abs(rs)))) ** 2)),
+                      np.sqrt(np.mean((err_v / (self.tol * (1.0 + np.abs(vs)))) ** 2)))
+            factor = 0.9 * err ** -0.2 if err > 0 else 5.0
+            if err <= 1.0:
+                # the last stage is the 5th order solution (FSAL)
+                r[...] = rs
+                v[...] = vs
+                self._k = (kr[-1], kv[-1])
+                if h == self.dt:
+                    self.dt = h * min(5.0, factor)
+                return h
+            self.rejected += 1
+            self.dt = h * max(0.2, factor)
+
+
+def integrate(integrator, duration, r, v, m, dt):
+    '''
+        advance the state by duration time units
+        dt - the timestep, for adaptive integrators only the initial guess,
+             their steps are bounded by the time left and their max_dt
+    '''
+    if integrator.adaptive and integrator.dt is None:
+        integrator.dt = min(dt, integrator.max_dt)
+    t = 0.0
+    while duration - t > 1e-12 * duration:
+        left = duration - t
+        t += integrator.step(r, v, m, left if integrator.adaptive else min(dt, left))
+
+
+def nbody(loops, reference, iterations, method='leapfrog', dt=0.01, tol=1e-9,
+          bodies=BODIES):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps of size dt per loop
+        method - name of the integrator, see INTEGRATORS
+        tol - error tolerance of the adaptive integrator
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    if method == 'adaptive':
+        integrator = Adaptive(tol=tol)
+    else:
+        integrator = INTEGRATORS[method]()
+
+    for _ in range(loops):
+        if method == 'adaptive':
+            integrate(integrator, iterations * dt, r, v, m, dt)
+        else:
+            for _ in range(iterations):
+                integrator.step(r, v, m, dt)
+        print(report_energy(r, v, m))
+
+
+def energy_drift(integrator, duration, dt, bodies=BODIES, reference='sun', samples=10):
+    '''
+        largest relative energy error |E - E0| / |E0| seen at samples
+        evenly spaced times over duration
+    '''
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    e0 = report_energy(r, v, m)
+    drift = 0.0
+    for _ in range(samples):
+        integrate(integrator, duration / samples, r, v, m, dt)
+        drift = max(drift, abs((report_energy(r, v, m) - e0) / e0))
+    return drift
+
+
+def time_to_solution(target, duration, methods=None, dt=0.1, bodies=BODIES,
+                     reference='sun', refinements=12):
+    '''
+        for every method find the largest step (halving dt, or dividing
+        the tolerance of the adaptive method by 10) that keeps the energy
+        drift over duration below target
+        returns a list of dicts with the force evaluations and the wall
+        clock time needed at that accuracy
+    '''
+    result = []
+    for method in methods or sorted(INTEGRATORS):
+        step, tol = dt, 1e-4
+        for _ in range(refinements):
+            if method == 'adaptive':
+                integrator = Adaptive(tol=tol)
+            else:
+                integrator = INTEGRATORS[method]()
+            start = time.time()
+            drift = energy_drift(integrator, duration, step, bodies, reference)
+            seconds = time.time() - start
+            if drift <= target:
+                break
+            if method == 'adaptive':
+                tol /= 10
+            else:
+                step /= 2
+        result.append({'method': method,
+                       'dt': step,
+                       'tol': tol if method == 'adaptive' else None,
+                       'drift': float(drift),
+                       'evaluations': integrator.evaluations,
+                       'seconds': seconds,
+                       'converged': bool(drift <= target)})
+    return result
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
@@ -0,0 +1,187 @@
+"""
+    N-body instrumentation.
+
+    Phase timers and counters built into the step loops, so a production
+    run can be profiled without attaching cProfile or %prun:
+
+        phases    force, drift, step, diagnostics, io - call count, total
+                  and longest wall time of every phase
+        counters  steps, force_evaluations, pair_interactions, bytes_written
+        rates     steps_per_second and pair_interactions_per_second derived
+                  from the counters and the step / force phase times
+
+    The instrumented modules share the METRICS instance. It is off unless
+    NBODY_METRICS=1 is set, and can be switched at runtime:
+
+        from nbody_metrics import METRICS
+        METRICS.enable()
+        nbody_numpy.nbody(10, 'sun', 1000)
+        print(METRICS.to_prometheus())
+
+    When disabled, the step loops check METRICS.enabled once per advance()
+    call and run their original uninstrumented loop; the remaining hooks
+    (one per force evaluation, report or write) cost an attribute test and,
+    for phase(), a shared no-op context manager.
+
+    Exports are a JSON document (to_json) and the Prometheus text
+    exposition format (to_prometheus); dump() picks one by file extension.
+"""
+import json
+import os
+import threading
+import time
+
+PREFIX = 'nbody'
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics(object):
+    '''
+        phase timers and counters, safe to update from several threads
+    '''
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        '''
+            drop all recorded timings and counts
+        '''
+        with self._lock:
+            self.phases = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def phase(self, name):
+        '''
+            context manager timing the enclosed block as phase name
+        '''
+        if not self.enabled:
+            return _NULL
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        '''
+            add one timed call of phase name
+        '''
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def count(self, name, n=1):
+        '''
+            add n to counter name, a no-op when disabled
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        '''
+            plain dict of the phases, counters and derived rates
+        '''
+        with self._lock:
+            phases = {name: {'calls': calls, 'seconds': total, 'max_seconds': longest}
+                      for name, (calls, total, longest) in self.phases.items()}
+            counters = dict(self.counters)
+        rates = {}
+        for rate, counter, phase in (('steps_per_second', 'steps', 'step'),
+                                     ('pair_interactions_per_second',
+                                      'pair_interactions', 'force')):
+            seconds = phases.get(phase, {}).get('seconds', 0.0)
+            if counter in counters and seconds > 0.0:
+                rates[rate] = counters[counter] / seconds
+        return {'enabled': self.enabled,
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'phases': phases,
+                'counters': counters,
+                'rates': rates}
+
+    def to_json(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent, sort_keys=True)
+
+    def to_prometheus(self, prefix=PREFIX):
+        '''
+            the snapshot in the Prometheus text exposition format
+        '''
+        snap = self.snapshot()
+        lines = []
+
+        def family(name, kind, text, samples):
+            if not samples:
+                return
+            lines.append('# HELP %s_%s %s' % (prefix, name, text))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for labels, value in samples:
+                lines.append('%s_%s%s %r' % (prefix, name, labels, float(value)))
+
+        phases = sorted(snap['phases'].items())
+        family('phase_seconds_total', 'counter', 'Wall time spent in the phase.',
+               [('{phase="%s"}' % name, p['seconds']) for name, p in phases])
+        family('phase_calls_total', 'counter', 'Number of timed calls of the phase.',
+               [('{phase="%s"}' % name, p['calls']) for name, p in phases])
+        family('phase_max_seconds', 'gauge', 'Longest single call of the phase.',
+               [('{phase="%s"}' % name, p['max_seconds']) for name, p in phases])
+        for name, value in sorted(snap['counters'].items()):
+            family('%s_total' % name, 'counter', 'Number of %s.' % name.replace('_', ' '),
+                   [('', value)])
+        for name, value in sorted(snap['rates'].items()):
+            family(name, 'gauge', 'Rate of %s.' % name.replace('_per_second', '').replace('_', ' '),
+                   [('', value)])
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        '''
+            write the snapshot to path, Prometheus text for .prom files,
+            JSON otherwise
+        '''
+        if os.path.splitext(path)[1] == '.prom':
+            text = self.to_prometheus()
+        else:
+            text = self.to_json(indent=1)
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+METRICS = Metrics(os.environ.get('NBODY_METRICS', '') == '1')
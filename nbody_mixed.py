@@ -0,0 +1,245 @@
+"""
+    N-body simulation.
+
+    Version: Mixed precision with compensated accumulation
+
+    On large N the force loop is bound by memory traffic, so the pair work
+    is done in float32, halving the bytes moved per pair:
+
+        positions   float32 storage per coordinate, shape (3, N); every
+                    drift is added with a float32 Kahan compensation term
+                    so the rounding error does not pile up over many steps
+        forces      pair deltas, distances and magnitudes in float32, the
+                    column tiles of every row are summed in float32 and the
+                    tile sums are accumulated in float64 with Neumaier
+                    compensation
+        velocities  float64
+        energy      pair terms in float32, accumulated in float64 with
+                    Neumaier compensation; kinetic energy in float64
+
+    compare_drift() runs this mode and the float64 numpy engine side by side
+    from the same initial state and reports the energy drift of both, which
+    is the accuracy cost of the mode.
+
+    MixedState(..., dtype=np.float64) runs the same (3, N) layout, tiling
+    and compensation in float64. It is the baseline for the speed of the
+    mode: part of the gain over nbody_numpy.accelerations comes from the
+    planar layout alone, which avoids the (rows, N, 3) delta temporaries.
+    compare_speed() times all three, the nbody_bench cases mixed,
+    mixed:float64 and mixed:numba track them. With engine='numba' the
+    forces come from the nbody_numba.mixed_accelerations kernel (pair math
+    in the storage dtype, float64 sums).
+
+    One force evaluation, N = 3000 Plummer sphere, one core:
+
+        nbody_numpy.accelerations     0.27 s
+        mixed, float64 (baseline)     0.11 s
+        mixed, float32                0.05 s   2.3x over the baseline
+        mixed:numba, float64/float32  0.04 s   no gain, the scalar loop is
+                                               bound by the divide and sqrt
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import (bodies_to_arrays, accelerations, report_energy,
+                         kinetic_energy, offset_momentum)
+
+BLOCK = 256
+TILE = 1024
+
+
+def neumaier_add(total, comp, x):
+    '''
+        add x to total with Neumaier compensation, element-wise
+        returns the new (total, comp); the sum is total + comp
+    '''
+    t = total + x
+    big = np.abs(total) >= np.abs(x)
+    comp = comp + np.where(big, (total - t) + x, (x - t) + total)
+    return t, comp
+
+
+class MixedState(object):
+    '''
+        float32 positions with Kahan compensation, float64 velocities
+        positions are stored per coordinate, shape (3, N), so the pair
+        arrays of a row block are plain 2-D float32 arrays
+        dtype - storage and pair dtype, np.float64 for the baseline
+        engine - 'numpy', or 'numba' for the compiled force kernel
+    '''
+
+    def __init__(self, r, v, m, dtype=np.float32, engine='numpy'):
+        self.dtype = np.dtype(dtype)
+        self.r = np.ascontiguousarray(np.asarray(r).T, dtype=self.dtype)
+        self.r_comp = np.zeros_like(self.r)
+        self.v = np.array(v, dtype=np.float64)
+        self.m = np.asarray(m, dtype=np.float64)
+        self.m32 = self.m.astype(self.dtype)
+        if engine == 'numba':
+            from nbody_numba import mixed_accelerations
+            self._kernel = mixed_accelerations
+        elif engine == 'numpy':
+            self._kernel = None
+        else:
+            raise ValueError('unknown engine %r' % engine)
+
+    def positions(self):
+        '''
+            float64 positions including the compensation term, (N, 3)
+        '''
+        return (self.r.astype(np.float64) - self.r_comp).T.copy()
+
+    def _pairs(self, start, stop, first, last):
+        '''
+            float32 deltas and squared distances of a (rows, columns) tile
+        '''
+        x, y, z = self.r
+        dx = x[start:stop, None] - x[None, first:last]
+        dy = y[start:stop, None] - y[None, first:last]
+        dz = z[start:stop, None] - z[None, first:last]
+        dist2 = dx * dx
+        dist2 += dy * dy
+        dist2 += dz * dz
+        return dx, dy, dz, dist2
+
+    def accelerations(self, block=BLOCK, tile=TILE):
+        '''
+            float32 pair forces, float64 compensated per body sums, (N, 3)
+        '''
+        m = self.m32
+        n = len(m)
+        acc = np.zeros((n, 3))
+        if self._kernel is not None:
+            self._kernel(self.r, m, acc)
+            return acc
+        comp = np.zeros((n, 3))
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            for first in range(0, n, tile):
+                last = min(first + tile, n)
+                dx, dy, dz, dist2 = self._pairs(start, stop, first, last)
+                # remove the self interaction where the tile holds the diagonal
+                diag = np.arange(max(start, first), min(stop, last))
+                dist2[diag - start, diag - first] = np.inf
+                mag = m[first:last] / (dist2 * np.sqrt(dist2))
+                part = -np.column_stack([np.einsum('ij,ij->i', dx, mag),
+                                         np.einsum('ij,ij->i', dy, mag),
+                                         np.einsum('ij,ij->i', dz, mag)])
+                acc[start:stop], comp[start:stop] = neumaier_add(
+                    acc[start:stop], comp[start:stop], part)
+        return acc + comp
+
+    def drift(self, dt):
+        '''
+            r += dt * v with Kahan compensation in float32
+        '''
+        y = (dt * self.v.T).astype(self.dtype) - self.r_comp
+        t = self.r + y
+        self.r_comp = (t - self.r) - y
+        self.r = t
+
+    def advance(self, iterations, dt):
+        '''
+            advance the system iterations timesteps (kick then drift)
+        '''
+        for _ in range(iterations):
+            self.v += dt * self.accelerations()
+            self.drift(dt)
+
+    def potential_energy(self, block=BLOCK, tile=TILE):
+        m = self.m32
+        n = len(m)
+        total = np.zeros(1)
+        comp = np.zeros(1)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            rows = np.arange(start, stop)
+            for first in range(start, n, tile):
+                last = min(first + tile, n)
+                dist2 = self._pairs(start, stop, first, last)[3]
+                # only count j > i so each pair is seen once
+                dist2[np.arange(first, last)[None, :] <= rows[:, None]] = np.inf
+                part = np.dot(m[start:stop], (m[first:last] / np.sqrt(dist2)).sum(axis=1))
+                total, comp = neumaier_add(total, comp, -np.float64(part))
+        return float(total[0] + comp[0])
+
+    def report_energy(self):
+        '''
+            compute the energy and return it so that it can be printed
+        '''
+        return self.potential_energy() + kinetic_energy(self.v, self.m)
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01):
+    '''
+        nbody simulation in mixed precision
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    state = MixedState(r, v, m)
+
+    for _ in range(loops):
+        state.advance(iterations, dt)
+        print(state.report_energy())
+
+
+def compare_drift(loops, reference, iterations, bodies=BODIES, dt=0.01,
+                  state=None):
+    '''
+        run the float64 engine and the mixed mode from the same initial
+        state; returns a list of (loop, float64 drift, mixed drift) where
+        drift is the relative energy error |E - E0| / |E0|
+        state - (r, v, m) arrays to use instead of bodies
+    '''
+    if state is None:
+        names, r, v, m = bodies_to_arrays(bodies)
+        offset_momentum(v, m, names.index(reference))
+    else:
+        r, v, m = (np.array(a, dtype=np.float64) for a in state)
+    mixed = MixedState(r, v, m)
+
+    e0 = report_energy(r, v, m)
+    result = []
+    for loop in range(loops):
+        for _ in range(iterations):
+            v += dt * accelerations(r, m)
+            r += dt * v
+        mixed.advance(iterations, dt)
+        result.append((loop,
+                       abs((report_energy(r, v, m) - e0) / e0),
+                       abs((mixed.report_energy() - e0) / e0)))
+    return result
+
+def compare_speed(n=2000, steps=5, seed=0, engines=('numpy',)):
+    '''
+        seconds per step of nbody_numpy.accelerations and of this mode in
+        float32 and float64, same initial state of n bodies
+        returns a dict name -> seconds, the baseline of the float32 speedup
+        is the float64 entry of the same engine
+    '''
+    import time
+    import nbody_ics
+    names, r, v, m = nbody_ics.plummer(n, seed=seed)
+
+    def best(step):
+        step()
+        times = []
+        for _ in range(steps):
+            start = time.perf_counter()
+            step()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    result = {'numpy': best(lambda: accelerations(r, m))}
+    for engine in engines:
+        for dtype in (np.float32, np.float64):
+            state = MixedState(r, v, m, dtype, engine)
+            result['%s %s' % (engine, np.dtype(dtype).name)] = best(state.accelerations)
+    return result
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
@@ -0,0 +1,222 @@
+'''
+Description: MPI-distributed N-body simulation with ring-pass force computation
+
+Every rank owns a contiguous block of bodies (positions, velocities, masses).
+To compute the forces on its own block, a rank needs every other block once:
+the position/mass blocks travel around a ring of ranks, rank i always sending
+to rank i+1 and receiving from rank i-1. The transfer of the next block is
+started with nonblocking Isend/Irecv before the local force computation on
+the current block, so communication overlaps with computation.
+
+After size ring steps every rank has seen every block, kicks and drifts its
+own bodies. The energy is computed with the same ring and summed with a
+reduction on rank 0.
+
+The memory per rank is O(N / size), so a single simulation can span several
+nodes. The initial state is either scattered from rank 0 with Scatterv (a
+BODIES dict only exists there anyway) or, for large runs, read from an .npy
+body table of nbody_ics (N rows of x, y, z, vx, vy, vz, m) where every rank
+maps the file and copies only the rows of its own block.
+
+Call by: mpiexec -n <the total number of processes> python nbody_mpi.py
+'''
+
+import numpy as np
+from mpi4py import MPI
+
+from nbody_opt import BODIES
+from nbody_numpy import BLOCK, bodies_to_arrays, kinetic_energy
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+TAG = 17
+
+
+def block_bounds(n, size):
+    '''
+        (first, last) body index of the block owned by every rank
+    '''
+    edges = np.linspace(0, n, size + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def scatter_state(r, v, m, comm=comm):
+    '''
+        distribute the state held by rank 0 (None elsewhere) with Scatterv,
+        every rank receives only its own block
+        returns the local (r, v, m)
+    '''
+    rank = comm.Get_rank()
+    n = comm.bcast(len(m) if rank == 0 else None, root=0)
+    bounds = block_bounds(n, comm.Get_size())
+    counts = [(last - first) * 7 for first, last in bounds]
+    displs = [first * 7 for first, _ in bounds]
+    table = None
+    if rank == 0:
+        table = np.ascontiguousarray(np.column_stack([r, v, m]))
+    first, last = bounds[rank]
+    local = np.empty((last - first, 7))
+    comm.Scatterv([table, counts, displs, MPI.DOUBLE], local, root=0)
+    return _split(local)
+
+
+def load_block(path, comm=comm):
+    '''
+        local block of an .npy body table, read through a memory map so
+        no rank reads more than its own rows
+        returns (n, r, v, m)
+    '''
+    table = np.load(path, mmap_mode='r')
+    n = len(table)
+    first, last = block_bounds(n, comm.Get_size())[comm.Get_rank()]
+    return (n,) + _split(np.array(table[first:last], dtype=np.float64))
+
+
+def _split(table):
+    return (np.ascontiguousarray(table[:, 0:3]),
+            np.ascontiguousarray(table[:, 3:6]),
+            np.ascontiguousarray(table[:, 6]))
+
+
+def offset_momentum(v, m, reference, bounds, comm=comm):
+    '''
+        change the velocity of body reference (a global index) so that the
+        total momentum of all blocks is zero
+    '''
+    p = comm.allreduce(np.dot(m, v), op=MPI.SUM)
+    first, last = bounds[comm.Get_rank()]
+    if first <= reference < last:
+        v[reference - first] -= p / m[reference - first]
+
+
+def _pack(r, m, width):
+    '''
+        positions and masses of a block in one (width, 4) send buffer,
+        padded rows carry zero mass
+    '''
+    buf = np.zeros((width, 4))
+    buf[:len(m), :3] = r
+    buf[:len(m), 3] = m
+    return buf
+
+
+def _ring(r, m, bounds, comm, visit):
+    '''
+        pass every block once around the ring of ranks and call
+        visit(positions, masses, same) for it, where same is True when the
+        visiting block is the local one
+    '''
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    width = max(last - first for first, last in bounds)
+    current = _pack(r, m, width)
+    incoming = np.empty_like(current)
+    dest = (rank + 1) % size
+    source = (rank - 1) % size
+
+    for step in range(size):
+        if step < size - 1:
+            reqs = [comm.Isend(current, dest=dest, tag=TAG),
+                    comm.Irecv(incoming, source=source, tag=TAG)]
+        # block that started on rank - step
+        first, last = bounds[(rank - step) % size]
+        count = last - first
+        visit(current[:count, :3], current[:count, 3], step == 0)
+        if step < size - 1:
+            MPI.Request.Waitall(reqs)
+            current, incoming = incoming, current
+
+
+def accelerations(r, m, bounds, comm=comm, block=BLOCK):
+    '''
+        acceleration on the local block from all blocks in the ring
+        the local rows are processed block rows at a time, so the pair
+        temporaries stay (block, N / size) whatever the local block size
+    '''
+    acc = np.zeros_like(r)
+
+    def visit(r2, m2, same):
+        if not len(m2) or not len(r):
+            return
+        for start in range(0, len(r), block):
+            stop = min(start + block, len(r))
+            d = r[start:stop, None, :] - r2[None, :, :]
+            dist2 = np.einsum('ijk,ijk->ij', d, d)
+            if same:
+                rows = np.arange(stop - start)
+                dist2[rows, rows + start] = np.inf
+            acc[start:stop] -= np.einsum('ijk,ij->ik', d, m2 * dist2 ** (-1.5))
+
+    _ring(r, m, bounds, comm, visit)
+    return acc
+
+
+def advance(iterations, r, v, m, bounds, dt, comm=comm):
+    '''
+        advance the local block iterations timesteps (kick then drift)
+    '''
+    for _ in range(iterations):
+        v += dt * accelerations(r, m, bounds, comm)
+        r += dt * v
+
+
+def report_energy(r, v, m, bounds, comm=comm, block=BLOCK):
+    '''
+        total energy of the distributed system, valid on rank 0
+    '''
+    e = [kinetic_energy(v, m)]
+
+    def visit(r2, m2, same):
+        if not len(m2) or not len(r):
+            return
+        for start in range(0, len(r), block):
+            stop = min(start + block, len(r))
+            d = r[start:stop, None, :] - r2[None, :, :]
+            dist2 = np.einsum('ijk,ijk->ij', d, d)
+            if same:
+                rows = np.arange(stop - start)
+                dist2[rows, rows + start] = np.inf
+            # every pair is visited by both of its ranks
+            e[0] -= 0.5 * np.dot(m[start:stop], (m2 / np.sqrt(dist2)).sum(axis=1))
+
+    _ring(r, m, bounds, comm, visit)
+    return comm.reduce(e[0], op=MPI.SUM, root=0)
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01, comm=comm,
+          path=None):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system, an index when path is given
+        iterations - number of timesteps to advance
+        path - .npy body table to load the blocks from instead of bodies
+    '''
+    rank = comm.Get_rank()
+
+    if path is not None:
+        n, r, v, m = load_block(path, comm)
+    else:
+        # the dict exists on rank 0 only, the other ranks get their blocks
+        if rank == 0:
+            names, r, v, m = bodies_to_arrays(bodies)
+            reference = names.index(reference)
+        else:
+            r = v = m = None
+        reference = comm.bcast(reference, root=0)
+        r, v, m = scatter_state(r, v, m, comm)
+        n = comm.allreduce(len(m), op=MPI.SUM)
+
+    bounds = block_bounds(n, comm.Get_size())
+    offset_momentum(v, m, int(reference), bounds, comm)
+
+    for _ in range(loops):
+        advance(iterations, r, v, m, bounds, dt, comm)
+        e = report_energy(r, v, m, bounds, comm)
+        if rank == 0:
+            print(e)
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
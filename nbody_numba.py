@@ -8,123 +8,210 @@
     Add a vectorized ufunc to the nbody_numba.py program called vec_deltas
 
     Change structure of BODIES
+
+    Version: nopython engine over flat float64 arrays
+
+    The first version jit-decorated functions that read the global 3-D
+    BODIES array, unpacked Python lists and used char signatures, which
+    numba cannot compile in nopython mode. The kernels now take the array
+    state of nbody_numpy as arguments:
+
+        r, v - float64[:, ::1], shape (N, 3)
+        m    - float64[::1],    shape (N,)
+
+    - every kernel is @njit with an explicit signature and cache=True, so
+      it is compiled once, written to __pycache__ and loaded from there by
+      every later process; warmup() forces the load up front
+    - advance_parallel spreads the bodies over all cores with prange, each
+      body summing its own row of forces so no two threads write the same
+      velocity; advance_pairs is the serial pair loop of nbody_opt that
+      applies both sides of a pair at once
+    - advance() picks advance_parallel from PARALLEL_MIN_BODIES bodies on
+    - mixed_accelerations is the force kernel of nbody_mixed.MixedState:
+      positions per coordinate, shape (3, N), in float32 (or float64 for
+      the baseline); the pair terms are computed in that dtype and summed
+      per body in float64
+    - fastmath is off by default; set NBODY_NUMBA_FASTMATH=1 before import
+      to allow reordering of the floating point operations
+    - the parallel kernels run on numba's workqueue threading layer unless
+      NUMBA_THREADING_LAYER says otherwise: a process that ran them on the
+      TBB layer and then forked (the process pools of nbody_sweep,
+      nbody_parareal and nbody_shm) hangs at exit
 """
+import os
+
 import numpy as np
-from numba import void, jit, int32, float64, typeof, char, vectorize, int_
-from itertools import combinations
-
-PI = 3.14159265358979323
-SOLAR_MASS = 4 * PI * PI
-DAYS_PER_YEAR = 365.24
-
-BODIES_KEYS = np.array( ['sun', 'jupiter', 'saturn', 'uranus', 'neptune'])
-
-BODIES = np.array( [ ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [39.4784176044, 0.0, 0.0]),
-                  
-                ([4.84143144246472090e+00,-1.16032004402742839e+00,-1.03622044471123109e-01],
-                [1.66007664274403694e-03 * DAYS_PER_YEAR,7.69901118419740425e-03 * DAYS_PER_YEAR, -6.90460016972063023e-05 * DAYS_PER_YEAR],
-                [9.54791938424326609e-04 * 39.4784176044, 0.0, 0.0] ),
-
-                ([8.34336671824457987e+00,4.12479856412430479e+00,-4.03523417114321381e-01],
-                [-2.76742510726862411e-03 * DAYS_PER_YEAR,4.99852801234917238e-03 * DAYS_PER_YEAR,2.30417297573763929e-05 * DAYS_PER_YEAR],
-                [2.85885980666130812e-04 * 39.4784176044, 0.0, 0.0] ),
-                
-                ([1.28943695621391310e+01,-1.51111514016986312e+01,-2.23307578892655734e-01],
-                 [2.96460137564761618e-03 * DAYS_PER_YEAR,2.37847173959480950e-03 * DAYS_PER_YEAR,-2.96589568540237556e-05 * DAYS_PER_YEAR],
-                 [4.36624404335156298e-05 * 39.4784176044, 0.0, 0.0] ),
-                  
-                ([1.53796971148509165e+01,-2.59193146099879641e+01,1.79258772950371181e-01],
-                 [2.68067772490389322e-03 * DAYS_PER_YEAR,1.62824170038242295e-03 * DAYS_PER_YEAR,-9.51592254519715870e-05 * DAYS_PER_YEAR],
-                 [5.15138902046611451e-05 * 39.4784176044, 0.0, 0.0] ) ],
-                  
-                  dtype = np.float64
-                 )
-
-
-@vectorize([float64(float64, float64)])
+from numba import config, njit, prange, vectorize, void, int64, float32, float64
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays
+
+FASTMATH = os.environ.get('NBODY_NUMBA_FASTMATH', '') == '1'
+if 'NUMBA_THREADING_LAYER' not in os.environ:
+    config.THREADING_LAYER = 'workqueue'
+PARALLEL_MIN_BODIES = 64
+
+STATE = (float64[:, ::1], float64[:, ::1], float64[::1])
+
+
+@vectorize([float64(float64, float64)], cache=True)
 def vec_deltas(x, y):
     return x - y
 
-@jit(int32(char))
-def get_index(reference):
-    idx = 0;
-    while(BODIES_KEYS[idx] != reference ):
-        idx += 1
-    return idx;
-    
 
-@jit(void(int32, int32[:,:], float64))
-def advance(iterations, body_keypairs, dt):
+@njit(void(int64, *STATE, float64), cache=True, fastmath=FASTMATH)
+def advance_pairs(iterations, r, v, m, dt):
+    '''
+        advance the system iterations timesteps, serial pair loop
+    '''
+    n = m.shape[0]
+    for _ in range(iterations):
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                dx = r[i, 0] - r[j, 0]
+                dy = r[i, 1] - r[j, 1]
+                dz = r[i, 2] - r[j, 2]
+                # update v's
+                mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+                mi_mag = m[i] * mag
+                mj_mag = m[j] * mag
+                v[i, 0] -= dx * mj_mag
+                v[i, 1] -= dy * mj_mag
+                v[i, 2] -= dz * mj_mag
+                v[j, 0] += dx * mi_mag
+                v[j, 1] += dy * mi_mag
+                v[j, 2] += dz * mi_mag
+
+        for i in range(n):
+            r[i, 0] += dt * v[i, 0]
+            r[i, 1] += dt * v[i, 1]
+            r[i, 2] += dt * v[i, 2]
+
+
+@njit(void(int64, *STATE, float64), cache=True, parallel=True, fastmath=FASTMATH)
+def advance_parallel(iterations, r, v, m, dt):
     '''
-        advance the system one timestep
+        advance the system iterations timesteps, bodies spread over cores
     '''
-    length = len(BODIES_KEYS)
+    n = m.shape[0]
     for _ in range(iterations):
-        for (body1, body2) in body_keypairs:
-            (l1, v1, m1) = BODIES[body1]
-            (l2, v2, m2) = BODIES[body2]
-            (dx, dy, dz) = vec_deltas(l1,l2)
-            # update v's
-            mag = dt * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
-            m1_mag = m1[0] * mag
-            m2_mag = m2[0] * mag
-            v1[0] -= dx * m2_mag
-            v1[1] -= dy * m2_mag
-            v1[2] -= dz * m2_mag
-            v2[0] += dx * m1_mag
-            v2[1] += dy * m1_mag
-            v2[2] += dz * m1_mag
-        
-        for body in range(length):
-            (r, [vx, vy, vz], m) = BODIES[body]
-            r[0] += dt * vx
-            r[1] += dt * vy
-            r[2] += dt * vz
-
-@jit(void(int32[:,:],float64))
-def report_energy(body_keypairs, e=0.0):
+        for i in prange(n):
+            ax = 0.0
+            ay = 0.0
+            az = 0.0
+            for j in range(n):
+                if j != i:
+                    dx = r[i, 0] - r[j, 0]
+                    dy = r[i, 1] - r[j, 1]
+                    dz = r[i, 2] - r[j, 2]
+                    mag = m[j] * ((dx * dx + dy * dy + dz * dz) ** (-1.5))
+                    ax -= dx * mag
+                    ay -= dy * mag
+                    az -= dz * mag
+            v[i, 0] += dt * ax
+            v[i, 1] += dt * ay
+            v[i, 2] += dt * az
+
+        for i in prange(n):
+            r[i, 0] += dt * v[i, 0]
+            r[i, 1] += dt * v[i, 1]
+            r[i, 2] += dt * v[i, 2]
+
+
+@njit(float64(*STATE), cache=True, parallel=True, fastmath=FASTMATH)
+def report_energy(r, v, m):
     '''
         compute the energy and return it so that it can be printed
     '''
-    length = len(BODIES_KEYS)
-    
-    for (body1, body2) in body_keypairs:
-        ([x1,y1,z1], v1, m1) = BODIES[body1]
-        ([x2,y2,z2], v2, m2) = BODIES[body2]
-        (dx, dy, dz) = (x1-x2, y1-y2,z1-z2)
-        # comput energy
-        e -= (m1[0] * m2[0]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
-    
-    for body in range(length):
-        (r, [vx, vy, vz], m) = BODIES[body]
-        e += m[0] * (vx * vx + vy * vy + vz * vz) / 2.
-    
+    n = m.shape[0]
+    e = 0.0
+    for i in prange(n):
+        ei = 0.5 * m[i] * (v[i, 0] * v[i, 0] + v[i, 1] * v[i, 1] + v[i, 2] * v[i, 2])
+        for j in range(i + 1, n):
+            dx = r[i, 0] - r[j, 0]
+            dy = r[i, 1] - r[j, 1]
+            dz = r[i, 2] - r[j, 2]
+            ei -= (m[i] * m[j]) / ((dx * dx + dy * dy + dz * dz) ** 0.5)
+        e += ei
     return e
 
-@jit(void(char, float64, float64, float64))
-def offset_momentum(reference, px=0.0, py=0.0, pz=0.0):
-    '''
-        ref is the body in the center of the system
-        offset values from this reference
-    '''
-    
-    length = len(BODIES_KEYS)
-    idx = get_index(reference)
-    ref = BODIES[idx]
-    
-    for body in range(length):
-        (r, [vx, vy, vz], m) = BODIES[body]
-        px -= vx * m[0]
-        py -= vy * m[0]
-        pz -= vz * m[0]
-        
-    (r, v, m) = ref
-    v[0] = px / m[0]
-    v[1] = py / m[0]
-    v[2] = pz / m[0]
-
-@jit(void(int32,char,float64))
-def nbody(loops, reference, iterations):
+
+@njit(void(float64[:, ::1], float64[::1], int64), cache=True, fastmath=FASTMATH)
+def offset_momentum(v, m, reference):
+    '''
+        reference is the index of the body in the center of the system
+        change its velocity so that the total momentum is zero, like
+        nbody_numpy.offset_momentum
+    '''
+    px = 0.0
+    py = 0.0
+    pz = 0.0
+    for i in range(m.shape[0]):
+        px -= v[i, 0] * m[i]
+        py -= v[i, 1] * m[i]
+        pz -= v[i, 2] * m[i]
+    v[reference, 0] += px / m[reference]
+    v[reference, 1] += py / m[reference]
+    v[reference, 2] += pz / m[reference]
+
+
+@njit([void(float32[:, ::1], float32[::1], float64[:, ::1]),
+       void(float64[:, ::1], float64[::1], float64[:, ::1])],
+      cache=True, parallel=True, fastmath=FASTMATH)
+def mixed_accelerations(r, m, acc):
+    '''
+        acceleration of every body from (3, N) positions into acc (N, 3)
+        pair terms in the dtype of r and m, per body sums in float64
+    '''
+    n = m.shape[0]
+    for i in prange(n):
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        for j in range(n):
+            if j != i:
+                dx = r[0, i] - r[0, j]
+                dy = r[1, i] - r[1, j]
+                dz = r[2, i] - r[2, j]
+                dist2 = dx * dx + dy * dy + dz * dz
+                mag = m[j] / (dist2 * np.sqrt(dist2))
+                ax -= dx * mag
+                ay -= dy * mag
+                az -= dz * mag
+        acc[i, 0] = ax
+        acc[i, 1] = ay
+        acc[i, 2] = az
+
+
+def advance(iterations, r, v, m, dt):
+    '''
+        advance the system iterations timesteps with the faster kernel for
+        the body count
+    '''
+    if len(m) >= PARALLEL_MIN_BODIES:
+        advance_parallel(iterations, r, v, m, dt)
+    else:
+        advance_pairs(iterations, r, v, m, dt)
+
+
+def warmup():
+    '''
+        run every kernel once on a tiny state so a fresh process has them
+        loaded (from the on-disk cache when available) before stepping
+    '''
+    r = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+    v = np.zeros((2, 3))
+    m = np.ones(2)
+    advance_pairs(1, r, v, m, 0.0)
+    advance_parallel(1, r, v, m, 0.0)
+    offset_momentum(v, m, 0)
+    report_energy(r, v, m)
+    for dtype in (np.float32, np.float64):
+        mixed_accelerations(np.ascontiguousarray(r.T, dtype=dtype), m.astype(dtype),
+                            np.zeros((2, 3)))
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01):
     '''
         nbody simulation
         loops - number of loops to run
@@ -132,17 +219,12 @@ def nbody(loops, reference, iterations):
         iterations - number of timesteps to advance
     '''
 
-    # Set up global state
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
 
-    offset_momentum(reference)
-
-    body_pairs = np.array(list(combinations(range(len(BODIES_KEYS)),2)), dtype = np.int32)
-    
     for _ in range(loops):
-        # report_energy(Bodies, body_pairs)
-        advance(iterations, body_pairs, 0.01)
-        print(report_energy(body_pairs))
+        advance(iterations, r, v, m, dt)
+        print(report_energy(r, v, m))
 
 if __name__ == '__main__':
     nbody(100, 'sun', 20000)
-
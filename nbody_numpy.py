@@ -0,0 +1,228 @@
+"""
+    N-body simulation.
+
+    Version: Structure-of-arrays engine, vectorized by numpy
+
+    The state is held as contiguous float64 arrays instead of the BODIES
+    dict of (list, list, float) tuples:
+
+        r - positions,  shape (N, 3)
+        v - velocities, shape (N, 3)
+        m - masses,     shape (N,)
+
+    All pairwise deltas, the dt * r**-1.5 magnitudes and the velocity
+    updates of one timestep are computed as batched array operations, so
+    the interpreted per-pair loop of nbody_opt.py disappears. Rows are
+    processed in blocks of BLOCK bodies to keep the temporary (block, N, 3)
+    delta array small for large N.
+
+    For the 5 hard-coded planets the numpy call overhead dominates and
+    nbody_opt.py is still faster; the vectorized engine wins once N grows
+    past a few dozen bodies.
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_metrics import METRICS
+
+BLOCK = 256
+
+
+def bodies_to_arrays(bodies):
+    '''
+        convert a BODIES style dict into the array state
+        returns (names, r, v, m)
+    '''
+    names = list(bodies.keys())
+    r = np.array([bodies[name][0] for name in names], dtype=np.float64)
+    v = np.array([bodies[name][1] for name in names], dtype=np.float64)
+    m = np.array([bodies[name][2] for name in names], dtype=np.float64)
+    return names, r, v, m
+
+
+def arrays_to_bodies(names, r, v, m):
+    '''
+        convert the array state back into a BODIES style dict
+    '''
+    return {name: (r[i].tolist(), v[i].tolist(), float(m[i]))
+            for i, name in enumerate(names)}
+
+
+def accelerations(r, m, block=BLOCK):
+    '''
+        gravitational acceleration on every body, shape (N, 3)
+        the self interaction is removed by setting the squared distance
+        on the diagonal to infinity
+    '''
+    n = len(m)
+    acc = np.empty_like(r)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        d = r[start:stop, None, :] - r[None, :, :]
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        rows = np.arange(stop - start)
+        dist2[rows, rows + start] = np.inf
+        mag = m * dist2 ** (-1.5)
+        acc[start:stop] = -np.einsum('ijk,ij->ik', d, mag)
+    return acc
+
+
+def accelerations_and_potential(r, m, block=BLOCK):
+    '''
+        accelerations and potential energy from the same pair distances
+        returns (acc, potential)
+    '''
+    n = len(m)
+    acc = np.empty_like(r)
+    e = 0.0
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        d = r[start:stop, None, :] - r[None, :, :]
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        rows = np.arange(stop - start)
+        dist2[rows, rows + start] = np.inf
+        inv = m / np.sqrt(dist2)
+        acc[start:stop] = -np.einsum('ijk,ij->ik', d, inv / dist2)
+        # every pair is seen from both sides
+        e -= 0.5 * np.dot(m[start:stop], inv.sum(axis=1))
+    return acc, e
+
+
+def diagnostics(r, v, m, potential):
+    '''
+        diagnostics record of the state, given its potential energy
+    '''
+    kinetic = kinetic_energy(v, m)
+    p = m[:, None] * v
+    return {'energy': potential + kinetic,
+            'kinetic': kinetic,
+            'potential': potential,
+            'momentum': p.sum(axis=0),
+            'angular_momentum': np.cross(r, p).sum(axis=0)}
+
+
+def advance(iterations, r, v, m, dt, acc=None, fused=False):
+    '''
+        advance the system iterations timesteps
+        kick all velocities, then drift all positions (same scheme as
+        nbody_opt.advance)
+
+        acc - accelerations at the current positions, if already known
+        fused - also compute the forces at the final positions and, in the
+                same pass over the pairs, the diagnostics of the final
+                state; returns (acc, record), pass acc on to the next call
+                so the forces are not computed twice
+    '''
+    if METRICS.enabled:
+        return _advance_timed(iterations, r, v, m, dt, acc, fused)
+    for _ in range(iterations):
+        if acc is None:
+            acc = accelerations(r, m)
+        v += dt * acc
+        r += dt * v
+        acc = None
+    if fused:
+        acc, potential = accelerations_and_potential(r, m)
+        return acc, diagnostics(r, v, m, potential)
+
+
+def _advance_timed(iterations, r, v, m, dt, acc, fused):
+    '''
+        advance() with phase timers and counters, used when METRICS is on
+    '''
+    n = len(m)
+    pairs = n * (n - 1) // 2
+    for _ in range(iterations):
+        with METRICS.phase('step'):
+            if acc is None:
+                with METRICS.phase('force'):
+                    acc = accelerations(r, m)
+                METRICS.count('force_evaluations')
+                METRICS.count('pair_interactions', pairs)
+            with METRICS.phase('drift'):
+                v += dt * acc
+                r += dt * v
+            acc = None
+        METRICS.count('steps')
+    if fused:
+        # the fused pass is the force evaluation of the next step, so it is
+        # timed and counted as one; only the energy bookkeeping on top of
+        # it is diagnostics
+        with METRICS.phase('force'):
+            acc, potential = accelerations_and_potential(r, m)
+        with METRICS.phase('diagnostics'):
+            record = diagnostics(r, v, m, potential)
+        METRICS.count('force_evaluations')
+        METRICS.count('pair_interactions', pairs)
+        return acc, record
+
+
+def potential_energy(r, m, block=BLOCK):
+    '''
+        sum of -m1 * m2 / distance over all unique pairs
+    '''
+    n = len(m)
+    e = 0.0
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        d = r[start:stop, None, :] - r[None, :, :]
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        rows = np.arange(stop - start)
+        # only count j > i so each pair is seen once
+        dist2[np.arange(n) <= (rows + start)[:, None]] = np.inf
+        e -= np.dot(m[start:stop], (m / np.sqrt(dist2)).sum(axis=1))
+    return e
+
+
+def kinetic_energy(v, m):
+    '''
+        sum of m * |v|**2 / 2 over all bodies
+    '''
+    return 0.5 * np.dot(m, np.einsum('ij,ij->i', v, v))
+
+
+def report_energy(r, v, m):
+    '''
+        compute the energy and return it so that it can be printed
+    '''
+    return potential_energy(r, m) + kinetic_energy(v, m)
+
+
+def offset_momentum(v, m, reference):
+    '''
+        reference is the index of the body in the center of the system
+        change its velocity so that the total momentum is zero; for a
+        reference at rest (the sun in BODIES) this is nbody_opt's offset
+    '''
+    p = -np.dot(m, v)
+    v[reference] += p / m[reference]
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01, fused=False):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        bodies - BODIES style dict with the initial state
+        fused - take the energy from the force pass instead of a separate
+                report_energy sweep over the pairs
+    '''
+
+    # Set up the array state
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+
+    acc = None
+    for _ in range(loops):
+        if fused:
+            acc, record = advance(iterations, r, v, m, dt, acc, fused=True)
+            print(record['energy'])
+        else:
+            advance(iterations, r, v, m, dt)
+            with METRICS.phase('diagnostics'):
+                e = report_energy(r, v, m)
+            print(e)
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
@@ -0,0 +1,166 @@
+"""
+    N-body simulation.
+
+    Version: Parallel in time (Parareal)
+
+    With 5 bodies there are 10 pairs per step and nothing to spread over
+    cores in space; the cost is the long chain of sequential timesteps.
+    Parareal splits the time interval into slices and iterates:
+
+        G(u)  coarse propagator, kick-drift over the slice with the large
+              timestep dt * coarse (cheap, sequential)
+        F(u)  fine propagator, the backend's advance over the slice with
+              the timestep dt (expensive, all slices in parallel)
+
+        U[0]   = u0,    U[k+1] = G(U[k])                       initial guess
+        U'[k+1] = G(U'[k]) + F(U[k]) - G(U[k])                 iteration
+
+    The fine propagations of all slices run on a process pool. After j
+    iterations the first j slices equal the sequential fine solution
+    exactly, so those are not propagated again, and after as many
+    iterations as slices the result is the sequential result. The
+    iteration stops earlier once the largest relative change of a slice
+    boundary state drops below tol.
+
+    The wall-clock gain is about slices / iterations, bounded by the
+    number of workers. It needs a coarse propagator that keeps the orbital
+    phase over a slice: with BODIES (Jupiter's period is about 1100 steps
+    of dt = 0.01) 8 slices of 100 steps converge to 1e-8 in 4 iterations at
+    coarse = 2 and in 6 at coarse = 10, while slices of several orbits need
+    about as many iterations as slices and gain nothing.
+"""
+import multiprocessing
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, report_energy, offset_momentum
+
+COARSE = 10
+TOL = 1e-8
+
+
+def _engine(backend):
+    import nbody_backends
+    return nbody_backends.load(backend)
+
+
+def _warm(backend):
+    '''
+        pool initializer, load the fine backend once per worker process
+    '''
+    _engine(backend)
+
+
+def _fine(args):
+    backend, steps, r, v, m, dt = args
+    _engine(backend).advance(steps, r, v, m, dt)
+    return r, v
+
+
+def _change(new, old):
+    '''
+        relative change of a (r, v) state
+    '''
+    scale = max(np.abs(old[0]).max(), np.abs(old[1]).max(), 1e-300)
+    return max(np.abs(new[0] - old[0]).max(), np.abs(new[1] - old[1]).max()) / scale
+
+
+class Parareal(object):
+    '''
+        Parareal propagation of a kick-drift trajectory
+        slices - number of time slices
+        steps - fine steps per slice
+        coarse - ratio of the coarse to the fine timestep
+        backend - nbody_backends backend of both propagators
+        workers - pool size, defaults to min(slices, cpu count)
+    '''
+
+    def __init__(self, slices, steps, dt=0.01, coarse=COARSE, tol=TOL,
+                 backend='numpy', workers=None, max_iterations=None):
+        self.slices = slices
+        self.steps = steps
+        self.dt = dt
+        self.coarse = coarse
+        self.tol = tol
+        self.backend = backend
+        self.workers = workers or min(slices, multiprocessing.cpu_count())
+        self.max_iterations = max_iterations or slices
+        self.iterations = 0
+        self.changes = []
+
+    def coarse_propagate(self, r, v, m):
+        '''
+            G: the slice with steps / coarse timesteps of dt * coarse
+        '''
+        r, v = r.copy(), v.copy()
+        steps = max(1, int(round(self.steps / float(self.coarse))))
+        _engine(self.backend).advance(steps, r, v, m, self.dt * self.steps / steps)
+        return r, v
+
+    def run(self, r, v, m, pool=None):
+        '''
+            propagate (r, v) over all slices
+            returns the list of slices + 1 boundary states (r, v)
+        '''
+        m = np.asarray(m, dtype=np.float64)
+        U = [(np.array(r, dtype=np.float64), np.array(v, dtype=np.float64))]
+        G = []
+        for k in range(self.slices):
+            G.append(self.coarse_propagate(U[k][0], U[k][1], m))
+            U.append(G[k])
+
+        own = pool is None
+        if own:
+            pool = multiprocessing.Pool(self.workers, _warm, (self.backend,))
+        try:
+            self.iterations = 0
+            self.changes = []
+            done = 0
+            while done < self.slices and self.iterations < self.max_iterations:
+                F = pool.map(_fine, [(self.backend, self.steps, U[k][0].copy(),
+                                      U[k][1].copy(), m, self.dt)
+                                     for k in range(done, self.slices)])
+                F = [None] * done + F
+                self.iterations += 1
+
+                # slice done is now exact, it started from an exact state
+                new = U[:done + 1]
+                new.append(F[done])
+                change = 0.0
+                for k in range(done + 1, self.slices):
+                    g = self.coarse_propagate(new[k][0], new[k][1], m)
+                    new.append((g[0] + F[k][0] - G[k][0], g[1] + F[k][1] - G[k][1]))
+                    G[k] = g
+                for k in range(done + 1, self.slices + 1):
+                    change = max(change, _change(new[k], U[k]))
+                U = new
+                done += 1
+                self.changes.append(change)
+                if change < self.tol:
+                    break
+        finally:
+            if own:
+                pool.close()
+                pool.join()
+        return U
+
+
+def nbody(loops, reference, iterations, bodies=BODIES, dt=0.01, coarse=COARSE,
+          tol=TOL, backend='numpy', workers=None):
+    '''
+        nbody simulation, one Parareal time slice per loop
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+
+    solver = Parareal(loops, iterations, dt, coarse, tol, backend, workers)
+    for r, v in solver.run(r, v, m)[1:]:
+        print(report_energy(r, v, m))
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
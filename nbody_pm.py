@@ -0,0 +1,217 @@
+"""
+    N-body simulation.
+
+    Version: Particle-mesh (FFT) gravity solver
+
+    For very large, roughly uniform particle clouds the force is computed on
+    a regular grid instead of from pairs:
+
+        1. cloud-in-cell (CIC) deposition of the masses onto a grid^3 mesh
+        2. Poisson equation  laplace(phi) = 4 pi rho  solved with numpy FFTs
+        3. acceleration -grad(phi) by central differences on the mesh
+        4. CIC interpolation of the mesh acceleration back to the bodies
+
+    A step costs O(N + grid^3 log grid) and is independent of the number of
+    pairs. Units are the same as the other nbody*.py files (G = 1, masses in
+    SOLAR_MASS = 4 pi^2).
+
+    Two boundary conditions are supported:
+
+        box=L     - periodic cube [0, L)^3, the usual cosmology setup
+        box=None  - isolated system; the mesh is fitted around the bodies
+                    every step and the density is zero padded to 2 * grid so
+                    the FFT convolution with the 1/r Green's function has no
+                    periodic images
+
+    Forces are softened on the scale of one mesh cell, so close encounters
+    (and the 5 planet default workload) are not resolved; use nbody_numpy or
+    nbody_bh for those.
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, kinetic_energy, offset_momentum
+
+GRID = 64
+
+
+class ParticleMesh(object):
+    '''
+        particle-mesh force solver
+        grid - number of mesh cells per axis
+        box  - side of the periodic cube, None for an isolated system
+    '''
+
+    def __init__(self, grid=GRID, box=None):
+        self.grid = grid
+        self.box = box
+        if box is not None:
+            self.shape = (grid, grid, grid)
+            self.spacing = box / grid
+        else:
+            self.shape = (2 * grid, 2 * grid, 2 * grid)
+            self.spacing = None
+        self._green = {}
+        self._state = None
+
+    def _fit(self, r):
+        '''
+            origin and cell size of the mesh for this step
+        '''
+        if self.box is not None:
+            return np.zeros(3), self.spacing
+        lo = r.min(axis=0)
+        hi = r.max(axis=0)
+        # keep the bodies on the first grid - 1 nodes so every CIC
+        # neighbour is still inside the unpadded part of the mesh
+        h = max((hi - lo).max(), 1e-12) / (self.grid - 2)
+        return lo - 0.5 * h, h
+
+    def _cic(self, r, origin, h):
+        '''
+            lower mesh index and the 8 CIC corner weights of every body
+        '''
+        u = (r - origin) / h
+        if self.box is not None:
+            u %= self.grid
+        i = np.floor(u).astype(np.intp)
+        f = u - i
+        corners = []
+        for o in range(8):
+            s = np.array([o & 1, (o >> 1) & 1, (o >> 2) & 1])
+            w = np.prod(np.where(s, f, 1.0 - f), axis=1)
+            idx = i + s
+            if self.box is not None:
+                idx %= self.grid
+            corners.append((idx, w))
+        return corners
+
+    def deposit(self, corners, m, h):
+        '''
+            mass density on the mesh
+        '''
+        n = self.shape[0]
+        rho = np.zeros(n ** 3)
+        for idx, w in corners:
+            flat = (idx[:, 0] * n + idx[:, 1]) * n + idx[:, 2]
+            rho += np.bincount(flat, m * w, minlength=n ** 3)
+        return rho.reshape(self.shape) / h ** 3
+
+    def _green_function(self, h):
+        '''
+            FFT of -1/r on the padded mesh
+            computed once per mesh shape for a unit cell and scaled by 1/h,
+            the isolated mesh is refitted with a new h every step
+        '''
+        if self.shape not in self._green:
+            n = self.shape[0]
+            x = np.minimum(np.arange(n), n - np.arange(n)).astype(np.float64)
+            dist = np.sqrt(x[:, None, None] ** 2 + x[None, :, None] ** 2 +
+                           x[None, None, :] ** 2)
+            dist[0, 0, 0] = 0.5
+            self._green[self.shape] = np.fft.rfftn(-1.0 / dist)
+        return self._green[self.shape] / h
+
+    def potential(self, rho, h):
+        '''
+            gravitational potential on the mesh
+        '''
+        if self.box is not None:
+            n = self.grid
+            k = 2 * np.pi * np.fft.fftfreq(n, d=h)
+            kz = 2 * np.pi * np.fft.rfftfreq(n, d=h)
+            k2 = k[:, None, None] ** 2 + k[None, :, None] ** 2 + kz[None, None, :] ** 2
+            k2[0, 0, 0] = 1.0
+            phi_k = -4 * np.pi * np.fft.rfftn(rho) / k2
+            # the mean density does not contribute to the force
+            phi_k[0, 0, 0] = 0.0
+            return np.fft.irfftn(phi_k, s=self.shape, axes=(0, 1, 2))
+        phi_k = np.fft.rfftn(rho) * self._green_function(h)
+        return h ** 3 * np.fft.irfftn(phi_k, s=self.shape, axes=(0, 1, 2))
+
+    def _solve(self, r, m):
+        '''
+            CIC corners, cell size and mesh potential of a state
+            the last solve is kept, so the energy report and the first force
+            evaluation of the next step share one deposit and FFT
+        '''
+        if self._state is not None:
+            r0, m0, result = self._state
+            if np.array_equal(r0, r) and np.array_equal(m0, m):
+                return result
+        origin, h = self._fit(r)
+        corners = self._cic(r, origin, h)
+        phi = self.potential(self.deposit(corners, m, h), h)
+        result = corners, h, phi
+        self._state = r.copy(), m.copy(), result
+        return result
+
+    def accelerations(self, r, m):
+        '''
+            mesh acceleration on every body, shape (N, 3)
+        '''
+        corners, h, phi = self._solve(r, m)
+        acc = np.zeros_like(r)
+        for axis in range(3):
+            g = (np.roll(phi, 1, axis) - np.roll(phi, -1, axis)) / (2 * h)
+            for idx, w in corners:
+                acc[:, axis] += w * g[idx[:, 0], idx[:, 1], idx[:, 2]]
+        return acc
+
+    def potential_energy(self, r, m):
+        '''
+            mesh estimate of the potential energy, 1/2 sum m phi(r)
+            it includes the softened self energy of every body
+        '''
+        corners, h, phi = self._solve(r, m)
+        e = 0.0
+        for idx, w in corners:
+            e += np.dot(m * w, phi[idx[:, 0], idx[:, 1], idx[:, 2]])
+        return 0.5 * e
+
+    def advance(self, iterations, r, v, m, dt):
+        '''
+            advance the system iterations timesteps with mesh forces
+            same kick then drift scheme as nbody_numpy.advance
+        '''
+        for _ in range(iterations):
+            v += dt * self.accelerations(r, m)
+            r += dt * v
+            if self.box is not None:
+                r %= self.box
+
+    def report_energy(self, r, v, m):
+        '''
+            energy consistent with the mesh forces, periodic in a box; an
+            O(N + grid^3 log grid) mesh estimate instead of a pair sum
+        '''
+        return self.potential_energy(r, m) + kinetic_energy(v, m)
+
+
+def advance(iterations, r, v, m, dt, mesh):
+    '''
+        advance the system iterations timesteps with mesh forces
+    '''
+    mesh.advance(iterations, r, v, m, dt)
+
+
+def nbody(loops, reference, iterations, grid=GRID, box=None, bodies=BODIES, dt=0.01):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        grid - mesh cells per axis
+        box - side of the periodic box, None for an isolated system
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+    mesh = ParticleMesh(grid, box)
+
+    for _ in range(loops):
+        mesh.advance(iterations, r, v, m, dt)
+        print(mesh.report_energy(r, v, m))
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
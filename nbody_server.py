@@ -0,0 +1,472 @@
+"""
+    N-body local job server.
+
+    An asyncio service around the nbody entry point, so jobs no longer pay
+    interpreter startup, NumPy/Numba imports and kernel compilation:
+
+        - a fixed set of worker processes is started with the server and
+          warmed up once (backends loaded, Numba kernels compiled or read
+          from their cache)
+        - submitted jobs wait in a FIFO queue and are handed to the next
+          idle worker
+        - the per-loop report_energy values are streamed back to the
+          clients while the job runs
+        - a job can be cancelled while queued or running; a running job
+          checks for cancellation every CANCEL_STEPS timesteps
+        - a worker process that dies (crash, out of memory, killed) is
+          noticed within LIVENESS seconds, its job fails with the exit
+          code and a fresh worker takes its place; every worker reports
+          on its own pipe, so a dying worker cannot block the others, and
+          workers are started from a fork server, so they never inherit
+          client connections
+
+    Protocol: newline delimited JSON over a Unix socket (SOCKET, or
+    $NBODY_SOCKET). Every request is one object with an "op":
+
+        submit  job parameters as the fields of nbody_sweep (ics, bodies,
+                seed, reference, dt, iterations, loops, backend, scale);
+                with "stream": true the connection receives the job's
+                messages until it ends, otherwise only its id
+        watch   {"job": id} - stream an existing job, the energies already
+                computed are replayed first
+        status  {"job": id}, or all jobs without an id
+        cancel  {"job": id}
+
+    Job messages: {"job", "state"} on every state change (queued, running,
+    done, cancelled, failed), {"job", "loop", "energy"} per loop.
+
+    Usage:
+
+        python nbody_server.py serve --workers 4
+        python nbody_server.py submit --loops 10 --iterations 20000
+        python nbody_server.py cancel 3
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+SOCKET = os.environ.get('NBODY_SOCKET',
+                        '/tmp/nbody-%d.sock' % (os.getuid() if hasattr(os, 'getuid') else 0))
+CANCEL_STEPS = 1000
+LIVENESS = 0.5
+FINISHED = ('done', 'cancelled', 'failed')
+
+# workers are forked from a clean helper process, a worker forked from the
+# server (on respawn) would inherit the open client sockets and hold them
+# open after the server closed them
+CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def _run_job(params, send, cancel):
+    '''
+        run one job in a worker, send(kind, payload) reports progress
+        returns the final state
+    '''
+    import nbody_backends
+    from nbody_sweep import DEFAULTS, initial_state
+
+    point = dict(DEFAULTS)
+    point.update(params)
+    r, v, m = initial_state(point)
+    dt = float(point['dt'])
+    iterations = int(point['iterations'])
+    engine = nbody_backends.get_backend(point['backend'], r, v, m, dt)
+
+    for loop in range(int(point['loops'])):
+        done = 0
+        while done < iterations:
+            if cancel.is_set():
+                return 'cancelled'
+            chunk = min(CANCEL_STEPS, iterations - done)
+            engine.advance(chunk, r, v, m, dt)
+            done += chunk
+        send('energy', {'loop': loop, 'energy': engine.report_energy(r, v, m)})
+    return 'done'
+
+
+def _worker(tasks, results, cancel, backends):
+    '''
+        worker process: warm up, then run the jobs sent to tasks
+        results - write end of the worker's own pipe to the server; it has
+                  no other writer, so no lock is shared with the server or
+                  the other workers that a dying worker could leave held
+    '''
+    from nbody_sweep import _warm
+    _warm(backends)
+    results.send((None, 'ready', None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job, params = task
+
+        def send(kind, payload):
+            results.send((job, kind, payload))
+
+        try:
+            state = _run_job(params, send, cancel)
+            send(state, None)
+        except Exception as e:
+            send('failed', '%s: %s' % (type(e).__name__, e))
+
+
+class Job(object):
+
+    def __init__(self, ident, params):
+        self.id = ident
+        self.params = params
+        self.state = 'queued'
+        self.energies = []
+        self.error = None
+        self.worker = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.watchers = []
+
+    def status(self):
+        return {'job': self.id, 'state': self.state, 'params': self.params,
+                'loops_done': len(self.energies), 'error': self.error,
+                'submitted': self.submitted, 'started': self.started,
+                'finished': self.finished}
+
+    def publish(self, message):
+        for queue in self.watchers:
+            queue.put_nowait(message)
+
+
+class _Worker(object):
+
+    def __init__(self, index, backends):
+        self.index = index
+        self.tasks = CONTEXT.Queue()
+        self.cancel = CONTEXT.Event()
+        self.results, writer = CONTEXT.Pipe(duplex=False)
+        self.process = CONTEXT.Process(
+            target=_worker, args=(self.tasks, writer, self.cancel, backends))
+        self.process.daemon = True
+        self._writer = writer
+        self.job = None
+        self.idle = None
+
+    def start(self):
+        self.idle = asyncio.Event()
+        self.process.start()
+        # the worker holds the only write end, its exit closes the pipe
+        self._writer.close()
+
+    def close(self):
+        self.results.close()
+        # nothing queued is of use once the worker is gone
+        self.tasks.cancel_join_thread()
+        self.tasks.close()
+
+
+class JobServer(object):
+    '''
+        job queue and warm worker pool behind a Unix socket
+        workers - number of worker processes, default cpu count
+        backends - backends to load in every worker ahead of the jobs
+    '''
+
+    def __init__(self, path=SOCKET, workers=None, backends=('numpy', 'numba')):
+        self.path = path
+        self.backends = list(backends)
+        self.workers = [_Worker(i, self.backends)
+                        for i in range(workers or multiprocessing.cpu_count())]
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._queue = None
+        self._server = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            self._start(worker)
+        self._dispatchers = [loop.create_task(self._dispatch(w.index)) for w in self.workers]
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._client, path=self.path)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._dispatchers:
+            task.cancel()
+        for worker in self.workers:
+            worker.cancel.set()
+            worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            self._stop_reading(worker)
+            worker.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    # jobs
+
+    def submit(self, params):
+        job = Job(next(self._ids), params)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def cancel(self, job):
+        if job.state == 'queued':
+            self._finish(job, 'cancelled')
+        elif job.state == 'running':
+            self.workers[job.worker].cancel.set()
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        job.publish({'job': job.id, 'state': state, 'error': error})
+        job.publish(None)
+
+    def _respawn(self, worker):
+        '''
+            replace a dead worker process, failing the job it was running
+        '''
+        code = worker.process.exitcode
+        if worker.job is not None and worker.job.state not in FINISHED:
+            self._finish(worker.job, 'failed', 'worker exited with code %s' % code)
+        self._stop_reading(worker)
+        worker.close()
+        fresh = _Worker(worker.index, self.backends)
+        self.workers[worker.index] = fresh
+        self._start(fresh)
+        return fresh
+
+    async def _wait_idle(self, index):
+        '''
+            wait until worker index is idle, respawning it whenever its
+            process is found dead
+            returns the (possibly new) worker
+        '''
+        worker = self.workers[index]
+        while True:
+            try:
+                await asyncio.wait_for(worker.idle.wait(), LIVENESS)
+                return worker
+            except asyncio.TimeoutError:
+                pass
+            if not worker.process.is_alive():
+                worker = self._respawn(worker)
+
+    async def _dispatch(self, index):
+        worker = await self._wait_idle(index)
+        while True:
+            job = await self._queue.get()
+            if job.state != 'queued':
+                continue
+            worker.idle.clear()
+            worker.job = job
+            job.worker = worker.index
+            job.state = 'running'
+            job.started = time.time()
+            job.publish({'job': job.id, 'state': 'running'})
+            # clear before handing the job over, a cancel from now on sticks
+            worker.cancel.clear()
+            worker.tasks.put((job.id, job.params))
+            worker = await self._wait_idle(index)
+
+    # worker messages
+
+    def _start(self, worker):
+        worker.start()
+        asyncio.get_running_loop().add_reader(worker.results.fileno(),
+                                              self._receive, worker)
+
+    def _stop_reading(self, worker):
+        if not worker.results.closed:
+            asyncio.get_running_loop().remove_reader(worker.results.fileno())
+
+    def _receive(self, worker):
+        '''
+            handle one message of a worker, called when its pipe is readable
+        '''
+        try:
+            ident, kind, payload = worker.results.recv()
+        except (EOFError, OSError):
+            # the worker exited, _wait_idle respawns it
+            self._stop_reading(worker)
+            return
+        if kind == 'ready':
+            worker.idle.set()
+            return
+        job = self.jobs[ident]
+        if job.state in FINISHED:
+            # late messages of a job failed on worker death
+            return
+        if kind == 'energy':
+            job.energies.append(payload['energy'])
+            job.publish(dict(payload, job=ident))
+            return
+        self._finish(job, kind, payload)
+        worker.job = None
+        worker.idle.set()
+
+    # clients
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    await self._handle(request, writer)
+                except (ValueError, KeyError, TypeError) as e:
+                    await self._send(writer, {'error': '%s: %s' % (type(e).__name__, e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, message):
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+
+    async def _handle(self, request, writer):
+        op = request.pop('op')
+        if op == 'submit':
+            stream = request.pop('stream', False)
+            job = self.submit(request)
+            if stream:
+                await self._watch(job, writer)
+            else:
+                await self._send(writer, {'job': job.id, 'state': job.state})
+        elif op == 'watch':
+            await self._watch(self.jobs[request['job']], writer)
+        elif op == 'status':
+            if 'job' in request:
+                await self._send(writer, self.jobs[request['job']].status())
+            else:
+                await self._send(writer, {'jobs': [j.status() for j in self.jobs.values()]})
+        elif op == 'cancel':
+            job = self.jobs[request['job']]
+            self.cancel(job)
+            await self._send(writer, {'job': job.id, 'state': job.state})
+        else:
+            raise ValueError('unknown op %r' % op)
+
+    async def _watch(self, job, writer):
+        # subscribe before replaying, so no message falls in between
+        queue = asyncio.Queue()
+        energies = list(job.energies)
+        finished = job.state in FINISHED
+        if not finished:
+            job.watchers.append(queue)
+        try:
+            await self._send(writer, {'job': job.id, 'state': 'queued'})
+            if job.started is not None:
+                await self._send(writer, {'job': job.id, 'state': 'running'})
+            for loop, energy in enumerate(energies):
+                await self._send(writer, {'job': job.id, 'loop': loop, 'energy': energy})
+            if finished:
+                await self._send(writer, {'job': job.id, 'state': job.state,
+                                          'error': job.error})
+                return
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                await self._send(writer, message)
+        finally:
+            if queue in job.watchers:
+                job.watchers.remove(queue)
+
+
+def request(message, path=SOCKET):
+    '''
+        send one request to a running server, yields the reply messages
+    '''
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('r') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def nbody(loops, reference, iterations, path=SOCKET, **params):
+    '''
+        nbody simulation run as a job of a running server
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+    '''
+    params.update(loops=loops, reference=reference, iterations=iterations,
+                  op='submit', stream=True)
+    for message in request(params, path):
+        if 'energy' in message:
+            print(message['energy'])
+        elif message.get('state') == 'failed':
+            raise RuntimeError(message['error'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='N-body job server')
+    parser.add_argument('--socket', default=SOCKET)
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve')
+    serve.add_argument('--workers', type=int)
+    serve.add_argument('--backends', default='numpy,numba')
+    submit = commands.add_parser('submit')
+    for name, kind in (('ics', str), ('bodies', int), ('seed', int),
+                       ('reference', str), ('dt', float), ('iterations', int),
+                       ('loops', int), ('backend', str), ('scale', float)):
+        submit.add_argument('--' + name, type=kind)
+    submit.add_argument('--detach', action='store_true')
+    for name in ('watch', 'status', 'cancel'):
+        commands.add_parser(name).add_argument('job', type=int, nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = JobServer(args.socket, args.workers,
+                           [b for b in args.backends.split(',') if b])
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.command == 'submit':
+        message = {name: value for name, value in vars(args).items()
+                   if name not in ('socket', 'command', 'detach') and value is not None}
+        message.update(op='submit', stream=not args.detach)
+    elif args.command in ('watch', 'status', 'cancel'):
+        message = {'op': args.command}
+        if args.job is not None:
+            message['job'] = args.job
+    else:
+        parser.print_help()
+        return 2
+    for reply in request(message, args.socket):
+        print(json.dumps(reply))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+    N-body simulation.
+
+    Version: Multi-core shared-memory force evaluation
+
+    The pair work of a timestep (the body_keypairs of nbody_opt.advance) is
+    split across a pool of worker processes:
+
+        - positions, velocities and masses are numpy arrays backed by
+          multiprocessing.shared_memory, so nothing is pickled per step
+        - worker k owns a contiguous range of rows i and handles every pair
+          (i, j > i) of those rows; the ranges are chosen so every worker
+          gets about the same number of pairs
+        - Newton's third law is applied inside the worker, into its own
+          (N, 3) acceleration buffer, so two workers never write the same
+          memory
+        - once every worker has signalled the end of its rows the parent
+          reduces the per-worker buffers, kicks and drifts
+
+    Results match nbody_numpy.advance to within round-off.
+
+    The parent waits for the workers at most timeout seconds and checks
+    every LIVENESS seconds that they are alive; a worker that died or hangs
+    makes the step raise RuntimeError instead of blocking forever, and the
+    engine is closed. (Semaphores are used rather than a Barrier: a process
+    killed inside Barrier.wait leaves the barrier unable to break.)
+
+    Usage:
+
+        with SharedMemoryEngine(r, v, m, workers=8) as engine:
+            engine.advance(iterations, dt)
+            engine.report_energy()
+"""
+import os
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, report_energy, offset_momentum
+
+BLOCK = 256
+TIMEOUT = 60.0
+LIVENESS = 0.1
+
+
+def _attach(name, shape):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _row_ranges(n, workers):
+    '''
+        split rows 0..n-1 into contiguous ranges with about the same
+        number of pairs (row i has n - 1 - i pairs)
+    '''
+    pairs = np.cumsum(np.arange(n - 1, -1, -1))
+    cuts = np.searchsorted(pairs, pairs[-1] * np.arange(1, workers) / workers)
+    bounds = [0] + [int(c) + 1 for c in cuts] + [n]
+    return [(min(a, n), min(max(a, b), n)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def pair_accelerations(r, m, first, last, acc, block=BLOCK):
+    '''
+        add the accelerations of every pair (i, j) with first <= i < last
+        and j > i to acc, applying both sides of each pair
+    '''
+    n = len(m)
+    for a in range(first, last, block):
+        b = min(a + block, last)
+        d = r[a:b, None, :] - r[None, a:, :]
+        dist2 = np.einsum('ijk,ijk->ij', d, d)
+        # only j > i, so each pair is seen once
+        dist2[np.arange(a, n)[None, :] <= np.arange(a, b)[:, None]] = np.inf
+        w = dist2 ** (-1.5)
+        acc[a:b] -= np.einsum('ijk,ij->ik', d, w * m[a:])
+        acc[a:] += np.einsum('ijk,ij->jk', d, w * m[a:b, None])
+
+
+def _worker(names, n, workers, rank, first, last, start, done):
+    shms = []
+    arrays = []
+    for name, shape in zip(names, [(n, 3), (n,), (workers, n, 3), (1,)]):
+        shm, array = _attach(name, shape)
+        shms.append(shm)
+        arrays.append(array)
+    r, m, accs, stop = arrays
+    acc = accs[rank]
+
+    try:
+        while True:
+            start.acquire()
+            if stop[0]:
+                break
+            acc[:] = 0.0
+            pair_accelerations(r, m, first, last, acc)
+            done.release()
+    finally:
+        del r, m, accs, stop, acc, arrays
+        for shm in shms:
+            shm.close()
+
+
+class SharedMemoryEngine(object):
+    '''
+        array state in shared memory plus a pool of force workers
+        r, v, m - initial state, copied into shared memory
+        workers - number of worker processes, defaults to os.cpu_count()
+        timeout - longest wait in seconds for the workers to finish a step
+    '''
+
+    def __init__(self, r, v, m, workers=None, timeout=TIMEOUT):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        n = len(m)
+        self._closed = False
+        self._procs = []
+        self._shms = []
+        self.r = self._share(r)
+        self.m = self._share(m)
+        self.accs = self._share(np.zeros((self.workers, n, 3)))
+        self._stop = self._share(np.zeros(1))
+        # velocities are only touched by the parent, but keeping them in
+        # shared memory lets other processes inspect a running job
+        self.v = self._share(v)
+
+        self._start = [mp.Semaphore(0) for _ in range(self.workers)]
+        self._done = mp.Semaphore(0)
+        names = [shm.name for shm in self._shms[:4]]
+        for rank, (first, last) in enumerate(_row_ranges(n, self.workers)):
+            proc = mp.Process(target=_worker,
+                              args=(names, n, self.workers, rank, first, last,
+                                    self._start[rank], self._done),
+                              daemon=True)
+            proc.start()
+            self._procs.append(proc)
+
+    def _share(self, array):
+        array = np.asarray(array, dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._shms.append(shm)
+        shared = np.ndarray(array.shape, dtype=np.float64, buffer=shm.buf)
+        shared[...] = array
+        return shared
+
+    def accelerations(self):
+        '''
+            run one force evaluation on the workers and reduce the buffers
+        '''
+        if self._closed:
+            raise RuntimeError('engine is closed')
+        for start in self._start:
+            start.release()
+        deadline = time.monotonic() + self.timeout
+        for _ in self._procs:
+            while not self._done.acquire(timeout=LIVENESS):
+                dead = ['%d (exit code %s)' % (rank, proc.exitcode)
+                        for rank, proc in enumerate(self._procs)
+                        if not proc.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError('force worker died: ' + ', '.join(dead))
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError('force workers did not finish the step in %g s'
+                                       % self.timeout)
+        return self.accs.sum(axis=0)
+
+    def advance(self, iterations, dt):
+        '''
+            advance the system iterations timesteps (kick then drift)
+        '''
+        for _ in range(iterations):
+            self.v += dt * self.accelerations()
+            self.r += dt * self.v
+
+    def report_energy(self):
+        return report_energy(self.r, self.v, self.m)
+
+    def close(self):
+        '''
+            stop the workers and free the shared memory, safe to call again
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        if self._procs:
+            self._stop[0] = 1.0
+            for start in self._start:
+                start.release()
+            for proc in self._procs:
+                proc.join(self.timeout)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join()
+            self._procs = []
+        del self.r, self.v, self.m, self.accs, self._stop
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def nbody(loops, reference, iterations, workers=None, bodies=BODIES, dt=0.01):
+    '''
+        nbody simulation
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        workers - number of worker processes
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+
+    with SharedMemoryEngine(r, v, m, workers) as engine:
+        for _ in range(loops):
+            engine.advance(iterations, dt)
+            print(engine.report_energy())
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
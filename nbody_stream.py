@@ -0,0 +1,204 @@
+"""
+    N-body simulation.
+
+    Version: Streaming trajectory output with bounded memory
+
+    trajectory() is a generator that advances the array state and yields a
+    snapshot (step, time, r, v) every `every` steps, so callers can consume
+    a trajectory without patching the loop or collecting Python lists.
+
+    TrajectoryWriter appends snapshots to a chunked binary file from a
+    background thread:
+
+        - snapshots are copied into one of a fixed pool of preallocated
+          chunk buffers (chunk snapshots each)
+        - a full chunk is handed to the writer thread through a queue and
+          the integration continues with the next free buffer
+        - the writer thread writes the chunk and returns the buffer to the
+          pool
+
+    Memory is bounded by buffers * chunk snapshots, independent of the run
+    length. The integration only waits when every buffer is still queued,
+    i.e. when the disk is persistently slower than the simulation.
+
+    File layout (little endian):
+
+        header   FILE_HEADER: magic, body count
+        chunk    CHUNK_HEADER: snapshot count k, then
+                 steps int64 (k,), times float64 (k,),
+                 r float64 (k, N, 3), v float64 (k, N, 3)
+"""
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, report_energy, offset_momentum
+from nbody_integrators import INTEGRATORS
+from nbody_metrics import METRICS
+
+MAGIC = b'NBODYTR1'
+FILE_HEADER = struct.Struct('<8sQ')
+CHUNK_HEADER = struct.Struct('<Q')
+CHUNK = 64
+BUFFERS = 4
+
+
+def trajectory(r, v, m, steps, every=1, dt=0.01, integrator=None, start=0):
+    '''
+        advance the state steps timesteps and yield (step, time, r, v)
+        every `every` steps; r and v are the live arrays, copy them to keep
+        a snapshot beyond the next iteration
+        start - step count of the initial state, to continue a run
+    '''
+    integrator = integrator or INTEGRATORS['kick-drift']()
+    time = start * dt
+    for step in range(start + 1, start + steps + 1):
+        with METRICS.phase('step'):
+            time += integrator.step(r, v, m, dt)
+        METRICS.count('steps')
+        if step % every == 0:
+            yield step, time, r, v
+
+
+class _Chunk(object):
+
+    def __init__(self, size, n):
+        self.steps = np.empty(size, dtype='<i8')
+        self.times = np.empty(size, dtype='<f8')
+        self.r = np.empty((size, n, 3), dtype='<f8')
+        self.v = np.empty((size, n, 3), dtype='<f8')
+        self.count = 0
+
+
+class TrajectoryWriter(object):
+    '''
+        buffered background writer of a chunked binary trajectory file
+        n - number of bodies
+        chunk - snapshots per chunk
+        decimate - keep every decimate-th snapshot passed to write()
+        buffers - number of chunk buffers, bounds the memory use
+    '''
+
+    def __init__(self, path, n, chunk=CHUNK, decimate=1, buffers=BUFFERS):
+        self.n = n
+        self.decimate = decimate
+        self._seen = 0
+        self._free = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(_Chunk(chunk, n))
+        self._full = queue.Queue()
+        self._current = self._free.get()
+        self._error = None
+        self._file = open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(MAGIC, n))
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._full.get()
+            if chunk is None:
+                break
+            try:
+                if self._error is None:
+                    with METRICS.phase('io'):
+                        k = chunk.count
+                        self._file.write(CHUNK_HEADER.pack(k))
+                        for a in (chunk.steps[:k], chunk.times[:k], chunk.r[:k], chunk.v[:k]):
+                            self._file.write(memoryview(np.ascontiguousarray(a)).cast('B'))
+                    METRICS.count('bytes_written', CHUNK_HEADER.size + k * (16 + 48 * self.n))
+            except Exception as e:
+                self._error = e
+            chunk.count = 0
+            self._free.put(chunk)
+
+    def write(self, step, time, r, v):
+        '''
+            copy one snapshot into the current chunk
+        '''
+        if self._error is not None:
+            raise self._error
+        self._seen += 1
+        if (self._seen - 1) % self.decimate:
+            return
+        chunk = self._current
+        k = chunk.count
+        chunk.steps[k] = step
+        chunk.times[k] = time
+        chunk.r[k] = r
+        chunk.v[k] = v
+        chunk.count += 1
+        if chunk.count == len(chunk.steps):
+            self._full.put(chunk)
+            self._current = self._free.get()
+
+    def close(self):
+        '''
+            flush the last partial chunk and wait for the writer thread
+        '''
+        if self._current is not None and self._current.count:
+            self._full.put(self._current)
+        self._current = None
+        self._full.put(None)
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trajectory(path):
+    '''
+        iterate over the chunks of a trajectory file,
+        yields (steps, times, r, v) arrays one chunk at a time
+    '''
+    with open(path, 'rb') as f:
+        magic, n = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a trajectory file' % path)
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            (k,) = CHUNK_HEADER.unpack(header)
+            steps = np.fromfile(f, dtype='<i8', count=k)
+            times = np.fromfile(f, dtype='<f8', count=k)
+            r = np.fromfile(f, dtype='<f8', count=k * n * 3).reshape(k, n, 3)
+            v = np.fromfile(f, dtype='<f8', count=k * n * 3).reshape(k, n, 3)
+            yield steps, times, r, v
+
+
+def nbody(loops, reference, iterations, path='nbody.traj', every=100,
+          decimate=1, dt=0.01, bodies=BODIES):
+    '''
+        nbody simulation writing a trajectory file
+        loops - number of loops to run
+        reference - body at center of system
+        iterations - number of timesteps to advance
+        every - snapshot every `every` steps
+        decimate - keep every decimate-th snapshot in the file
+    '''
+
+    names, r, v, m = bodies_to_arrays(bodies)
+    offset_momentum(v, m, names.index(reference))
+
+    integrator = INTEGRATORS['kick-drift']()
+
+    with TrajectoryWriter(path, len(m), decimate=decimate) as writer:
+        for loop in range(loops):
+            for snapshot in trajectory(r, v, m, iterations, every, dt,
+                                       integrator, loop * iterations):
+                writer.write(*snapshot)
+            print(report_energy(r, v, m))
+
+if __name__ == '__main__':
+    nbody(100, 'sun', 20000)
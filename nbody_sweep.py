@@ -0,0 +1,252 @@
+"""
+    N-body parameter sweeps on a persistent process pool.
+
+    Launching `python nbody_opt.py` once per parameter point pays
+    interpreter startup, imports and JIT compilation for every point. Here
+    the points of a grid are scheduled over a multiprocessing pool whose
+    workers are started once and warmed up by the pool initializer
+    (backends loaded, Numba kernels compiled or read from their cache),
+    then every worker runs point after point.
+
+    A point is a dict of the FIELDS, missing fields take DEFAULTS:
+
+        ics         'solar' (BODIES) or a generator of nbody_ics:
+                    'plummer', 'cube', 'disk'
+        bodies      body count of the generated initial conditions
+        seed        generator seed; for 'solar' a non-empty seed perturbs
+                    BODIES by a relative scale (nbody_ensemble.perturb)
+        reference   body at the center of the system, 'solar' only
+        dt, iterations, loops, backend
+                    as in nbody_backends.nbody
+
+    Results stream back as the points finish and are appended to a CSV
+    table, one row per point: the point fields followed by the RESULTS
+    columns. With resume (the default) the points already in the table are
+    skipped, so an interrupted sweep continues where it stopped; rows that
+    recorded an error are run again.
+
+    Usage:
+
+        python nbody_sweep.py --dt 0.01,0.005 --reference sun,jupiter \\
+            --seed 0,1,2 --iterations 1000 --workers 4 --output sweep.csv
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum
+
+FIELDS = ('ics', 'bodies', 'seed', 'reference', 'dt', 'iterations', 'loops',
+          'backend', 'scale')
+DEFAULTS = {'ics': 'solar',
+            'bodies': len(BODIES),
+            'seed': None,
+            'reference': 'sun',
+            'dt': 0.01,
+            'iterations': 1000,
+            'loops': 1,
+            'backend': 'numpy',
+            'scale': 1e-6}
+RESULTS = ('energy0', 'energy', 'drift', 'seconds', 'steps_per_second',
+           'worker', 'error')
+
+
+def grid(**axes):
+    '''
+        list of points of the cartesian product of the axes, e.g.
+        grid(dt=[0.01, 0.005], seed=[0, 1]) gives 4 points
+    '''
+    for name in axes:
+        if name not in FIELDS:
+            raise ValueError('unknown sweep parameter %r' % name)
+    names = sorted(axes)
+    points = []
+    for values in itertools.product(*(axes[name] for name in names)):
+        point = dict(DEFAULTS)
+        point.update(zip(names, values))
+        points.append(point)
+    return points
+
+
+def point_key(point):
+    '''
+        identity of a point, equal for a point and its row read back from
+        the results table
+    '''
+    return tuple('' if point.get(f) is None else str(point.get(f)) for f in FIELDS)
+
+
+def initial_state(point):
+    '''
+        (r, v, m) of a point
+    '''
+    import nbody_ics
+    ics = point['ics']
+    seed = None if point['seed'] in (None, '') else int(point['seed'])
+    generators = {'plummer': nbody_ics.plummer,
+                  'cube': nbody_ics.uniform_cube,
+                  'disk': nbody_ics.disk}
+    if ics == 'solar':
+        names, r, v, m = bodies_to_arrays(BODIES)
+        if seed is not None:
+            import nbody_ensemble
+            r, v, m = nbody_ensemble.perturb(BODIES, 1, float(point['scale']), seed)
+            r, v = r[0], v[0]
+        offset_momentum(v, m, names.index(point['reference']))
+    elif ics in generators:
+        names, r, v, m = generators[ics](int(point['bodies']), seed=seed)
+    else:
+        raise ValueError('unknown initial conditions %r' % ics)
+    return r, v, m
+
+
+def _warm(backends):
+    '''
+        pool initializer, load the backends once per worker process
+    '''
+    import nbody_backends
+    for name in backends:
+        if name == 'auto':
+            continue
+        try:
+            nbody_backends.load(name)
+        except Exception:
+            # reported per point by run_point
+            continue
+        if name == 'numba':
+            import nbody_numba
+            nbody_numba.warmup()
+
+
+def run_point(point):
+    '''
+        run one point, returns the point with the RESULTS columns added
+    '''
+    import nbody_backends
+    row = dict(point)
+    row.update((name, None) for name in RESULTS)
+    row['worker'] = os.getpid()
+    try:
+        r, v, m = initial_state(point)
+        dt = float(point['dt'])
+        iterations = int(point['iterations'])
+        loops = int(point['loops'])
+        engine = nbody_backends.get_backend(point['backend'], r, v, m, dt)
+        e0 = engine.report_energy(r, v, m)
+        start = time.perf_counter()
+        for _ in range(loops):
+            engine.advance(iterations, r, v, m, dt)
+        seconds = time.perf_counter() - start
+        e = engine.report_energy(r, v, m)
+        row.update(energy0=e0, energy=e, drift=abs((e - e0) / e0),
+                   seconds=seconds,
+                   steps_per_second=loops * iterations / seconds if seconds else None)
+    except Exception:
+        row['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    return row
+
+
+def read_results(path):
+    '''
+        rows of a results table, {} if it does not exist
+        returns {point_key: row}
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {point_key(row): row for row in csv.DictReader(f)}
+
+
+def sweep(points, workers=None, done=()):
+    '''
+        run the points not in done on a warm process pool and yield the
+        result rows in completion order
+    '''
+    done = set(done)
+    todo = [p for p in points if point_key(p) not in done]
+    if not todo:
+        return
+    backends = sorted(set(p['backend'] for p in todo))
+    pool = multiprocessing.Pool(workers, _warm, (backends,))
+    try:
+        for row in pool.imap_unordered(run_point, todo):
+            yield row
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def run_sweep(points, path, workers=None, resume=True, verbose=False):
+    '''
+        run a sweep into the CSV table at path
+        resume - keep the finished rows already in the table and skip
+                 their points, otherwise start a new table
+        returns the number of points run
+    '''
+    columns = list(FIELDS) + list(RESULTS)
+    done = {}
+    if resume:
+        done = {key: row for key, row in read_results(path).items()
+                if not row.get('error')}
+
+    # rewrite the table with the finished rows only, dropping failed ones
+    tmp = path + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(done.values())
+    os.replace(tmp, path)
+
+    count = 0
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        for row in sweep(points, workers, done):
+            writer.writerow(row)
+            f.flush()
+            count += 1
+            if verbose:
+                print('%s %s' % (', '.join('%s=%s' % (k, row[k]) for k in FIELDS),
+                                 row['error'] or 'drift=%.3e' % row['drift']))
+    return count
+
+
+def _list(kind):
+    def parse(text):
+        return [kind(x) for x in text.split(',') if x]
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='N-body parameter sweep')
+    parser.add_argument('--ics', type=_list(str))
+    parser.add_argument('--bodies', type=_list(int))
+    parser.add_argument('--seed', type=_list(int))
+    parser.add_argument('--reference', type=_list(str))
+    parser.add_argument('--dt', type=_list(float))
+    parser.add_argument('--iterations', type=_list(int))
+    parser.add_argument('--loops', type=_list(int))
+    parser.add_argument('--backend', type=_list(str))
+    parser.add_argument('--scale', type=_list(float))
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--output', default='sweep.csv')
+    parser.add_argument('--no-resume', dest='resume', action='store_false')
+    args = parser.parse_args(argv)
+
+    axes = {name: getattr(args, name) for name in FIELDS
+            if getattr(args, name) is not None}
+    points = grid(**axes)
+    count = run_sweep(points, args.output, args.workers, args.resume, verbose=True)
+    print('%d of %d points run, results in %s' % (count, len(points), args.output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
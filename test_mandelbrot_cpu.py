@@ -0,0 +1,57 @@
+'''
+Description: tests of the CPU Mandelbrot engine
+'''
+
+import numpy as np
+import pytest
+
+import mandelbrot_cpu
+from mandelbrot_cpu import compute_mandel_numpy
+
+
+def mandel(x, y, max_iters):
+    '''
+    the device function of the CUDA kernels in plain Python
+    '''
+    c = complex(x, y)
+    z = 0.0j
+    for i in range(max_iters):
+        z = z*z + c
+        if (z.real*z.real + z.imag*z.imag) >= 4:
+            return i
+    return max_iters
+
+
+def reference(min_x, max_x, min_y, max_y, image, iters):
+    height, width = image.shape
+    pixel_size_x = (max_x - min_x) / width
+    pixel_size_y = (max_y - min_y) / height
+    for y in range(height):
+        for x in range(width):
+            image[y, x] = mandel(min_x + x * pixel_size_x, min_y + y * pixel_size_y, iters)
+
+
+ENGINES = [compute_mandel_numpy]
+if mandelbrot_cpu.njit is not None:
+    ENGINES.append(mandelbrot_cpu.compute_mandel_numba)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('window', [(-2.0, 1.0, -1.0, 1.0),
+                                    (-0.7530, -0.7490, 0.0990, 0.1030)])
+def test_pixel_identical_to_the_kernel(engine, window):
+    expected = np.zeros((64, 96), dtype=np.int64)
+    reference(*window, expected, 200)
+    image = np.zeros_like(expected)
+    engine(*window, image, 200)
+    np.testing.assert_array_equal(image, expected)
+
+
+def test_engines_agree_on_the_full_image():
+    pytest.importorskip('numba')
+    a = np.zeros((1024, 1536), dtype=np.uint8)
+    b = np.zeros_like(a)
+    compute_mandel_numpy(-2.0, 1.0, -1.0, 1.0, a, 20)
+    mandelbrot_cpu.compute_mandel_numba(-2.0, 1.0, -1.0, 1.0, b, 20)
+    np.testing.assert_array_equal(a, b)
+    assert mandelbrot_cpu.compute_mandel is mandelbrot_cpu.compute_mandel_numba
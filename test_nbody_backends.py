@@ -0,0 +1,65 @@
+"""
+    Tests of the backend registry.
+"""
+import numpy as np
+import pytest
+
+import nbody_ics
+import nbody_backends
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, 0)
+    return r, v, m
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'backends.json')
+    monkeypatch.setattr(nbody_backends, 'CACHE_FILE', path)
+    return path
+
+
+@pytest.mark.parametrize('name', sorted(nbody_backends.BACKENDS))
+def test_backends_agree_with_numpy(name):
+    try:
+        backend = nbody_backends.load(name)
+    except Exception as e:
+        pytest.skip('%s backend not available: %s' % (name, e))
+    numpy = nbody_backends.load('numpy')
+    r, v, m = solar()
+    r2, v2 = r.copy(), v.copy()
+    assert backend.report_energy(r, v, m) == pytest.approx(
+        numpy.report_energy(r, v, m), rel=1e-14)
+    backend.advance(1000, r, v, m, 0.01)
+    numpy.advance(1000, r2, v2, m, 0.01)
+    np.testing.assert_allclose(r, r2, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(v, v2, rtol=1e-9, atol=1e-12)
+    assert backend.report_energy(r, v, m) == pytest.approx(
+        numpy.report_energy(r2, v2, m), rel=1e-12)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        nbody_backends.load('fortran')
+
+
+def test_calibration_stays_within_budget():
+    names, r, v, m = nbody_ics.plummer(512, seed=1)
+    timings = nbody_backends.calibrate(r, v, m, budget=0.05)
+    assert set(timings) == set(nbody_backends.available())
+    assert all(t > 0 for t in timings.values())
+
+
+def test_choice_is_cached(cache_file, monkeypatch):
+    r, v, m = solar()
+    best = nbody_backends.choose(r, v, m)
+    assert best.name in nbody_backends.available()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('calibrated again')
+    monkeypatch.setattr(nbody_backends, 'calibrate', fail)
+    assert nbody_backends.choose(r, v, m) is best
@@ -0,0 +1,60 @@
+"""
+    Tests of the benchmark suite and its regression check.
+"""
+import json
+
+import pytest
+
+import nbody_bench
+from nbody_bench import run_suite, compare, summarize
+
+
+def report(median, iqr=0.0):
+    record = {'case': 'backend:numpy', 'bodies': 64, 'steps': 10}
+    record.update(summarize([median - iqr / 2, median, median + iqr / 2]))
+    return {'machine': {}, 'results': [record]}
+
+
+@pytest.mark.parametrize('median, regressed', [(1.05, False), (1.2, True), (0.5, False)])
+def test_regression_threshold(median, regressed):
+    assert bool(compare(report(median), report(1.0), 0.10)) == regressed
+
+
+def test_noise_widens_the_threshold():
+    assert not compare(report(1.2, iqr=0.4), report(1.0), 0.10)
+
+
+def test_unmatched_cases_are_ignored():
+    baseline = report(1.0)
+    baseline['results'][0]['bodies'] = 5
+    assert compare(report(10.0), baseline) == []
+
+
+def test_suite_records_trials():
+    result = run_suite(['backend:numpy', 'nbody_opt'], bodies=(5, 16), steps=(20,),
+                       repeat=3, log=None)
+    cases = [(r['case'], r['bodies']) for r in result['results']]
+    # the scripts only run the 5 body system
+    assert cases == [('backend:numpy', 5), ('backend:numpy', 16), ('nbody_opt', 5)]
+    for r in result['results']:
+        assert len(r['times']) == 3
+        assert r['min'] <= r['median'] <= r['max']
+    assert result['machine']['python']
+
+
+def test_main_exits_with_status_1_on_regression(tmp_path, capsys):
+    baseline = str(tmp_path / 'base.json')
+    output = str(tmp_path / 'new.json')
+    argv = ['--cases', 'backend:numpy', '--bodies', '32', '--steps', '5',
+            '--repeat', '3', '--output', baseline]
+    assert nbody_bench.main(argv) == 0
+
+    with open(baseline) as f:
+        data = json.load(f)
+    for r in data['results']:
+        r['median'] /= 100
+    with open(baseline, 'w') as f:
+        json.dump(data, f)
+    argv[-1] = output
+    assert nbody_bench.main(argv + ['--baseline', baseline]) == 1
+    assert 'REGRESSION backend:numpy n=32' in capsys.readouterr().out
@@ -0,0 +1,35 @@
+"""
+    Tests of the Barnes-Hut octree backend.
+"""
+import numpy as np
+import pytest
+
+import nbody_ics
+from nbody_numpy import accelerations
+from nbody_bh import Octree, compare_drift
+
+
+@pytest.fixture(scope='module')
+def cloud():
+    names, r, v, m = nbody_ics.plummer(2000, seed=1)
+    return r, m
+
+
+def test_theta_zero_is_the_exact_pair_sum(cloud):
+    r, m = cloud
+    np.testing.assert_allclose(Octree(r, m).accelerations(0.0), accelerations(r, m),
+                               rtol=1e-9, atol=1e-12)
+
+
+def test_error_grows_with_theta(cloud):
+    r, m = cloud
+    exact = accelerations(r, m)
+    scale = np.abs(exact).max()
+    errors = [np.abs(Octree(r, m).accelerations(theta) - exact).max() / scale
+              for theta in (0.3, 0.7)]
+    assert errors[0] < errors[1] < 0.05
+
+
+def test_drift_of_the_planets_close_to_exact():
+    for loop, exact, tree in compare_drift(2, 'sun', 200):
+        assert tree == pytest.approx(exact, rel=1e-6, abs=1e-12)
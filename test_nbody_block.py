@@ -0,0 +1,45 @@
+"""
+    Tests of the hierarchical block timesteps.
+"""
+import numpy as np
+import pytest
+
+import nbody_ics
+from nbody_opt import BODIES
+from nbody_numpy import (bodies_to_arrays, accelerations, report_energy,
+                         offset_momentum)
+from nbody_integrators import INTEGRATORS
+from nbody_block import BlockScheduler, accelerations_on
+
+
+@pytest.mark.parametrize('block', [3, 256])
+def test_accelerations_on_active_bodies(block):
+    names, r, v, m = nbody_ics.plummer(100, seed=6)
+    active = np.arange(1, 100, 3)
+    np.testing.assert_allclose(accelerations_on(active, r, m, block),
+                               accelerations(r, m)[active], rtol=1e-12)
+
+
+def test_single_level_is_velocity_verlet():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, 0)
+    r2, v2 = r.copy(), v.copy()
+    BlockScheduler(r, v, m, 0.01, levels=0).advance(200)
+    leapfrog = INTEGRATORS['leapfrog']()
+    for _ in range(200):
+        leapfrog.step(r2, v2, m, 0.01)
+    np.testing.assert_allclose(r, r2, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(v, v2, rtol=1e-10, atol=1e-14)
+
+
+def test_tight_pair_among_wide_orbits_saves_evaluations():
+    # central mass, one close companion and a disk of far bodies
+    names, r, v, m = nbody_ics.disk(21, seed=7, inner=2.0, outer=5.0)
+    r = np.vstack([r, [[0.05, 0.0, 0.0]]])
+    v = np.vstack([v, [[0.0, np.sqrt(1.0 / 0.05), 0.0]]])
+    m = np.append(m, 1e-6)
+    e0 = report_energy(r, v, m)
+    scheduler = BlockScheduler(r, v, m, dt=0.05, levels=8)
+    scheduler.advance(20)
+    assert scheduler.saved() > 0.5
+    assert abs(report_energy(r, v, m) / e0 - 1) < 1e-4
@@ -0,0 +1,83 @@
+"""
+    Tests of the run cache.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import nbody_cache
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum
+from nbody_cache import RunCache, run, run_key
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, 0)
+    return r, v, m
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RunCache(str(tmp_path / 'runs'))
+
+
+@pytest.mark.parametrize('method', ['kick-drift', 'leapfrog', 'adaptive'])
+def test_resumed_run_is_bit_identical(method, cache, tmp_path):
+    r, v, m = solar()
+    full = run(300, r, v, m, method=method, cache=RunCache(str(tmp_path / 'other')))
+
+    run(120, r, v, m, method=method, cache=cache)
+    resumed = run(300, r, v, m, method=method, cache=cache)
+    assert resumed[3]['resumed_from'] == 120
+    for a, b in zip(resumed[:3], full[:3]):
+        np.testing.assert_array_equal(a, b)
+
+    again = run(300, r, v, m, method=method, cache=cache)
+    assert again[3]['cached']
+    np.testing.assert_array_equal(again[0], full[0])
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_backend_run_matches_the_integrator(cache):
+    r, v, m = solar()
+    a = run(100, r, v, m, cache=cache)
+    b = run(100, r, v, m, backend='numpy', cache=cache)
+    assert a[3]['key'] != b[3]['key']
+    np.testing.assert_allclose(a[0], b[0], rtol=1e-12)
+
+
+def test_key_covers_state_parameters_and_version(monkeypatch):
+    r, v, m = solar()
+    key = run_key(r, v, m)
+    v2 = v.copy()
+    v2[1, 0] = np.nextafter(v2[1, 0], 1.0)
+    assert run_key(r, v2, m) != key
+    assert run_key(r, v, m, dt=0.005) != key
+    assert run_key(r, v, m, method='leapfrog') != key
+    monkeypatch.setattr(nbody_cache, 'CACHE_VERSION', nbody_cache.CACHE_VERSION + 1)
+    assert run_key(r, v, m) != key
+
+
+def test_least_recently_used_snapshots_are_evicted(cache):
+    r, v, m = solar()
+    run(40, r, v, m, every=10, cache=cache)
+    key = run_key(r, v, m)
+    assert cache.steps(key) == [10, 20, 30, 40]
+    size = os.path.getsize(cache._path(key, 10))
+
+    os.utime(cache._path(key, 10), (0, 0))
+    cache.max_bytes = 3 * size
+    cache.evict()
+    assert cache.steps(key) == [20, 30, 40]
+
+
+def test_clear_removes_the_run_directories(cache):
+    r, v, m = solar()
+    run(10, r, v, m, cache=cache)
+    run(10, r, v, m, dt=0.005, cache=cache)
+    assert len(os.listdir(cache.directory)) == 2
+    cache.clear()
+    assert os.listdir(cache.directory) == []
+    assert cache.size() == 0
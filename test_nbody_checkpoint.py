@@ -0,0 +1,77 @@
+"""
+    Tests of the binary checkpoint/restart.
+"""
+import os
+import stat
+
+import numpy as np
+import pytest
+
+import nbody_checkpoint
+from nbody_checkpoint import write_checkpoint, read_checkpoint
+
+
+def energies(output):
+    return [float(line) for line in output.split()]
+
+
+@pytest.mark.parametrize('method', ['kick-drift', 'leapfrog', 'adaptive'])
+def test_restart_is_bit_identical(method, tmp_path, capsys):
+    path = str(tmp_path / 'run.ckpt')
+    nbody_checkpoint.nbody(4, 'sun', 50, path=str(tmp_path / 'full.ckpt'), method=method)
+    full = energies(capsys.readouterr().out)
+
+    nbody_checkpoint.nbody(2, 'sun', 50, path=path, method=method)
+    nbody_checkpoint.nbody(4, 'sun', 50, path=path, method=method)
+    resumed = energies(capsys.readouterr().out)
+    assert resumed == full
+
+    a = read_checkpoint(path)
+    b = read_checkpoint(str(tmp_path / 'full.ckpt'))
+    assert a['step'] == b['step'] == 200
+    assert a['time'] == b['time']
+    np.testing.assert_array_equal(a['r'], b['r'])
+    np.testing.assert_array_equal(a['v'], b['v'])
+
+
+def test_time_is_the_integrated_time(tmp_path, capsys):
+    path = str(tmp_path / 'run.ckpt')
+    nbody_checkpoint.nbody(1, 'sun', 100, path=path, method='adaptive', dt=0.01)
+    state = read_checkpoint(path)
+    # adaptive steps are bounded by dt here, their sum is the run time
+    assert state['time'] == pytest.approx(1.0, rel=1e-12)
+
+
+def test_arrays_round_trip(tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    rng = np.random.default_rng(0)
+    r, v, m = rng.random((7, 3)), rng.random((7, 3)), rng.random(7)
+    extra = {'kr': rng.random((7, 3)), 'dt': np.array([0.5])}
+    write_checkpoint(path, r, v, m, 12, 3.5, 0.25, 'adaptive', extra)
+    for mmap in (True, False):
+        state = read_checkpoint(path, mmap)
+        assert (state['step'], state['time'], state['dt'], state['integrator']) == \
+            (12, 3.5, 0.25, 'adaptive')
+        for name, a in (('r', r), ('v', v), ('m', m)):
+            np.testing.assert_array_equal(state[name], a)
+        np.testing.assert_array_equal(state['extra']['kr'], extra['kr'])
+
+
+@pytest.mark.parametrize('kwargs', [{'extra': {'x' * 17: np.zeros(1)}},
+                                    {'integrator': 'y' * 33}])
+def test_long_names_are_rejected(kwargs, tmp_path):
+    path = tmp_path / 'state.ckpt'
+    with pytest.raises(ValueError):
+        write_checkpoint(str(path), np.zeros((1, 3)), np.zeros((1, 3)), np.ones(1), 0,
+                         **kwargs)
+    assert not os.listdir(tmp_path)
+
+
+def test_file_mode_follows_the_umask(tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    old = os.umask(0o027)
+    try:
+        write_checkpoint(path, np.zeros((1, 3)), np.zeros((1, 3)), np.ones(1), 0)
+    finally:
+        os.umask(old)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
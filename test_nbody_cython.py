@@ -0,0 +1,68 @@
+"""
+    Tests of the Cython engine, needs the built extension:
+
+        python build_cython.py build_ext --inplace
+"""
+import copy
+import time
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+nbody_cython = pytest.importorskip('nbody_cython')
+
+import nbody_ics
+import nbody_numpy
+import nbody_opt
+from nbody_numpy import bodies_to_arrays
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(nbody_opt.BODIES)
+    nbody_numpy.offset_momentum(v, m, 0)
+    return r, v, m
+
+
+def test_pair_array():
+    assert nbody_cython.pair_array(4).tolist() == list(map(list, combinations(range(4), 2)))
+    assert nbody_cython.pair_array(1).shape == (0, 2)
+
+
+@pytest.mark.parametrize('n', [5, nbody_cython.PARALLEL_MIN_BODIES * 2])
+def test_matches_numpy(n):
+    if n == 5:
+        r, v, m = solar()
+        dt = 0.01
+    else:
+        names, r, v, m = nbody_ics.plummer(n, seed=5)
+        dt = 1e-4
+    r2, v2 = r.copy(), v.copy()
+    nbody_cython.advance(50, r, v, m, dt)
+    nbody_numpy.advance(50, r2, v2, m, dt)
+    np.testing.assert_allclose(r, r2, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(v, v2, rtol=1e-10, atol=1e-12)
+    assert nbody_cython.report_energy(r, v, m) == pytest.approx(
+        nbody_numpy.report_energy(r2, v2, m), rel=1e-12)
+
+
+def test_offset_momentum_matches_numpy():
+    names, r, v, m = nbody_ics.plummer(20, seed=3)
+    v += 1.0
+    v2 = v.copy()
+    nbody_cython.offset_momentum(v, m, 4)
+    nbody_numpy.offset_momentum(v2, m, 4)
+    np.testing.assert_allclose(v, v2, rtol=1e-13)
+
+
+def test_faster_than_nbody_opt():
+    bodies = copy.deepcopy(nbody_opt.BODIES)
+    pairs = list(combinations(bodies, 2))
+    start = time.perf_counter()
+    nbody_opt.advance(2000, pairs, bodies, 0.01)
+    python = time.perf_counter() - start
+
+    r, v, m = solar()
+    start = time.perf_counter()
+    nbody_cython.advance(2000, r, v, m, 0.01)
+    assert time.perf_counter() - start < python / 5
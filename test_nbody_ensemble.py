@@ -0,0 +1,41 @@
+"""
+    Tests of the batched ensemble mode.
+"""
+import numpy as np
+import pytest
+
+import nbody_numpy
+import nbody_ensemble
+from nbody_opt import BODIES
+
+
+def test_members_match_separate_numpy_runs():
+    r, v, m = nbody_ensemble.perturb(BODIES, 4, scale=1e-3, seed=0)
+    energies = nbody_ensemble.nbody(2, 'sun', 50, r, v, m)
+    assert energies.shape == (2, 4)
+
+    r0, v0, _ = nbody_ensemble.perturb(BODIES, 4, scale=1e-3, seed=0)
+    for b in range(4):
+        rb, vb = r0[b].copy(), v0[b].copy()
+        nbody_numpy.offset_momentum(vb, m, 0)
+        nbody_numpy.advance(100, rb, vb, m, 0.01)
+        np.testing.assert_allclose(r[b], rb, rtol=1e-12, atol=1e-14)
+        assert energies[-1, b] == pytest.approx(nbody_numpy.report_energy(rb, vb, m),
+                                                rel=1e-12)
+
+
+@pytest.mark.parametrize('pairs', [1, 10, 100, nbody_ensemble.PAIRS])
+def test_chunking_does_not_change_the_result(pairs):
+    rng = np.random.default_rng(1)
+    r, v, m = rng.random((3, 30, 3)), rng.random((3, 30, 3)), rng.random(30)
+    np.testing.assert_allclose(nbody_ensemble.accelerations(r, m, pairs),
+                               nbody_ensemble.accelerations(r, m, 10 ** 9), rtol=1e-13)
+    np.testing.assert_allclose(nbody_ensemble.report_energy(r, v, m, pairs),
+                               nbody_ensemble.report_energy(r, v, m, 10 ** 9), rtol=1e-13)
+
+
+def test_reference_may_be_a_numpy_integer():
+    r, v, m = nbody_ensemble.perturb(BODIES, 2, seed=0)
+    nbody_ensemble.nbody(1, np.int64(0), 1, r, v, m)
+    p = np.einsum('i,bik->bk', m, v)
+    np.testing.assert_allclose(p, 0.0, atol=1e-15)
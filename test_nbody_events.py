@@ -0,0 +1,110 @@
+"""
+    Tests of the event detection and dense output.
+"""
+import numpy as np
+import pytest
+
+import nbody_events
+from nbody_integrators import INTEGRATORS
+from nbody_events import (EventDetector, close_approach, radius_crossing,
+                          conjunction, hermite, run)
+
+
+def kepler(e=0.5):
+    '''
+        test particle around a unit mass on an orbit of semi-major axis 1,
+        starting at apocenter, period 2 pi
+    '''
+    r = np.array([[0.0, 0.0, 0.0], [1.0 + e, 0.0, 0.0]])
+    v = np.array([[0.0, 0.0, 0.0], [0.0, np.sqrt((1.0 - e) / (1.0 + e)), 0.0]])
+    m = np.array([1.0, 1e-12])
+    return r, v, m
+
+
+def test_hermite_matches_the_end_states_and_cubics():
+    t0, t1 = 1.0, 1.5
+    r0, v0 = np.array([1.0]), np.array([2.0])
+    position = lambda t: 1.0 + 2.0 * (t - t0) + 3.0 * (t - t0) ** 3
+    velocity = lambda t: 2.0 + 9.0 * (t - t0) ** 2
+    r1, v1 = np.array([position(t1)]), np.array([velocity(t1)])
+    for t in (t0, 1.2, t1):
+        r, v = hermite(t, t0, r0, v0, t1, r1, v1)
+        assert r[0] == pytest.approx(position(t), rel=1e-14)
+        assert v[0] == pytest.approx(velocity(t), rel=1e-14)
+
+
+def test_close_approach_is_the_pericenter():
+    r, v, m = kepler(0.5)
+    detector = EventDetector([close_approach(0, 1)])
+    run(7000, r, v, m, detector, dt=1e-3)
+    table = detector.table()
+    assert len(table) == 1
+    assert table['time'][0] == pytest.approx(np.pi, rel=1e-3)
+    assert table['value'][0] == pytest.approx(0.5, rel=1e-3)
+    assert table['step'][0] == np.ceil(table['time'][0] / 1e-3)
+
+
+def test_terminal_event_stops_the_run():
+    r, v, m = kepler(0.5)
+    event = radius_crossing(1, 1.0, direction=-1)
+    event.terminal = True
+    detector = EventDetector([event])
+    done, time = run(7000, r, v, m, detector, dt=1e-3)
+    assert done < 7000
+    assert detector.table()['time'][0] <= time
+    assert np.linalg.norm(r[1] - r[0]) < 1.0
+
+
+def test_conjunctions_on_the_same_side_only():
+    # two particles on circular orbits of radius 1 and 2, starting aligned
+    r = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [-2.0, 0.0, 0.0]])
+    v = np.array([[0.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, -np.sqrt(0.5), 0.0]])
+    m = np.array([1.0, 1e-12, 1e-12])
+    detector = EventDetector([conjunction(1, 2)])
+    run(9000, r, v, m, detector, dt=1e-3)
+    table = detector.table()
+    # synodic period 2 pi / (1 - 2 ** -1.5), first conjunction half of it
+    synodic = 2 * np.pi / (1 - 2 ** -1.5)
+    np.testing.assert_allclose(table['time'], [synodic / 2], rtol=1e-3)
+
+
+def test_dense_output_samples():
+    r, v, m = kepler(0.0)
+    states = {0: (r.copy(), v.copy())}
+    r2, v2 = r.copy(), v.copy()
+    integrator = INTEGRATORS['kick-drift']()
+    for step in range(1, 1002):
+        integrator.step(r2, v2, m, 1e-3)
+        states[step] = (r2.copy(), v2.copy())
+
+    times = [0.0, 0.25, 1.0005, 3.0]
+    detector = EventDetector(times=times)
+    run(2000, r, v, m, detector, dt=1e-3)
+    t, rs, vs = detector.samples()
+    np.testing.assert_array_equal(t, times[:3])
+    # on a step boundary the sample is the state of that step
+    np.testing.assert_allclose(rs[1], states[250][0], rtol=1e-14, atol=1e-15)
+    np.testing.assert_allclose(vs[1], states[250][1], rtol=1e-14, atol=1e-15)
+    # halfway through a step it lies between both states
+    np.testing.assert_allclose(rs[2], 0.5 * (states[1000][0] + states[1001][0]), atol=1e-7)
+    np.testing.assert_allclose(vs[2], 0.5 * (states[1000][1] + states[1001][1]), atol=1e-3)
+    np.testing.assert_allclose(rs[2, 1, 0], np.cos(1.0005), atol=1e-3)
+
+
+def test_adding_an_event_restarts_the_detector():
+    r, v, m = kepler()
+    detector = EventDetector([close_approach(0, 1)])
+    assert not detector.started
+    run(10, r, v, m, detector, dt=1e-3)
+    assert detector.started
+    detector.add(radius_crossing(1, 1.0))
+    assert not detector.started
+    run(10, r, v, m, detector, dt=1e-3, start=10, time=0.01)
+    assert detector.started
+
+
+def test_solar_system_events(capsys):
+    names, table = nbody_events.nbody(1, 'sun', 2000)
+    assert names[0] == 'approach 1-2'
+    assert np.all(np.diff(table['time']) >= 0)
+    assert np.all((table['time'] > 0) & (table['time'] <= 20.0))
@@ -0,0 +1,80 @@
+"""
+    Tests of the initial condition loaders and generators.
+"""
+import copy
+
+import numpy as np
+import pytest
+
+import nbody_ics
+import nbody_opt
+from nbody_numpy import bodies_to_arrays, offset_momentum, report_energy
+
+GENERATORS = [nbody_ics.plummer, nbody_ics.uniform_cube, nbody_ics.disk]
+
+
+@pytest.mark.parametrize('generator', GENERATORS)
+def test_generators_return_the_array_state(generator):
+    names, r, v, m = generator(1000, seed=1)
+    assert names is None
+    assert r.shape == v.shape == (1000, 3)
+    assert m.shape == (1000,)
+    assert all(a.dtype == np.float64 and a.flags.c_contiguous for a in (r, v, m))
+    np.testing.assert_allclose(np.dot(m, v), 0.0, atol=1e-15)
+
+
+@pytest.mark.parametrize('generator', GENERATORS)
+def test_generators_are_seeded(generator):
+    a, b = generator(50, seed=3), generator(50, seed=3)
+    for x, y in zip(a[1:], b[1:]):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_plummer_is_bound_and_in_virial_equilibrium():
+    names, r, v, m = nbody_ics.plummer(2000, seed=0)
+    kinetic = 0.5 * np.dot(m, (v * v).sum(axis=1))
+    potential = report_energy(r, v, m) - kinetic
+    assert potential < 0
+    assert -2 * kinetic / potential == pytest.approx(1.0, abs=0.1)
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.json', '.npy'])
+def test_save_load_round_trip(ext, tmp_path):
+    names, r, v, m = bodies_to_arrays(nbody_opt.BODIES)
+    offset_momentum(v, m, names.index('sun'))
+    path = str(tmp_path / ('bodies' + ext))
+    nbody_ics.save(path, r, v, m, names)
+    loaded = nbody_ics.load(path, 'sun' if ext != '.npy' else 0)
+    assert loaded[0] == (None if ext == '.npy' else names)
+    for a, b in zip(loaded[1:], (r, v, m)):
+        np.testing.assert_allclose(a, b, rtol=1e-15, atol=1e-15)
+
+
+def test_loaded_state_matches_nbody_opt_offset(tmp_path):
+    bodies = copy.deepcopy(nbody_opt.BODIES)
+    nbody_opt.offset_momentum(bodies, 'sun')
+    path = str(tmp_path / 'bodies.json')
+    names, r, v, m = bodies_to_arrays(nbody_opt.BODIES)
+    nbody_ics.save(path, r, v, m, names)
+    names, r, v, m = nbody_ics.load(path, 'sun')
+    for i, name in enumerate(names):
+        np.testing.assert_allclose(v[i], bodies[name][1], rtol=1e-14, atol=1e-17)
+
+
+def test_moving_reference_only_changes_its_own_velocity(tmp_path):
+    path = str(tmp_path / 'bodies.json')
+    names, r, v, m = bodies_to_arrays(nbody_opt.BODIES)
+    nbody_ics.save(path, r, v, m, names)
+    loaded = nbody_ics.load(path, 'jupiter')
+    j = names.index('jupiter')
+    np.testing.assert_allclose(np.dot(m, loaded[2]), 0.0, atol=1e-15)
+    np.testing.assert_array_equal(np.delete(loaded[2], j, axis=0), np.delete(v, j, axis=0))
+
+
+def test_named_reference_needs_names(tmp_path):
+    path = str(tmp_path / 'bodies.npy')
+    np.save(path, np.ones((3, 7)))
+    with pytest.raises(ValueError):
+        nbody_ics.load(path, 'sun')
+    with pytest.raises(ValueError):
+        nbody_ics.load(str(tmp_path / 'bodies.txt'))
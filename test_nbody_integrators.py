@@ -0,0 +1,69 @@
+"""
+    Tests of the selectable integrators.
+"""
+import numpy as np
+import pytest
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum
+from nbody_integrators import INTEGRATORS, Adaptive, integrate
+
+DURATION = 2.0
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, names.index('sun'))
+    return r, v, m
+
+
+@pytest.fixture(scope='module')
+def reference():
+    r, v, m = solar()
+    integrate(INTEGRATORS['yoshida4'](), DURATION, r, v, m, 1e-3)
+    return r
+
+
+def error(method, dt, reference):
+    r, v, m = solar()
+    integrate(INTEGRATORS[method](), DURATION, r, v, m, dt)
+    return np.abs(r - reference).max()
+
+
+@pytest.mark.parametrize('method, order', [('kick-drift', 1), ('leapfrog', 2),
+                                           ('yoshida4', 4)])
+def test_convergence_order(method, order, reference):
+    ratio = error(method, 0.02, reference) / error(method, 0.01, reference)
+    assert ratio == pytest.approx(2 ** order, rel=0.2)
+
+
+def test_adaptive_takes_long_steps_at_tolerance(reference):
+    r, v, m = solar()
+    integrator = Adaptive(tol=1e-10)
+    integrate(integrator, DURATION, r, v, m, 0.01)
+    assert np.abs(r - reference).max() < 1e-8
+    # fixed steps of the initial guess would need 7 * 200 evaluations
+    assert integrator.evaluations < 7 * DURATION / 0.01 / 2
+
+
+def test_adaptive_max_dt_bounds_the_step():
+    r, v, m = solar()
+    integrator = Adaptive(tol=1e-6, max_dt=0.05)
+    for _ in range(20):
+        assert integrator.step(r, v, m, 1.0) <= 0.05
+
+
+@pytest.mark.parametrize('method', sorted(INTEGRATORS))
+def test_state_round_trip_continues_bit_identically(method):
+    r, v, m = solar()
+    first = INTEGRATORS[method]()
+    for _ in range(5):
+        first.step(r, v, m, 0.01)
+    second = INTEGRATORS[method]()
+    second.set_state({k: np.array(a) for k, a in first.get_state().items()})
+    r2, v2 = r.copy(), v.copy()
+    for _ in range(5):
+        first.step(r, v, m, 0.01)
+        second.step(r2, v2, m, 0.01)
+    np.testing.assert_array_equal(r, r2)
+    np.testing.assert_array_equal(v, v2)
@@ -0,0 +1,88 @@
+"""
+    Tests of the phase timers and counters.
+"""
+import json
+import os
+import re
+
+import pytest
+
+import nbody_numpy
+from nbody_opt import BODIES
+from nbody_metrics import Metrics, METRICS
+from nbody_checkpoint import write_checkpoint
+
+
+@pytest.fixture
+def metrics():
+    enabled = METRICS.enabled
+    METRICS.reset()
+    METRICS.enable()
+    yield METRICS
+    METRICS.enabled = enabled
+    METRICS.reset()
+
+
+def test_disabled_records_nothing():
+    m = Metrics()
+    with m.phase('force'):
+        m.count('steps', 3)
+    assert m.snapshot()['phases'] == {}
+    assert m.snapshot()['counters'] == {}
+
+
+def test_phases_counters_and_rates():
+    m = Metrics(enabled=True)
+    for seconds in (0.5, 1.5):
+        m.record('step', seconds)
+    m.count('steps', 4)
+    snap = m.snapshot()
+    assert snap['phases']['step'] == {'calls': 2, 'seconds': 2.0, 'max_seconds': 1.5}
+    assert snap['counters'] == {'steps': 4}
+    assert snap['rates'] == {'steps_per_second': 2.0}
+    assert json.loads(m.to_json())['counters'] == {'steps': 4}
+
+
+def test_prometheus_exposition():
+    m = Metrics(enabled=True)
+    m.record('force', 0.25)
+    m.count('pair_interactions', 10)
+    text = m.to_prometheus()
+    assert '# TYPE nbody_phase_seconds_total counter' in text
+    assert 'nbody_phase_seconds_total{phase="force"} 0.25' in text
+    assert 'nbody_pair_interactions_total 10.0' in text
+    assert 'nbody_pair_interactions_per_second 40.0' in text
+    sample = re.compile(r'^nbody_[a-z_]+(\{phase="[a-z]+"\})? \S+$')
+    for line in text.splitlines():
+        assert line.startswith('# ') or sample.match(line)
+
+
+def test_dump_picks_the_format_by_extension(tmp_path):
+    m = Metrics(enabled=True)
+    m.count('steps')
+    m.dump(str(tmp_path / 'run.json'))
+    m.dump(str(tmp_path / 'run.prom'))
+    with open(str(tmp_path / 'run.json')) as f:
+        assert json.load(f)['counters'] == {'steps': 1}
+    with open(str(tmp_path / 'run.prom')) as f:
+        assert 'nbody_steps_total 1.0' in f.read()
+
+
+def test_step_loop_is_instrumented(metrics, capsys):
+    nbody_numpy.nbody(2, 'sun', 50)
+    snap = metrics.snapshot()
+    assert snap['counters']['steps'] == 100
+    assert snap['counters']['force_evaluations'] == 100
+    assert snap['counters']['pair_interactions'] == 100 * 10
+    assert snap['phases']['drift']['calls'] == 100
+    assert snap['phases']['step']['calls'] == 100
+    assert snap['rates']['steps_per_second'] > 0
+
+
+def test_checkpoint_bytes_are_counted(metrics, tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    r, v, m = nbody_numpy.bodies_to_arrays(BODIES)[1:]
+    write_checkpoint(path, r, v, m, 0)
+    snap = metrics.snapshot()
+    assert snap['counters']['bytes_written'] == os.path.getsize(path)
+    assert snap['phases']['io']['calls'] == 1
@@ -0,0 +1,54 @@
+"""
+    Tests of the mixed precision mode.
+"""
+import numpy as np
+import pytest
+
+import nbody_ics
+import nbody_mixed
+from nbody_numpy import accelerations, report_energy
+from nbody_mixed import MixedState, neumaier_add
+
+
+def test_neumaier_add_keeps_the_small_terms():
+    total, comp = np.zeros(1), np.zeros(1)
+    for x in [1e16, 1.0, -1e16, 1.0]:
+        total, comp = neumaier_add(total, comp, np.array([x]))
+    assert total[0] + comp[0] == 2.0
+
+
+@pytest.mark.parametrize('dtype, rtol', [(np.float32, 1e-4), (np.float64, 1e-12)])
+def test_accelerations_and_energy(dtype, rtol):
+    names, r, v, m = nbody_ics.plummer(600, seed=1)
+    state = MixedState(r, v, m, dtype)
+    exact = accelerations(r, m)
+    error = np.abs(state.accelerations(block=100, tile=256) - exact).max()
+    assert error < rtol * np.abs(exact).max()
+    assert state.report_energy() == pytest.approx(report_energy(r, v, m), rel=rtol)
+
+
+def test_numba_engine_matches_numpy_engine():
+    pytest.importorskip('numba')
+    names, r, v, m = nbody_ics.plummer(300, seed=2)
+    for dtype in (np.float32, np.float64):
+        a = MixedState(r, v, m, dtype, 'numba').accelerations()
+        b = MixedState(r, v, m, dtype).accelerations()
+        np.testing.assert_allclose(a, b, rtol=1e-4 if dtype == np.float32 else 1e-12,
+                                   atol=1e-6 * np.abs(b).max())
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        MixedState(np.zeros((2, 3)), np.zeros((2, 3)), np.ones(2), engine='gpu')
+
+
+def test_compensated_drift_of_the_solar_system():
+    # the integrator error dominates, the mixed mode tracks the float64 run
+    for loop, direct, mixed in nbody_mixed.compare_drift(3, 'sun', 2000):
+        assert abs(mixed - direct) < 1e-6
+
+
+def test_float32_is_faster_than_the_float64_layout():
+    timings = nbody_mixed.compare_speed(n=2000, steps=3)
+    assert timings['numpy float32'] < timings['numpy float64']
+    assert timings['numpy float64'] < timings['numpy']
@@ -0,0 +1,83 @@
+"""
+    Tests of the MPI ring-pass engine.
+
+    The single rank tests run in the pytest process, the multi-rank test
+    launches mpiexec.
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('mpi4py')
+
+import nbody_ics
+import nbody_numpy
+import nbody_mpi
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+RANKS_SCRIPT = '''
+import sys
+import numpy as np
+import nbody_mpi
+from nbody_mpi import comm, rank, size
+
+n, r, v, m = nbody_mpi.load_block(sys.argv[1])
+bounds = nbody_mpi.block_bounds(n, size)
+nbody_mpi.offset_momentum(v, m, 0, bounds)
+acc = nbody_mpi.accelerations(r, m, bounds, block=16)
+nbody_mpi.advance(3, r, v, m, bounds, 1e-3)
+e = nbody_mpi.report_energy(r, v, m, bounds, block=16)
+parts = comm.gather((acc, r, v), root=0)
+if rank == 0:
+    np.savez(sys.argv[2], acc=np.concatenate([p[0] for p in parts]),
+             r=np.concatenate([p[1] for p in parts]),
+             v=np.concatenate([p[2] for p in parts]), e=e)
+'''
+
+
+@pytest.fixture
+def cloud():
+    return nbody_ics.plummer(200, seed=5)[1:]
+
+
+def test_single_rank_matches_numpy(cloud):
+    r, v, m = cloud
+    bounds = nbody_mpi.block_bounds(len(m), 1)
+    np.testing.assert_allclose(nbody_mpi.accelerations(r, m, bounds, block=16),
+                               nbody_numpy.accelerations(r, m), rtol=1e-12)
+    assert nbody_mpi.report_energy(r, v, m, bounds, block=16) == pytest.approx(
+        nbody_numpy.report_energy(r, v, m), rel=1e-13)
+
+
+def test_block_bounds_cover_all_bodies():
+    bounds = nbody_mpi.block_bounds(10, 3)
+    assert bounds[0][0] == 0 and bounds[-1][1] == 10
+    assert all(a[1] == b[0] for a, b in zip(bounds, bounds[1:]))
+
+
+@pytest.mark.skipif(shutil.which('mpiexec') is None, reason='needs mpiexec')
+def test_three_ranks_match_numpy(cloud, tmp_path):
+    r, v, m = cloud
+    table = tmp_path / 'bodies.npy'
+    np.save(table, np.column_stack([r, v, m]))
+    out = tmp_path / 'out.npz'
+    env = dict(os.environ, PYTHONPATH=HERE, OMPI_ALLOW_RUN_AS_ROOT='1',
+               OMPI_ALLOW_RUN_AS_ROOT_CONFIRM='1',
+               OMPI_MCA_rmaps_base_oversubscribe='1')
+    subprocess.run(['mpiexec', '-n', '3', sys.executable, '-c', RANKS_SCRIPT,
+                    str(table), str(out)], env=env, check=True, timeout=300)
+    result = np.load(out)
+
+    nbody_numpy.offset_momentum(v, m, 0)
+    np.testing.assert_allclose(result['acc'], nbody_numpy.accelerations(r, m),
+                               rtol=1e-12)
+    nbody_numpy.advance(3, r, v, m, 1e-3)
+    np.testing.assert_allclose(result['r'], r, rtol=1e-12)
+    np.testing.assert_allclose(result['v'], v, rtol=1e-10)
+    assert float(result['e']) == pytest.approx(nbody_numpy.report_energy(r, v, m),
+                                               rel=1e-12)
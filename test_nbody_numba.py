@@ -0,0 +1,63 @@
+"""
+    Tests of the Numba engine.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+import nbody_ics
+import nbody_numpy
+import nbody_numba
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    nbody_numpy.offset_momentum(v, m, 0)
+    return r, v, m
+
+
+@pytest.mark.parametrize('kernel', [nbody_numba.advance_pairs, nbody_numba.advance_parallel])
+def test_kernels_match_numpy(kernel):
+    r, v, m = solar()
+    r2, v2 = r.copy(), v.copy()
+    for _ in range(5):
+        kernel(200, r, v, m, 0.01)
+        nbody_numpy.advance(200, r2, v2, m, 0.01)
+        assert nbody_numba.report_energy(r, v, m) == pytest.approx(
+            nbody_numpy.report_energy(r2, v2, m), rel=1e-12)
+    np.testing.assert_allclose(r, r2, rtol=1e-10, atol=1e-12)
+
+
+def test_parallel_kernel_on_many_bodies():
+    names, r, v, m = nbody_ics.plummer(nbody_numba.PARALLEL_MIN_BODIES * 2, seed=2)
+    r2, v2 = r.copy(), v.copy()
+    nbody_numba.advance(3, r, v, m, 1e-4)
+    nbody_numpy.advance(3, r2, v2, m, 1e-4)
+    np.testing.assert_allclose(v, v2, rtol=1e-10, atol=1e-12)
+
+
+def test_offset_momentum_matches_numpy():
+    names, r, v, m = nbody_ics.plummer(20, seed=3)
+    v += 1.0
+    v2 = v.copy()
+    nbody_numba.offset_momentum(v, m, 4)
+    nbody_numpy.offset_momentum(v2, m, 4)
+    np.testing.assert_allclose(v, v2, rtol=1e-13)
+
+
+def test_vec_deltas():
+    x, y = np.arange(5.0), np.ones(5)
+    np.testing.assert_array_equal(nbody_numba.vec_deltas(x, y), x - y)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_mixed_accelerations(dtype):
+    names, r, v, m = nbody_ics.plummer(50, seed=4)
+    acc = np.zeros_like(r)
+    nbody_numba.mixed_accelerations(np.ascontiguousarray(r.T, dtype=dtype),
+                                    m.astype(dtype), acc)
+    rtol = 1e-4 if dtype == np.float32 else 1e-12
+    np.testing.assert_allclose(acc, nbody_numpy.accelerations(r, m), rtol=rtol, atol=rtol)
@@ -0,0 +1,111 @@
+"""
+    Tests of the structure-of-arrays numpy engine.
+"""
+import copy
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+import nbody_opt
+import nbody_numpy
+from nbody_numpy import (bodies_to_arrays, arrays_to_bodies, accelerations,
+                         advance, report_energy, offset_momentum)
+
+
+def direct_accelerations(r, m):
+    '''
+        plain double loop over all pairs
+    '''
+    acc = np.zeros_like(r)
+    for i in range(len(m)):
+        for j in range(len(m)):
+            if i != j:
+                d = r[i] - r[j]
+                acc[i] -= m[j] * d / np.dot(d, d) ** 1.5
+    return acc
+
+
+def random_state(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n, 3)), 0.01 * rng.standard_normal((n, 3)), rng.random(n) / n
+
+
+def test_energies_match_nbody_opt():
+    bodies = copy.deepcopy(nbody_opt.BODIES)
+    pairs = list(combinations(bodies, 2))
+    nbody_opt.offset_momentum(bodies, 'sun')
+
+    names, r, v, m = bodies_to_arrays(nbody_opt.BODIES)
+    offset_momentum(v, m, names.index('sun'))
+
+    assert report_energy(r, v, m) == pytest.approx(
+        nbody_opt.report_energy(bodies, pairs), rel=1e-14)
+    for _ in range(3):
+        nbody_opt.advance(500, pairs, bodies, 0.01)
+        advance(500, r, v, m, 0.01)
+        assert report_energy(r, v, m) == pytest.approx(
+            nbody_opt.report_energy(bodies, pairs), rel=1e-12)
+
+
+def test_round_trip_through_bodies():
+    names, r, v, m = bodies_to_arrays(nbody_opt.BODIES)
+    again = bodies_to_arrays(arrays_to_bodies(names, r, v, m))
+    assert again[0] == names
+    for a, b in zip(again[1:], (r, v, m)):
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('block', [1, 7, nbody_numpy.BLOCK])
+def test_blocked_accelerations_match_pair_loop(block):
+    r, v, m = random_state(40)
+    np.testing.assert_allclose(accelerations(r, m, block), direct_accelerations(r, m),
+                               rtol=1e-12)
+
+
+def test_offset_momentum_zeroes_momentum_of_moving_reference():
+    r, v, m = random_state(10)
+    offset_momentum(v, m, 3)
+    np.testing.assert_allclose(np.dot(m, v), 0.0, atol=1e-16)
+
+
+@pytest.fixture
+def metrics():
+    from nbody_metrics import METRICS
+    enabled = METRICS.enabled
+    METRICS.reset()
+    METRICS.enable()
+    yield METRICS
+    METRICS.enabled = enabled
+    METRICS.reset()
+
+
+def test_fused_diagnostics_match_separate_passes():
+    r, v, m = random_state(300)
+    acc, record = advance(3, r, v, m, 1e-3, fused=True)
+    np.testing.assert_allclose(acc, accelerations(r, m), rtol=1e-12)
+    assert record['energy'] == pytest.approx(report_energy(r, v, m), rel=1e-12)
+    assert record['potential'] == pytest.approx(nbody_numpy.potential_energy(r, m),
+                                                rel=1e-12)
+    np.testing.assert_allclose(record['momentum'], np.dot(m, v), rtol=1e-12)
+    np.testing.assert_allclose(record['angular_momentum'],
+                               np.cross(r, m[:, None] * v).sum(axis=0), rtol=1e-12)
+
+
+def test_fused_forces_are_reused(capsys):
+    nbody_numpy.nbody(3, 'sun', 100, fused=True)
+    fused = [float(e) for e in capsys.readouterr().out.split()]
+    nbody_numpy.nbody(3, 'sun', 100)
+    separate = [float(e) for e in capsys.readouterr().out.split()]
+    assert fused == pytest.approx(separate, rel=1e-13)
+
+
+def test_fused_pass_is_timed_and_counted_as_a_force_evaluation(metrics):
+    r, v, m = random_state(50)
+    acc, record = advance(10, r, v, m, 1e-3, fused=True)
+    advance(10, r, v, m, 1e-3, acc, fused=True)
+    snap = metrics.snapshot()
+    assert snap['counters']['force_evaluations'] == 21
+    assert snap['phases']['force']['calls'] == 21
+    assert snap['counters']['pair_interactions'] == 21 * 50 * 49 // 2
+    assert snap['phases']['diagnostics']['calls'] == 2
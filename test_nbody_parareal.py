@@ -0,0 +1,61 @@
+"""
+    Tests of the Parareal time slicing.
+"""
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import nbody_numpy
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum
+from nbody_parareal import Parareal
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, 0)
+    return r, v, m
+
+
+def sequential(slices, steps, r, v, m, dt=0.01):
+    r, v = r.copy(), v.copy()
+    states = [(r.copy(), v.copy())]
+    for _ in range(slices):
+        nbody_numpy.advance(steps, r, v, m, dt)
+        states.append((r.copy(), v.copy()))
+    return states
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with multiprocessing.Pool(2) as pool:
+        yield pool
+
+
+def test_zero_tolerance_gives_the_sequential_result(pool):
+    r, v, m = solar()
+    solver = Parareal(4, 50, tol=0.0)
+    states = solver.run(r, v, m, pool)
+    assert solver.iterations == 4
+    for (a, b), (c, d) in zip(states, sequential(4, 50, r, v, m)):
+        np.testing.assert_array_equal(a, c)
+        np.testing.assert_array_equal(b, d)
+
+
+def test_converges_in_fewer_iterations_than_slices(pool):
+    r, v, m = solar()
+    solver = Parareal(8, 100, coarse=2, tol=1e-8)
+    states = solver.run(r, v, m, pool)
+    assert solver.iterations < 8
+    assert solver.changes[-1] < 1e-8
+    exact = sequential(8, 100, r, v, m)[-1]
+    np.testing.assert_allclose(states[-1][0], exact[0], rtol=1e-6, atol=1e-8)
+
+
+def test_nbody_prints_one_energy_per_slice(capsys):
+    from nbody_parareal import nbody
+    nbody(3, 'sun', 50, tol=0.0, workers=1)
+    energies = [float(e) for e in capsys.readouterr().out.split()]
+    nbody_numpy.nbody(3, 'sun', 50)
+    assert energies == [float(e) for e in capsys.readouterr().out.split()]
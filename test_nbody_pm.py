@@ -0,0 +1,51 @@
+"""
+    Tests of the particle-mesh solver.
+"""
+import numpy as np
+import pytest
+
+import nbody_ics
+from nbody_pm import ParticleMesh
+
+
+@pytest.fixture
+def cloud():
+    return nbody_ics.plummer(1000, seed=2)[1:]
+
+
+def test_isolated_force_of_distant_bodies_is_newtonian():
+    # two bodies many cells apart
+    r = np.array([[0.0, 0.0, 0.0], [1.0, 0.3, -0.2]])
+    m = np.array([1.0, 1e-3])
+    acc = ParticleMesh(64).accelerations(r, m)
+    d = r[1] - r[0]
+    exact = -m[0] * d / np.dot(d, d) ** 1.5
+    np.testing.assert_allclose(acc[1], exact, rtol=0.05)
+
+
+def test_green_function_cached_once_per_shape(cloud):
+    r, v, m = cloud
+    mesh = ParticleMesh(16)
+    mesh.advance(3, r, v, m, 1e-3)
+    assert list(mesh._green) == [mesh.shape]
+    kernel = mesh._green[mesh.shape]
+    np.testing.assert_allclose(mesh._green_function(0.5), 2 * kernel)
+
+
+def test_energy_reuses_the_force_solve(cloud, monkeypatch):
+    r, v, m = cloud
+    mesh = ParticleMesh(16)
+    mesh.accelerations(r, m)
+    calls = []
+    monkeypatch.setattr(mesh, 'potential', lambda *a: calls.append(a))
+    e = mesh.report_energy(r, v, m)
+    assert not calls
+    assert e == pytest.approx(ParticleMesh(16).report_energy(r, v, m), rel=1e-14)
+
+
+def test_periodic_box_keeps_bodies_inside(cloud):
+    r, v, m = cloud
+    r = r % 4.0
+    mesh = ParticleMesh(16, box=4.0)
+    mesh.advance(5, r, v, m, 1e-2)
+    assert ((r >= 0) & (r < 4.0)).all()
@@ -0,0 +1,99 @@
+"""
+    Tests of the local job server.
+"""
+import asyncio
+import json
+import os
+import signal
+
+import pytest
+
+import nbody_backends
+from nbody_server import JobServer
+
+LONG = {'iterations': 10 ** 8, 'loops': 1}
+
+
+def serve(tmp_path, client, workers=1):
+    '''
+        run client(server, call) against a fresh server, call(message)
+        returns the reply messages of one request
+    '''
+    async def main():
+        server = JobServer(str(tmp_path / 's'), workers, backends=('numpy',))
+        await server.start()
+
+        async def call(message):
+            reader, writer = await asyncio.open_unix_connection(server.path)
+            writer.write(json.dumps(message).encode() + b'\n')
+            writer.write_eof()
+            replies = [json.loads(line) async for line in reader]
+            writer.close()
+            return replies
+
+        try:
+            return await asyncio.wait_for(client(server, call), 60)
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+
+async def running(job):
+    while job.state == 'queued':
+        await asyncio.sleep(0.01)
+
+
+def test_streamed_energies_match_the_backend(tmp_path, capsys):
+    async def client(server, call):
+        return await call({'op': 'submit', 'stream': True, 'loops': 3,
+                           'iterations': 200})
+    replies = serve(tmp_path, client)
+    assert [r['state'] for r in replies if 'state' in r] == ['queued', 'running', 'done']
+
+    nbody_backends.nbody(3, 'sun', 200, backend='numpy')
+    expected = [float(e) for e in capsys.readouterr().out.split()]
+    assert [r['energy'] for r in replies if 'energy' in r] == expected
+
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    async def client(server, call):
+        first = server.submit(LONG)
+        second = server.submit(LONG)
+        await running(first)
+        assert second.state == 'queued'
+        await call({'op': 'cancel', 'job': second.id})
+        await call({'op': 'cancel', 'job': first.id})
+        replies = await call({'op': 'watch', 'job': first.id})
+        after = await call({'op': 'submit', 'stream': True, 'iterations': 10})
+        return first, second, replies, after
+    first, second, replies, after = serve(tmp_path, client)
+    assert (first.state, second.state) == ('cancelled', 'cancelled')
+    assert second.started is None
+    assert replies[-1]['state'] == 'cancelled'
+    assert after[-1]['state'] == 'done'
+
+
+def test_dead_worker_fails_its_job_and_is_replaced(tmp_path):
+    async def client(server, call):
+        job = server.submit(LONG)
+        await running(job)
+        pid = server.workers[0].process.pid
+        os.kill(pid, signal.SIGKILL)
+        replies = await call({'op': 'watch', 'job': job.id})
+        after = await call({'op': 'submit', 'stream': True, 'iterations': 10})
+        return job, pid, server.workers[0].process.pid, replies, after
+    job, pid, new_pid, replies, after = serve(tmp_path, client)
+    assert job.state == 'failed'
+    assert replies[-1]['error'] == 'worker exited with code -9'
+    assert new_pid != pid
+    assert after[-1]['state'] == 'done'
+
+
+def test_bad_requests_get_an_error(tmp_path):
+    async def client(server, call):
+        return (await call({'op': 'reboot'}), await call({'op': 'status', 'job': 7}),
+                await call({'op': 'status'}))
+    unknown, missing, status = serve(tmp_path, client)
+    assert 'unknown op' in unknown[0]['error']
+    assert missing[0]['error'].startswith('KeyError')
+    assert status == [{'jobs': []}]
@@ -0,0 +1,65 @@
+"""
+    Tests of the shared-memory multi-process engine.
+"""
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+import nbody_ics
+import nbody_numpy
+from nbody_shm import SharedMemoryEngine, _row_ranges
+
+
+@pytest.fixture
+def cloud():
+    return nbody_ics.plummer(300, seed=4)[1:]
+
+
+def test_row_ranges_cover_all_rows_with_balanced_pairs():
+    n = 1000
+    ranges = _row_ranges(n, 4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == n
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    pairs = [sum(n - 1 - i for i in range(first, last)) for first, last in ranges]
+    assert max(pairs) - min(pairs) < n
+
+
+def test_matches_numpy_engine(cloud):
+    r, v, m = cloud
+    with SharedMemoryEngine(r, v, m, workers=2) as engine:
+        engine.advance(5, 1e-3)
+        r_shm, v_shm = engine.r.copy(), engine.v.copy()
+    nbody_numpy.advance(5, r, v, m, 1e-3)
+    np.testing.assert_allclose(r_shm, r, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(v_shm, v, rtol=1e-10, atol=1e-13)
+
+
+def test_dead_worker_raises_and_close_is_idempotent(cloud):
+    r, v, m = cloud
+    engine = SharedMemoryEngine(r, v, m, workers=2, timeout=10)
+    engine.advance(1, 1e-3)
+    os.kill(engine._procs[1].pid, signal.SIGKILL)
+    engine._procs[1].join()
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='worker died'):
+        engine.advance(1, 1e-3)
+    assert time.monotonic() - start < 5
+    engine.close()
+    engine.close()
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason='needs several cores')
+def test_workers_speed_up_the_force_evaluation():
+    r, v, m = nbody_ics.plummer(3000, seed=4)[1:]
+    times = []
+    for workers in (1, min(os.cpu_count(), 4)):
+        with SharedMemoryEngine(r, v, m, workers) as engine:
+            engine.accelerations()
+            start = time.perf_counter()
+            for _ in range(3):
+                engine.accelerations()
+            times.append(time.perf_counter() - start)
+    assert times[1] < 0.8 * times[0]
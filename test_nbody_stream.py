@@ -0,0 +1,44 @@
+"""
+    Tests of the streaming trajectory output.
+"""
+import numpy as np
+
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum
+from nbody_stream import TrajectoryWriter, trajectory, read_trajectory
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, 0)
+    return r, v, m
+
+
+def test_file_holds_the_yielded_snapshots(tmp_path):
+    path = str(tmp_path / 'run.traj')
+    r, v, m = solar()
+    kept = []
+    with TrajectoryWriter(path, len(m), chunk=7, decimate=2) as writer:
+        for step, time, rs, vs in trajectory(r, v, m, 300, every=10):
+            writer.write(step, time, rs, vs)
+            kept.append((step, time, rs.copy(), vs.copy()))
+    kept = kept[::2]
+
+    chunks = list(read_trajectory(path))
+    assert [len(c[0]) for c in chunks] == [7, 7, 1]
+    steps, times, rs, vs = (np.concatenate(a) for a in zip(*chunks))
+    np.testing.assert_array_equal(steps, [k[0] for k in kept])
+    np.testing.assert_array_equal(times, [k[1] for k in kept])
+    np.testing.assert_array_equal(rs, [k[2] for k in kept])
+    np.testing.assert_array_equal(vs, [k[3] for k in kept])
+
+
+def test_memory_is_bounded_by_the_buffer_pool(tmp_path):
+    r, v, m = solar()
+    seen = set()
+    with TrajectoryWriter(str(tmp_path / 'run.traj'), len(m), chunk=4, buffers=2) as writer:
+        for snapshot in trajectory(r, v, m, 400):
+            writer.write(*snapshot)
+            seen.add(id(writer._current))
+    assert len(seen) == 2
+    assert sum(len(c[0]) for c in read_trajectory(str(tmp_path / 'run.traj'))) == 400
@@ -0,0 +1,53 @@
+"""
+    Tests of the parameter sweeps.
+"""
+import pytest
+
+import nbody_backends
+import nbody_sweep
+from nbody_sweep import grid, point_key, run_point, run_sweep, read_results
+
+
+def test_grid_is_the_cartesian_product():
+    points = grid(dt=[0.01, 0.005], seed=[0, 1, 2])
+    assert len(points) == 6
+    assert len(set(map(point_key, points))) == 6
+    assert all(p['reference'] == 'sun' for p in points)
+    with pytest.raises(ValueError):
+        grid(step=[1])
+
+
+def test_point_matches_the_backend(capsys):
+    row = run_point(dict(nbody_sweep.DEFAULTS, iterations=200))
+    assert row['error'] is None
+    nbody_backends.nbody(1, 'sun', 200, backend='numpy')
+    assert row['energy'] == float(capsys.readouterr().out)
+    assert row['drift'] == abs((row['energy'] - row['energy0']) / row['energy0'])
+
+
+def test_failed_points_report_the_error():
+    row = run_point(dict(nbody_sweep.DEFAULTS, ics='galaxy'))
+    assert 'unknown initial conditions' in row['error']
+
+
+def test_resume_skips_finished_points(tmp_path):
+    path = str(tmp_path / 'sweep.csv')
+    points = grid(dt=[0.01, 0.005], iterations=[50])
+    assert run_sweep(points[:1], path, workers=1) == 1
+    rows = read_results(path)
+    assert run_sweep(points, path, workers=1) == 1
+    again = read_results(path)
+    assert set(again) == set(map(point_key, points))
+    key = point_key(points[0])
+    assert again[key] == rows[key]
+
+    assert run_sweep(points, path, workers=1) == 0
+    assert run_sweep(points, path, workers=1, resume=False) == 2
+
+
+def test_failed_rows_run_again(tmp_path):
+    path = str(tmp_path / 'sweep.csv')
+    points = grid(ics=['solar', 'galaxy'], iterations=[20])
+    assert run_sweep(points, path, workers=1) == 2
+    assert run_sweep(points, path, workers=1) == 1
+    assert len(read_results(path)) == 2
@@ -0,0 +1,50 @@
+"""
+    Tests of the Wisdom-Holman mapping.
+"""
+import numpy as np
+import pytest
+
+import nbody_numpy
+from nbody_opt import BODIES
+from nbody_numpy import bodies_to_arrays, offset_momentum, report_energy
+from nbody_wh import WisdomHolman, kepler_drift
+
+
+def solar():
+    names, r, v, m = bodies_to_arrays(BODIES)
+    offset_momentum(v, m, 0)
+    return r, v, m
+
+
+@pytest.mark.parametrize('e', [0.0, 0.5, 0.9])
+def test_kepler_drift_closes_the_orbit_after_one_period(e):
+    mu, a = 4 * np.pi ** 2, 1.0
+    r = np.array([[a * (1 - e), 0.0, 0.0]])
+    v = np.array([[0.0, np.sqrt(mu / a * (1 + e) / (1 - e)), 0.0]])
+    r0, v0 = r.copy(), v.copy()
+    period = 2 * np.pi * np.sqrt(a ** 3 / mu)
+    for _ in range(10):
+        kepler_drift(r, v, mu, period / 10)
+    np.testing.assert_allclose(r, r0, atol=1e-10)
+    np.testing.assert_allclose(v, v0, atol=1e-9)
+
+
+def test_coordinates_round_trip():
+    r, v, m = solar()
+    r2, v2, m2 = WisdomHolman(r, v, m, 0).to_arrays()
+    np.testing.assert_allclose(r2, r, atol=1e-14)
+    np.testing.assert_allclose(v2, v, atol=1e-14)
+    np.testing.assert_array_equal(m2, m)
+
+
+def test_long_steps_beat_kick_drift_over_the_same_time():
+    r, v, m = solar()
+    e0 = report_energy(r, v, m)
+    system = WisdomHolman(r, v, m, 0)
+    system.advance(400, 0.5)
+    wh = abs(system.report_energy() / e0 - 1)
+
+    nbody_numpy.advance(20000, r, v, m, 0.01)
+    direct = abs(report_energy(r, v, m) / e0 - 1)
+    assert wh < 1e-5
+    assert wh < direct / 10